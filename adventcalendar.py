@@ -0,0 +1,250 @@
+"""
+Точка входа с командами:
+
+    python -m adventcalendar run [polling|webhook]   # бот (SHARDS > 1 — с шардами)
+    python -m adventcalendar migrate [--db file]     # миграции схемы БД
+    python -m adventcalendar validate [path]         # проверка days.yaml
+    python -m adventcalendar warmup                  # загрузка медиа заранее
+    python -m adventcalendar media                   # варианты медиа и сэкономленные байты
+    python -m adventcalendar bench [bot|sharding|startup] [аргументы бенчмарка]
+    python -m adventcalendar export [users|letters|beagle_photos] [--format csv|jsonl] [--out file]
+    python -m adventcalendar funnel [--check|--fix]  # воронка; проверка счётчиков по users
+
+Тяжёлое (aiogram, bot.py с его Dispatcher и контентом) импортируется только командами,
+которым оно нужно: migrate, validate, export и funnel работают без aiogram и без BOT_TOKEN.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+from typing import List, Optional
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# что выгружает export: таблица и порядок строк
+EXPORTS = {
+    "users": "SELECT * FROM users ORDER BY user_id",
+    "letters": "SELECT * FROM letters ORDER BY id",
+    "beagle_photos": "SELECT * FROM beagle_photos ORDER BY id",
+}
+BENCHMARKS = {
+    "bot": "bench_bot.py",
+    "sharding": "bench_sharding.py",
+    "startup": "bench_startup.py",
+}
+
+
+def _env():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def cmd_run(args) -> int:
+    import bot
+    bot.run(args.mode or bot.RUN_MODE)
+    return 0
+
+
+def cmd_migrate(args) -> int:
+    import asyncio
+    from zoneinfo import ZoneInfo
+
+    import schema
+    from content import REQUIRED_STEPS, load_content
+    from storage import ConnectionPool
+
+    db_path = args.db or os.getenv("DB_PATH", "advent.sqlite")
+    # те же переменные и значения по умолчанию, что в bot.py
+    unlock_at = schema.next_unlock_time(
+        ZoneInfo(os.getenv("TZ", "Europe/Minsk")),
+        int(os.getenv("UNLOCK_HOUR", "10")),
+        int(os.getenv("UNLOCK_MINUTE", "0")),
+    )
+    ctx = schema.MigrationContext(
+        content=load_content(os.getenv("CONTENT_PATH", "days.yaml"), REQUIRED_STEPS),
+        next_unlock_at=int(unlock_at.timestamp()),
+    )
+
+    async def go() -> int:
+        pool = ConnectionPool(db_path, size=1)
+        await pool.open()
+        try:
+            return await schema.db_init(pool, ctx)
+        finally:
+            await pool.close()
+
+    version = asyncio.run(go())
+    print(f"{db_path}: схема версии {version}")
+    return 0
+
+
+def cmd_validate(args) -> int:
+    from content import REQUIRED_STEPS, ContentError, load_content
+
+    path = args.path or os.getenv("CONTENT_PATH", "days.yaml")
+    try:
+        content = load_content(path, REQUIRED_STEPS)
+    except ContentError as err:
+        print(f"{err.path}: ошибок {len(err.errors)}", file=sys.stderr)
+        for error in err.errors:
+            print(f"  - {error}", file=sys.stderr)
+        return 1
+    steps = sum(len(day.get("steps") or ()) for day in content.values())
+    print(f"{path}: OK, дней {len(content)}, шагов {steps}")
+    return 0
+
+
+def cmd_warmup(_args) -> int:
+    import asyncio
+
+    import bot
+    asyncio.run(bot.warmup_main())
+    return 0
+
+
+def cmd_media(_args) -> int:
+    import bot
+    from media_variants import format_report
+    from warmup import collect_media
+
+    items = collect_media(bot.CONTENT, extra=[bot.PROGRESS_PHOTO_META])
+    print(format_report(bot.media_variants.build((item["file"], item["type"]) for item in items)))
+    return 0
+
+
+def cmd_bench(args) -> int:
+    # отдельным процессом: бенчмарк шардов запускает spawn-процессы от своего __main__
+    path = os.path.join(ROOT, "benchmarks", BENCHMARKS[args.name])
+    return subprocess.call([sys.executable, path] + args.args)
+
+
+def cmd_export(args) -> int:
+    """
+    Выгрузка таблицы users, letters (ответы письма, в том числе ещё не ушедшие в дайджест)
+    или beagle_photos (присланные фото бигля).
+    Строки пишутся по мере чтения курсора, без загрузки таблицы в память. Шаги и режимы,
+    ещё не сброшенные запущенным ботом из памяти (USER_CACHE_FLUSH_MS), попадут в следующую выгрузку.
+    """
+    db_path = args.db or os.getenv("DB_PATH", "advent.sqlite")
+    if not os.path.isfile(db_path):
+        print(f"{db_path}: базы нет", file=sys.stderr)
+        return 1
+    # только чтение: бот может работать параллельно (WAL)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        try:
+            cur = conn.execute(EXPORTS[args.table])
+        except sqlite3.OperationalError as err:
+            print(f"{db_path}: {err}", file=sys.stderr)
+            return 1
+        columns = [d[0] for d in cur.description]
+        out = open(args.out, "w", encoding="utf-8", newline="") if args.out else sys.stdout
+        try:
+            if args.format == "jsonl":
+                for row in cur:
+                    out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+            else:
+                writer = csv.writer(out)
+                writer.writerow(columns)
+                writer.writerows(cur)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    finally:
+        conn.close()
+    return 0
+
+
+def cmd_funnel(args) -> int:
+    import asyncio
+
+    import funnel
+    from storage import ConnectionPool
+
+    db_path = args.db or os.getenv("DB_PATH", "advent.sqlite")
+    if not os.path.isfile(db_path):
+        # ConnectionPool создал бы пустую базу на этом месте
+        print(f"{db_path}: базы нет", file=sys.stderr)
+        return 1
+
+    async def go() -> int:
+        pool = ConnectionPool(db_path, size=1)
+        await pool.open()
+        try:
+            if not (args.check or args.fix):
+                async with pool.acquire() as db:
+                    print(funnel.format_funnel(await funnel.read_counters(db)))
+                return 0
+            # BEGIN IMMEDIATE до подсчёта: запись в users ждёт COMMIT, счётчики и users сравниваются на одном снимке
+            async with pool.transaction() as db:
+                stored = await funnel.read_counters(db)
+                actual = await funnel.rebuild(db) if args.fix else await funnel.count_from_scratch(db)
+        finally:
+            await pool.close()
+        mismatches = funnel.diff(stored, actual)
+        for metric, key, was, real in mismatches:
+            print(f"{metric} {key}: было {was}, на самом деле {real}")
+        print(f"расхождений: {len(mismatches)}" + (" (исправлено)" if args.fix and mismatches else ""))
+        return 1 if mismatches and not args.fix else 0
+
+    try:
+        return asyncio.run(go())
+    except sqlite3.OperationalError as err:
+        # например, база до миграции v4 (python -m adventcalendar migrate)
+        print(f"{db_path}: {err}", file=sys.stderr)
+        return 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="adventcalendar", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="запустить бота")
+    p.add_argument("mode", nargs="?", choices=("polling", "webhook"), help="по умолчанию RUN_MODE")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("migrate", help="применить миграции БД")
+    p.add_argument("--db", help="по умолчанию DB_PATH")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("validate", help="проверить контент")
+    p.add_argument("path", nargs="?", help="по умолчанию CONTENT_PATH")
+    p.set_defaults(func=cmd_validate)
+
+    sub.add_parser("warmup", help="загрузить медиа и сохранить file_id").set_defaults(func=cmd_warmup)
+    sub.add_parser("media", help="собрать варианты медиа").set_defaults(func=cmd_media)
+
+    p = sub.add_parser("bench", help="запустить бенчмарк из benchmarks/")
+    p.add_argument("name", nargs="?", choices=tuple(BENCHMARKS), default="bot")
+    p.add_argument("args", nargs=argparse.REMAINDER, help="аргументы самого бенчмарка")
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser("export", help="выгрузить пользователей, ответы письма или фото бигля")
+    p.add_argument("table", nargs="?", choices=tuple(EXPORTS), default="users")
+    p.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    p.add_argument("--out", help="файл (по умолчанию stdout)")
+    p.add_argument("--db", help="по умолчанию DB_PATH")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("funnel", help="воронка по счётчикам")
+    group = p.add_mutually_exclusive_group()
+    group.add_argument("--check", action="store_true", help="пересчитать по users и показать расхождения")
+    group.add_argument("--fix", action="store_true", help="пересчитать и записать")
+    p.add_argument("--db", help="по умолчанию DB_PATH")
+    p.set_defaults(func=cmd_funnel)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    _env()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
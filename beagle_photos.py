@@ -0,0 +1,161 @@
+import asyncio
+import html
+import itertools
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from scheduler import Sleep, run_periodic
+from storage import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS beagle_photos (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id INTEGER NOT NULL,
+      user_name TEXT NOT NULL DEFAULT '',
+      file_id TEXT NOT NULL,
+      created_at INTEGER NOT NULL,
+      forwarded_at INTEGER,            -- NULL: ещё не ушло админу
+      attempts INTEGER NOT NULL DEFAULT 0  -- сколько раз Telegram отклонил сам файл
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_beagle_photos_pending ON beagle_photos(id) WHERE forwarded_at IS NULL",
+)
+
+# sendMediaGroup принимает от 2 до 10 элементов; одиночное фото уходит через sendPhoto
+ALBUM_SIZE = 10
+MAX_CAPTION_CHARS = 1024
+# после стольких отказов (PhotoRejected) фото пропускается, чтобы не держать очередь
+MAX_ATTEMPTS = 3
+# пауза перед следующей отправкой после отказа: фото отказавшего альбома уходят по одному
+REJECT_PAUSE = 3.0
+
+# части описаний ошибок 400, которые говорят о самом файле, а не о чате или правах бота
+_FILE_ERRORS = (
+    "wrong file",
+    "file identifier",
+    "file of type",
+    "wrong type of the web page content",
+    "failed to get http url content",
+    "photo_invalid",
+    "photo_ext_invalid",
+    "image_process_failed",
+    "media_empty",
+    "file_reference",
+)
+
+
+class PhotoRejected(Exception):
+    """
+    Telegram отклонил фото в альбоме (file_id неверный, не фото и т.п.): повтор того же
+    альбома не поможет. Ошибки чата («chat not found», нет прав) так не помечаются.
+    """
+
+
+def is_file_error(description: str) -> bool:
+    description = description.lower()
+    return any(marker in description for marker in _FILE_ERRORS)
+
+
+# [(file_id, подпись)]; отказ из-за самих фото — PhotoRejected, остальное пробрасывается как есть
+SendAlbum = Callable[[List[Tuple[str, str]]], Awaitable[Any]]
+
+
+def caption(row: Dict[str, Any]) -> str:
+    when = datetime.fromtimestamp(row["created_at"]).strftime("%d.%m %H:%M")
+    name = html.escape((row["user_name"] or "")[:200])
+    return f"🐶 День 4 — от {name} (id {row['user_id']}), {when}"[:MAX_CAPTION_CHARS]
+
+
+class BeagleForwarder:
+    """
+    Фото бигля из дня 4 сначала пишутся в таблицу beagle_photos, а админу уходят
+    фоновой задачей: раз в interval секунд накопленные фото отправляются альбомами
+    по ALBUM_SIZE, у каждого фото подпись с автором. Отметка forwarded_at ставится
+    только после успешной отправки альбома, так что при ошибке или 429 он уйдёт повторно.
+    Если Telegram отклоняет сами фото (PhotoRejected), фото альбома считают отказ и дальше
+    уходят по одному, с паузой REJECT_PAUSE; фото, отклонённое MAX_ATTEMPTS раз, пропускается
+    (остаётся в таблице с forwarded_at NULL). Ошибки чата или настроек не трогают строки:
+    forward() их пробрасывает, и run_periodic повторяет позже с нарастающей паузой.
+    """
+
+    def __init__(self, pool: ConnectionPool, send_album: SendAlbum, interval: float = 30.0,
+                 sleep: Sleep = asyncio.sleep):
+        self.pool = pool
+        self.send_album = send_album
+        self.interval = interval
+        self.sleep = sleep
+
+    async def add(self, user_id: int, user_name: str, file_id: str) -> int:
+        async with self.pool.transaction() as db:
+            cur = await db.execute(
+                "INSERT INTO beagle_photos(user_id, user_name, file_id, created_at) VALUES(?, ?, ?, ?)",
+                (user_id, user_name, file_id, int(time.time())),
+            )
+            photo_id = cur.lastrowid
+            await cur.close()
+        return photo_id
+
+    async def pending(self) -> int:
+        async with self.pool.acquire() as db:
+            cur = await db.execute(
+                "SELECT COUNT(*) FROM beagle_photos WHERE forwarded_at IS NULL AND attempts < ?", (MAX_ATTEMPTS,)
+            )
+            (count,) = await cur.fetchone()
+            await cur.close()
+        return count
+
+    async def _next_album(self) -> List[Dict[str, Any]]:
+        async with self.pool.acquire() as db:
+            cur = await db.execute(
+                "SELECT id, user_id, user_name, file_id, created_at, attempts FROM beagle_photos "
+                "WHERE forwarded_at IS NULL AND attempts < ? ORDER BY id LIMIT ?",
+                (MAX_ATTEMPTS, ALBUM_SIZE),
+            )
+            rows = await cur.fetchall()
+            await cur.close()
+        columns = ("id", "user_id", "user_name", "file_id", "created_at", "attempts")
+        rows = [dict(zip(columns, row)) for row in rows]
+        # уже отклонённое фото идёт отдельно: так плохой file_id не тянет за собой весь альбом
+        clean = list(itertools.takewhile(lambda row: not row["attempts"], rows))
+        return clean or rows[:1]
+
+    async def _rejected(self, rows: List[Dict[str, Any]], err: PhotoRejected):
+        async with self.pool.transaction() as db:
+            await db.executemany(
+                "UPDATE beagle_photos SET attempts=attempts + 1 WHERE id=?", [(row["id"],) for row in rows]
+            )
+        for row in rows:
+            if row["attempts"] + 1 >= MAX_ATTEMPTS:
+                logger.error("beagle photo %s from %s rejected %s times, skipped: %s",
+                             row["id"], row["user_id"], MAX_ATTEMPTS, err)
+
+    async def forward(self) -> int:
+        """
+        Отправить все накопленные фото. Ошибку отправки (кроме PhotoRejected) пробрасывает —
+        повтор решает run_periodic.
+        """
+        forwarded = 0
+        while True:
+            rows = await self._next_album()
+            if not rows:
+                return forwarded
+            try:
+                await self.send_album([(row["file_id"], caption(row)) for row in rows])
+            except PhotoRejected as err:
+                await self._rejected(rows, err)
+                await self.sleep(REJECT_PAUSE)
+                continue
+            async with self.pool.transaction() as db:
+                await db.executemany(
+                    "UPDATE beagle_photos SET forwarded_at=? WHERE id=?",
+                    [(int(time.time()), row["id"]) for row in rows],
+                )
+            forwarded += len(rows)
+
+    async def run(self):
+        await run_periodic("beagle photos forwarding", self.forward, self.interval)
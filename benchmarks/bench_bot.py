@@ -0,0 +1,290 @@
+"""
+Офлайн-бенчмарк бота целиком: поднимает заглушку Bot API (fake_bot_api.py),
+запускает bot.main() в режиме polling против неё на временной базе и проводит
+синтетических пользователей через все 7 дней CONTENT: /start, «Открыть день»,
+кнопки шагов, фото бигля в день 4, ответы письма в день 6, искры.
+Между днями все пользователи разом получают новый день — меряется рассылка уведомлений.
+
+Отчёт: время старта (импорт bot.py и main() до polling), апдейты/с, p50/p99 времени
+хендлера, обращений к БД на апдейт, длительность рассылки при открытии дня. --json сохраняет его для сравнения между версиями.
+
+    python benchmarks/bench_bot.py --users 200 --latency 0.02 --rate-429 0.01 --json bench.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+DAY6_ANSWER = "Очень важный для меня ответ на вопрос из письма"
+# защита от зацикливания сценария, если шаг так и не сдвинулся
+MAX_ACTIONS_PER_DAY = 40
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Harness:
+    def __init__(self, bot_module, api: FakeBotAPI):
+        self.b = bot_module
+        self.api = api
+        self.handler_seconds: List[float] = []
+        self.errors = 0
+        self.updates = 0
+        self.stalled = 0
+        self._done: Dict[int, asyncio.Future] = {}
+        self._jobs: Dict[int, int] = defaultdict(int)
+        self._jobs_idle: Dict[int, asyncio.Event] = defaultdict(asyncio.Event)
+        self._install_hooks()
+
+    # --- перехват внутри бота ---
+    def _install_hooks(self):
+        harness = self
+
+        async def timing(handler, event, data):
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            except Exception:
+                harness.errors += 1
+            finally:
+                harness.handler_seconds.append(time.perf_counter() - started)
+                future = harness._done.pop(event.update_id, None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+        self.b.dp.update.outer_middleware(timing)
+
+        # отложенные шаги (паузы истории) тоже часть обработки: ждём и их
+        delayed = self.b.delayed_steps
+        enqueue, run_job = delayed.enqueue, delayed._run_job
+
+        async def counted_enqueue(chat_id, *args, **kwargs):
+            job_id = await enqueue(chat_id, *args, **kwargs)
+            if job_id is not None:
+                harness._jobs[chat_id] += 1
+                harness._jobs_idle[chat_id].clear()
+            return job_id
+
+        async def counted_run_job(job):
+            try:
+                await run_job(job)
+            finally:
+                chat_id = job["chat_id"]
+                harness._jobs[chat_id] -= 1
+                if harness._jobs[chat_id] <= 0:
+                    harness._jobs_idle[chat_id].set()
+
+        delayed.enqueue = counted_enqueue
+        delayed._run_job = counted_run_job
+
+    # --- апдейты от пользователя ---
+    @staticmethod
+    def _user(uid: int) -> Dict[str, Any]:
+        return {"id": uid, "is_bot": False, "first_name": f"User{uid}"}
+
+    def _message(self, uid: int, **fields) -> Dict[str, Any]:
+        return {
+            "message_id": int(time.time() * 1000) % 1_000_000_000,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self._user(uid),
+            **fields,
+        }
+
+    async def _send(self, uid: int, event: Dict[str, Any]):
+        update_id = self.api.push_update(event)
+        future = asyncio.get_running_loop().create_future()
+        self._done[update_id] = future
+        self.updates += 1
+        await future
+        if self._jobs[uid] > 0:
+            await self._jobs_idle[uid].wait()
+
+    async def text(self, uid: int, text: str):
+        await self._send(uid, {"message": self._message(uid, text=text)})
+
+    async def photo(self, uid: int):
+        photo = [{"file_id": f"user-photo-{uid}", "file_unique_id": f"u{uid}", "width": 800, "height": 600}]
+        await self._send(uid, {"message": self._message(uid, photo=photo)})
+
+    async def callback(self, uid: int, data: str):
+        last = (self.api.sent.get(uid) or [None])[-1]
+        message = last or self._message(uid, text=".")
+        await self._send(uid, {"callback_query": {
+            "id": f"{uid}-{self.updates}",
+            "from": self._user(uid),
+            "chat_instance": str(uid),
+            "data": data,
+            "message": {**message, "from": {"id": 1, "is_bot": True, "first_name": "Bench"}},
+        }})
+
+    # --- сценарий ---
+    def _next_action(self, day: int, step_idx: int):
+        step = self.b.COMPILED[day].steps[step_idx]
+        for row in (step.reply_markup.inline_keyboard if step.reply_markup else ()):
+            for button in row:
+                cb = self.b.callbacks.decode(button.callback_data)
+                if cb is not None and cb.action not in ("menu", "noop"):
+                    return "callback", button.callback_data
+        if day == 4 and step_idx == 2:
+            return "photo", None
+        if day == 6 and step_idx in (3, 4, 5):
+            return "text", DAY6_ANSWER
+        return None
+
+    async def _position(self, uid: int):
+        user = await self.b.db_get_user(uid)
+        return user["active_day"], user["active_step"]
+
+    async def play_day(self, uid: int, day: int):
+        await self.callback(uid, self.b.callbacks.encode("open_day"))
+        for _ in range(MAX_ACTIONS_PER_DAY):
+            position = await self._position(uid)
+            if position[0] != day:
+                break
+            action = self._next_action(*position)
+            if action is None:
+                return
+            kind, payload = action
+            if kind == "callback":
+                await self.callback(uid, payload)
+                if self.b.callbacks.decode(payload).action == "get_spark":
+                    return
+            elif kind == "photo":
+                await self.photo(uid)
+            else:
+                await self.text(uid, payload)
+        self.stalled += 1
+
+    async def unlock_all(self) -> float:
+        async with self.b.db_pool.transaction() as db:
+            await db.execute("UPDATE users SET next_unlock_at = ? WHERE opened_day < 7", (int(time.time()) - 1,))
+        # в жизни между уведомлениями сутки: паузу «не чаще раза в секунду на чат» с прошлого дня не ждём
+        self.b.notify_dispatcher._last_sent.clear()
+        started = time.perf_counter()
+        await self.b.db_unlock_next_day_for_due_users()
+        return time.perf_counter() - started
+
+
+async def run(args) -> Dict[str, Any]:
+    api = FakeBotAPI(args.latency, args.jitter, args.rate_429, args.retry_after, seed=args.seed)
+    url = await api.start()
+
+    workdir = tempfile.mkdtemp(prefix="advent-bench-")
+    os.environ.update({
+        "BOT_TOKEN": "42:bench",
+        "TELEGRAM_API_URL": url,
+        "DB_PATH": os.path.join(workdir, "bench.sqlite"),
+        "STEP_DELAY": "0",
+        "DAY4_BEAGLE_DELAY": "0",
+        "DAY6_LETTER_DELAY": "0",
+        "MEDIA_WARMUP_ON_START": "0",
+        "MEDIA_VARIANTS_DIR": os.path.join(workdir, "media"),
+        "MAINTENANCE_MODE": "0",
+        "SEND_RATE_LIMIT": str(args.send_rate),
+    })
+    os.chdir(ROOT)  # days.yaml и media/ лежат относительно корня
+    # холодный старт: импорт bot.py и main() до начала polling
+    startup_started = time.perf_counter()
+    import bot as bot_module
+
+    harness = Harness(bot_module, api)
+    started = asyncio.Event()
+    bot_module.dp.startup.register(lambda: started.set())
+    main_task = asyncio.create_task(bot_module.main("polling"))
+    await started.wait()
+    startup_seconds = time.perf_counter() - startup_started
+
+    users = list(range(100001, 100001 + args.users))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def each(coro_factory):
+        async def one(uid):
+            async with semaphore:
+                await coro_factory(uid)
+        await asyncio.gather(*(one(uid) for uid in users))
+
+    drive_seconds = 0.0
+    unlocks = []
+    ops_before = bot_module.db_pool.ops
+    t = time.perf_counter()
+    await each(lambda uid: harness.text(uid, "/start"))
+    drive_seconds += time.perf_counter() - t
+    for day in range(1, 8):
+        if day > 1:
+            unlocks.append({"day": day, "users": len(users), "seconds": round(await harness.unlock_all(), 4)})
+        t = time.perf_counter()
+        await each(lambda uid: harness.play_day(uid, day))
+        drive_seconds += time.perf_counter() - t
+    # отложенная запись состояния тоже считается
+    await bot_module.user_cache.flush()
+    db_ops = bot_module.db_pool.ops - ops_before
+
+    await bot_module.dp.stop_polling()
+    await main_task
+    await api.stop()
+
+    latencies = harness.handler_seconds
+    return {
+        "users": args.users,
+        "config": {
+            "latency": args.latency, "jitter": args.jitter, "rate_429": args.rate_429,
+            "concurrency": args.concurrency, "send_rate": args.send_rate,
+        },
+        "startup_seconds": round(startup_seconds, 3),
+        "updates": harness.updates,
+        "updates_per_second": round(harness.updates / drive_seconds, 1) if drive_seconds else None,
+        "handler_latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            "p99": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+            "max": round(max(latencies) * 1000, 2) if latencies else None,
+        },
+        "db_ops_per_update": round(db_ops / harness.updates, 2) if harness.updates else None,
+        "unlock_fanout": unlocks,
+        "handler_errors": harness.errors,
+        "stalled_days": harness.stalled,
+        "api_calls": dict(api.calls),
+        "api_429": dict(api.throttled),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=100, help="сколько пользователей действуют одновременно")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа Bot API, с")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--send-rate", type=float, default=1000.0, help="SEND_RATE_LIMIT для рассылок, сообщ./с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="куда сохранить отчёт")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
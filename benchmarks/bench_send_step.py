@@ -0,0 +1,53 @@
+"""
+Микробенчмарк подготовки шага к отправке:
+старый путь (сборка клавиатуры и разбор словаря шага на каждый send_step)
+против нового (готовый CompiledStep из COMPILED).
+
+    python benchmarks/bench_send_step.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+def prepare_old():
+    for day, day_data in bot.CONTENT.items():
+        steps = day_data["steps"]
+        total = len(steps)
+        for step_idx, step in enumerate(steps):
+            bot.build_step_kb(day, step_idx, step, total)
+            step.get("file_id") or step.get("file")
+            step.get("caption", "")
+            for a in step.get("after") or []:
+                a.get("file_id") or a.get("file")
+        bot.InlineKeyboardBuilder()  # menu_kb() собирался заново на каждое уведомление
+    return total
+
+
+def prepare_new():
+    for day, day_data in bot.COMPILED.items():
+        for step in day_data.steps:
+            step.reply_markup
+            step.file_id or step.file
+            step.caption
+            for a in step.after:
+                a.file_id or a.file
+        bot.menu_kb()
+    return len(day_data.steps)
+
+
+def main():
+    steps = sum(len(d["steps"]) for d in bot.CONTENT.values())
+    number = 2000
+    for name, fn in (("old", prepare_old), ("new", prepare_new)):
+        seconds = min(timeit.repeat(fn, number=number, repeat=5))
+        per_step_us = seconds / (number * steps) * 1e6
+        print(f"{name}: {per_step_us:.2f} µs per step")
+
+
+if __name__ == "__main__":
+    main()
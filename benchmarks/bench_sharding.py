@@ -0,0 +1,105 @@
+"""
+Пропускная способность шардирования: супервизор раздаёт апдейты N процессам
+по user_id (sharding.ShardBus), каждый шард разбирает апдейт в модели aiogram
+и прогоняет его через Dispatcher с хендлером, который собирает клавиатуру и
+сериализует ответ — то, что при пике в 10:00 упирается в одно ядро.
+Telegram и БД не участвуют: меряется только Python-часть на апдейт.
+
+    python benchmarks/bench_sharding.py [updates] [max_shards]
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sharding import ShardBus, start_shards  # noqa: E402
+
+
+def _update(update_id: int, user_id: int):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "chat_instance": "1",
+            "data": f"next:{user_id % 7 + 1}:{update_id % 5}",
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "text": "шаг",
+            },
+        },
+    }
+
+
+def _shard(results, index: int, count: int, queues):
+    from aiogram import Bot, Dispatcher
+    from aiogram.types import CallbackQuery
+    from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+    bot = Bot("1:bench")
+    dp = Dispatcher()
+    handled = 0
+
+    @dp.callback_query()
+    async def on_next(c: CallbackQuery):
+        nonlocal handled
+        _, day, step = c.data.split(":")
+        kb = InlineKeyboardBuilder()
+        kb.button(text="Дальше ➡️", callback_data=f"next:{day}:{int(step) + 1}")
+        kb.button(text="⬅️ В меню", callback_data="menu")
+        kb.adjust(1)
+        kb.as_markup().model_dump_json(exclude_none=True)
+        handled += 1
+
+    async def on_update(update):
+        await dp.feed_raw_update(bot, update)
+
+    async def run():
+        results.put(("ready", index))
+        await ShardBus(queues, index).serve(on_update, {})
+        results.put(("done", index, handled))
+
+    asyncio.run(run())
+
+
+def measure(shards: int, updates: int, users: int = 10000) -> float:
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    bus, processes = start_shards(functools.partial(_shard, results), shards)
+    for _ in range(shards):
+        results.get()
+
+    started = time.perf_counter()
+    for i in range(updates):
+        bus.route(_update(i + 1, i % users + 1))
+    bus.stop_all()
+    handled = sum(results.get()[2] for _ in range(shards))
+    elapsed = time.perf_counter() - started
+
+    for process in processes:
+        process.join()
+    assert handled == updates, (handled, updates)
+    return updates / elapsed
+
+
+def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    max_shards = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    print(f"cpu: {os.cpu_count()}, updates: {updates}")
+    base = None
+    shards = 1
+    while shards <= max_shards:
+        rate = measure(shards, updates)
+        base = base or rate
+        print(f"shards={shards}: {rate:,.0f} updates/s (x{rate / base:.2f})")
+        shards *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Холодный старт: сколько проходит от запуска процесса до готовности.
+Каждая команда запускается отдельным процессом --runs раз, в отчёте — медиана и минимум.
+
+    import_bot — python -c "import bot": всё, что bot.py делает при импорте
+                 (aiogram, Dispatcher, загрузка и компиляция контента);
+    validate   — python -m adventcalendar validate: проверка контента без aiogram;
+    help       — python -m adventcalendar --help: сама точка входа.
+
+Время до начала polling (с созданием Bot и открытием БД) — startup_seconds в bench_bot.py.
+
+    python benchmarks/bench_startup.py --runs 5 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "import_bot": [sys.executable, "-c", "import bot"],
+    "validate": [sys.executable, "-m", "adventcalendar", "validate"],
+    "help": [sys.executable, "-m", "adventcalendar", "--help"],
+}
+
+
+def measure(command: List[str], runs: int) -> Dict[str, float]:
+    env = {**os.environ, "BOT_TOKEN": ""}  # без токена: импорт не должен его требовать
+    seconds = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - started)
+    return {"median": round(statistics.median(seconds), 3), "min": round(min(seconds), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="куда сохранить отчёт")
+    args = parser.parse_args()
+
+    report = {name: measure(command, args.runs) for name, command in COMMANDS.items()}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
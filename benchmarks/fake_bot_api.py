@@ -0,0 +1,191 @@
+"""
+Заглушка Bot API для офлайн-бенчмарков: aiohttp-сервер, который отвечает
+как Telegram на методы, которые использует бот, с настраиваемой задержкой
+и случайными 429. Бот направляется на неё через TELEGRAM_API_URL
+(TelegramAPIServer.from_base).
+
+Апдейты для бота кладутся через push_update() и отдаются ему getUpdates.
+Отправленные ботом сообщения учитываются по методам (calls) и по чатам (sent).
+
+    python benchmarks/fake_bot_api.py --port 8081 --latency 0.05 --rate-429 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# что кладётся в ответ send*-методов рядом с базовыми полями Message
+_MEDIA_FIELDS = {
+    "sendPhoto": lambda fid: {"photo": [{"file_id": fid, "file_unique_id": fid, "width": 512, "height": 512}]},
+    "sendVoice": lambda fid: {"voice": {"file_id": fid, "file_unique_id": fid, "duration": 5}},
+    "sendVideo": lambda fid: {"video": {"file_id": fid, "file_unique_id": fid, "width": 640, "height": 640, "duration": 5}},
+    "sendVideoNote": lambda fid: {"video_note": {"file_id": fid, "file_unique_id": fid, "length": 240, "duration": 5}},
+    "sendSticker": lambda fid: {"sticker": {
+        "file_id": fid, "file_unique_id": fid, "type": "regular",
+        "width": 512, "height": 512, "is_animated": False, "is_video": False,
+    }},
+}
+_TRUE_METHODS = {"answerCallbackQuery", "editMessageReplyMarkup", "editMessageCaption", "setWebhook", "deleteWebhook", "deleteMessage"}
+# на эти методы 429 не отдаём: они не про исходящие сообщения
+_NO_LIMIT_METHODS = {"getUpdates", "getMe", "setWebhook", "deleteWebhook"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_429: float = 0.0, retry_after: int = 1,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self.sent: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._updates: List[Dict[str, Any]] = []
+        self._updates_ready = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+    # --- апдейты для бота ---
+    def push_update(self, event: Dict[str, Any]) -> int:
+        """
+        event — {"message": {...}} или {"callback_query": {...}}; update_id назначается здесь.
+        """
+        update_id = next(self._update_ids)
+        self._updates.append({"update_id": update_id, **event})
+        self._updates_ready.set()
+        return update_id
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    # --- HTTP ---
+    @staticmethod
+    async def _params(request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        form = await request.post()
+        # файлы нам не нужны, только то, что они были
+        return {key: (value if isinstance(value, str) else "<file>") for key, value in form.items()}
+
+    def _message(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if params.get("caption"):
+            message["caption"] = params["caption"]
+        if method in _MEDIA_FIELDS:
+            message.update(_MEDIA_FIELDS[method](f"fake-{method}-{message['message_id']}"))
+        if params.get("reply_markup"):
+            markup = json.loads(params["reply_markup"]) if isinstance(params["reply_markup"], str) else params["reply_markup"]
+            if markup:
+                message["reply_markup"] = markup
+        self.sent[chat_id].append(message)
+        return message
+
+    def _media_group(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        media = json.loads(params["media"]) if isinstance(params["media"], str) else params["media"]
+        return [
+            self._message("sendPhoto", {"chat_id": params["chat_id"], "caption": item.get("caption")})
+            for item in media
+        ]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        if method not in _NO_LIMIT_METHODS and self.rate_429 and self.random.random() < self.rate_429:
+            self.throttled[method] += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                status=429,
+            )
+
+        if method == "getMe":
+            result: Any = BOT_USER
+        elif method == "sendMessage" or method in _MEDIA_FIELDS:
+            result = self._message(method, params)
+        elif method == "sendMediaGroup":
+            result = self._media_group(params)
+        elif method in _TRUE_METHODS:
+            result = True
+        else:
+            return web.json_response(
+                {"ok": False, "error_code": 404, "description": f"Not Found: method {method} is not faked"},
+                status=404,
+            )
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_host, bound_port = self._runner.addresses[0][:2]
+        self.url = f"http://{bound_host}:{bound_port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(args):
+    api = FakeBotAPI(args.latency, args.jitter, args.rate_429, args.retry_after)
+    print(f"fake Bot API on {await api.start(args.host, args.port)}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, до N с")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
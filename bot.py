@@ -1,29 +1,52 @@
 import os
+import sys
 import html
 import asyncio
-from asyncio import sleep
+import logging
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from functools import lru_cache
+from datetime import datetime
 from zoneinfo import ZoneInfo
 from typing import Any, Dict, List, Optional, Tuple
 
-import aiosqlite
 from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery, InputMediaPhoto
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.methods import TelegramMethod
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramNotFound
 
 from maintenance import MaintenanceMiddleware, DEFAULT_MAINTENANCE_TEXT
+from user_queue import UserSerialMiddleware
+from instrumentation import ApiTimingMiddleware, InstrumentationMiddleware, Metrics, serve_prometheus
+from storage import ConnectionPool
+from schema import MigrationContext, next_unlock_time, db_init as schema_db_init
+from scheduler import Scheduler
+from fanout import FanoutDispatcher, TokenBucket, TELEGRAM_GLOBAL_RATE
+from broadcast import BroadcastRunner
+from media_cache import MediaCache, file_id_from_message
+from warmup import collect_media, warmup_media
+from media_variants import MediaVariants, format_report
+from user_cache import UserStateCache
+from delayed_steps import ChatUnavailable, DelayedSteps
+import funnel
+from letters import LetterDigester
+from beagle_photos import BeagleForwarder, PhotoRejected, is_file_error
+from webhook import WebhookConfig, run_webhook, stop_on_signals
+from sharding import ShardBus, poll_into, serve_webhook_into, start_shards, stop_shards, watch_shards
+from callbacks import CallbackData, CallbackRouter
+from content import BUTTON_ACTIONS, REQUIRED_STEPS, CompiledDay, CompiledMedia, ContentError, compile_content, freeze_markup, load_content
 
 # ----------------------------
 # 1) ENV / BOT INIT
 # ----------------------------
 load_dotenv()
+# проверяется в create_bot(): без токена модуль импортируется (проверка контента, миграции, бенчмарки)
 TOKEN = os.getenv("BOT_TOKEN", "").strip()
-if not TOKEN:
-    raise RuntimeError("BOT_TOKEN not set in .env")
 
 TZ_NAME = os.getenv("TZ", "Europe/Minsk")
 TZ = ZoneInfo(TZ_NAME)
@@ -34,487 +57,121 @@ DAY4_BEAGLE_DELAY = float(os.getenv("DAY4_BEAGLE_DELAY", "8"))
 DAY6_LETTER_DELAY = float(os.getenv("DAY6_LETTER_DELAY", "6"))
 DAY6_ANSWER_MIN_LEN = int(os.getenv("DAY6_ANSWER_MIN_LEN", "20"))
 ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "791104636").strip() or "791104636")
-BROADCAST_DELAY = float(os.getenv("BROADCAST_DELAY", "0.05"))
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "200"))
+# Ответы письма дня 6 копятся в таблице letters и уходят сюда дайджестом раз в LETTERS_DIGEST_INTERVAL секунд
+LETTERS_CHAT_ID = int(os.getenv("LETTERS_CHAT_ID", "").strip() or ADMIN_CHAT_ID)
+LETTERS_DIGEST_INTERVAL = float(os.getenv("LETTERS_DIGEST_INTERVAL", "60"))
+# Фото бигля (день 4) копятся в таблице beagle_photos и уходят сюда альбомами до 10 штук
+BEAGLE_PHOTOS_CHAT_ID = int(os.getenv("BEAGLE_PHOTOS_CHAT_ID", "").strip() or ADMIN_CHAT_ID)
+BEAGLE_PHOTOS_INTERVAL = float(os.getenv("BEAGLE_PHOTOS_INTERVAL", "30"))
+SEND_RATE_LIMIT = float(os.getenv("SEND_RATE_LIMIT", str(TELEGRAM_GLOBAL_RATE)))
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "16"))
 MAINTENANCE_MODE = os.getenv("MAINTENANCE_MODE", "0").strip() == "1"
 MAINTENANCE_TEXT = os.getenv("MAINTENANCE_TEXT", DEFAULT_MAINTENANCE_TEXT).strip()
 MAINTENANCE_PHOTO_ID = os.getenv("MAINTENANCE_PHOTO_ID", "").strip() or None
 
-DB_PATH = "advent.sqlite"
+DB_PATH = os.getenv("DB_PATH", "advent.sqlite")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_FLUSH_MS = int(os.getenv("USER_CACHE_FLUSH_MS", "200"))
 
-# Можно задать file_id для прогресс-фото, чтобы Telegram брал картинку из кеша
+# Локальные картинки загружаются один раз (см. media_cache / warmup),
+# PROGRESS_PHOTO_ID нужен, только если хочется явно подменить картинку прогресса.
 PROGRESS_PHOTO_ID = os.getenv("PROGRESS_PHOTO_ID", "").strip()
+PROGRESS_PHOTO_META = (
+    {"type": "photo", "file_id": PROGRESS_PHOTO_ID} if PROGRESS_PHOTO_ID
+    else {"type": "photo", "file": "media/img1.png"}
+)
 
-DAY3_M1_PHOTO_ID = os.getenv("DAY3_M1_PHOTO_ID", "").strip()
-DAY3_M4_PHOTO_ID = os.getenv("DAY3_M4_PHOTO_ID", "").strip()
-
-DAY3_M1_PHOTO_META = {"file_id": DAY3_M1_PHOTO_ID} if DAY3_M1_PHOTO_ID else {"file": "media/img4.png"}
-DAY3_M4_PHOTO_META = {"file_id": DAY3_M4_PHOTO_ID} if DAY3_M4_PHOTO_ID else {"file": "media/img5.png"}
-
-DAY4_M2_PHOTO_ID = os.getenv("DAY4_M2_PHOTO_ID", "").strip()
-DAY4_M4_PHOTO_ID = os.getenv("DAY4_M4_PHOTO_ID", "").strip()
-
-DAY4_M2_PHOTO_META = {"file_id": DAY4_M2_PHOTO_ID} if DAY4_M2_PHOTO_ID else {"file": "media/img4.png"}
-DAY4_M4_PHOTO_META = {"file_id": DAY4_M4_PHOTO_ID} if DAY4_M4_PHOTO_ID else {"file": "media/img5.png"}
-
-DAY5_M2_PHOTO_ID = os.getenv("DAY5_M2_PHOTO_ID", "").strip()
-DAY5_M4_PHOTO_ID = os.getenv("DAY5_M4_PHOTO_ID", "").strip()
+PROGRESS_PHOTO = CompiledMedia(PROGRESS_PHOTO_META)
+
+# Чат, куда warm-up загружает локальные медиа, чтобы получить их file_id
+MEDIA_STORAGE_CHAT_ID = int(os.getenv("MEDIA_STORAGE_CHAT_ID", "").strip() or ADMIN_CHAT_ID)
+MEDIA_WARMUP_ON_START = os.getenv("MEDIA_WARMUP_ON_START", "1").strip() == "1"
+# Фото без file_id загружаются пережатыми (JPEG, нужен Pillow), варианты лежат в MEDIA_VARIANTS_DIR,
+# байты горячих файлов — в памяти (до MEDIA_MEMORY_CACHE_MB). Отчёт: python bot.py media
+MEDIA_VARIANTS_DIR = os.getenv("MEDIA_VARIANTS_DIR", ".media_cache")
+MEDIA_MEMORY_CACHE_MB = float(os.getenv("MEDIA_MEMORY_CACHE_MB", "32"))
+MEDIA_PHOTO_MAX_SIDE = int(os.getenv("MEDIA_PHOTO_MAX_SIDE", "1280"))
+MEDIA_PHOTO_QUALITY = int(os.getenv("MEDIA_PHOTO_QUALITY", "85"))
+
+# Метрики хендлеров/БД/Bot API: /stats у админа и (если METRICS_PORT) GET /metrics для Prometheus
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").strip() == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1").strip()
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0").strip() or "0")
+
+# Свой адрес Bot API (локальный telegram-bot-api или заглушка из benchmarks/fake_bot_api.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").strip()
+
+# Режим получения апдейтов: polling (getUpdates) или webhook (aiohttp-сервер, см. webhook.py)
+RUN_MODE = os.getenv("RUN_MODE", "polling").strip().lower()
+WEBHOOK_CONFIG = WebhookConfig(
+    url=os.getenv("WEBHOOK_URL", "").strip() or None,
+    path=os.getenv("WEBHOOK_PATH", "/webhook").strip() or "/webhook",
+    host=os.getenv("WEBHOOK_HOST", "0.0.0.0").strip(),
+    port=int(os.getenv("WEBHOOK_PORT", "8080")),
+    secret_token=os.getenv("WEBHOOK_SECRET", "").strip() or None,
+    drain_timeout=float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30")),
+    # за балансировщиком с несколькими инстансами вебхук снимать не нужно
+    delete_on_stop=os.getenv("WEBHOOK_DELETE_ON_STOP", "1").strip() == "1",
+)
 
-DAY5_M2_PHOTO_META = {"file_id": DAY5_M2_PHOTO_ID} if DAY5_M2_PHOTO_ID else {"file": "media/img4.png"}
-DAY5_M4_PHOTO_META = {"file_id": DAY5_M4_PHOTO_ID} if DAY5_M4_PHOTO_ID else {"file": "media/img5.png"}
+# SHARDS > 1: супервизор принимает апдейты и раздаёт их SHARDS процессам по user_id (см. sharding.py).
+# SHARD_INDEX и shard_bus задаются в процессе шарда; шард 0 владеет открытием дней и рассылками.
+SHARDS = max(1, int(os.getenv("SHARDS", "1")))
+SHARD_INDEX = 0
+shard_bus: Optional[ShardBus] = None
 
-# ВАЖНО: parse_mode="HTML" задан по умолчанию для всего бота
-bot = Bot(
-    token=TOKEN,
-    default=DefaultBotProperties(parse_mode="HTML")  # parse_mode="HTML"
-)
+# Bot создаётся в create_bot() при запуске команды, которой он нужен (main, warmup, супервизор)
+bot: Optional[Bot] = None
 dp = Dispatcher()
+# Общий лимит исходящих сообщений для массовых отправок (уведомления, рассылки)
+send_bucket = TokenBucket(rate=SEND_RATE_LIMIT)
+notify_dispatcher = FanoutDispatcher(send_bucket, workers=FANOUT_WORKERS)
+metrics = Metrics(enabled=METRICS_ENABLED)
+# Апдейты одного пользователя — строго по очереди, повторные нажатия той же кнопки схлопываются.
+# Один экземпляр на message и callback_query: текст и нажатие одного пользователя тоже не пересекаются.
+user_serial = UserSerialMiddleware()
+dp.message.outer_middleware(user_serial)
+dp.callback_query.outer_middleware(user_serial)
+if METRICS_ENABLED:
+    dp.message.middleware(InstrumentationMiddleware(metrics))
+    dp.callback_query.middleware(InstrumentationMiddleware(metrics))
 dp.message.middleware(MaintenanceMiddleware(MAINTENANCE_MODE, MAINTENANCE_TEXT, MAINTENANCE_PHOTO_ID))
 dp.callback_query.middleware(MaintenanceMiddleware(MAINTENANCE_MODE, MAINTENANCE_TEXT, MAINTENANCE_PHOTO_ID))
 
+def create_bot() -> Bot:
+    """
+    Создаёт Bot один раз на процесс (повторный вызов возвращает тот же).
+    """
+    global bot
+    if bot is not None:
+        return bot
+    if not TOKEN:
+        raise RuntimeError("BOT_TOKEN not set in .env")
+    # ВАЖНО: parse_mode="HTML" задан по умолчанию для всего бота
+    bot = Bot(
+        token=TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+        default=DefaultBotProperties(parse_mode="HTML")  # parse_mode="HTML"
+    )
+    if METRICS_ENABLED:
+        bot.session.middleware(ApiTimingMiddleware(metrics))
+    return bot
+
 # ----------------------------
 # 2) CONTENT (7 DAYS)
-#    Заполни дни 2-7 по аналогии.
+#    Тексты и медиа дней — в days.yaml (CONTENT_PATH).
 # ----------------------------
-CONTENT: Dict[int, Dict[str, Any]] = {
-    1: {
-        "title": "День 1 — «Потерянная варежка»",
-        "spark_name": "Искра №1",
-        "code_part": "В",
-        "steps": [
-            {
-                "type": "text",
-                "text": (
-                    "Привет 🐾\n\n"
-                    "Сегодня начинается одна маленькая новогодняя история на <b>7 дней</b>.\n\n"
-                    "И у неё есть герой… который сейчас в лёгкой панике."
-                ),
-                "next": True,
-            },
-            {
-                "type": "photo",
-                "file_id": "AgACAgIAAxkBAAP7aUqVCWH61Kd1ai1q5VvvCVGojF0AAvkLaxu_5FhK2oCzWwABnR14AQADAgADeQADNgQ",
-                "caption":
-                  (
-                    "Вайбик (да, бигль) шёл по снегу…\n\n"
-                    "и нашёл <b>потерянную варежку</b> 🧤\n\n"
-                    "Она была тёплая, будто её только что уронили.\n\n"
-                    "И на ней была бирка:\n"
-                    "<b>«Вернуть хозяйке. Внутри — Искра №1»</b> ✨"
-                ),
-                "next": True,
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Вайбик заглянул внутрь…\n\n"
-                    "а там маленькая записка:\n\n"
-                    "<b>«Если ты читаешь это — значит, ты теперь в игре.»</b>\n\n"
-                    "<b>7 дней</b>.\n"
-                    "Каждый день — новая глава и маленький сюрприз.\n\n"
-                    "Вайбик сказал, что без тебя он не дойдёт до финала 🤍"
-                ),
-                "next": True,
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Но сначала Вайбик должен понять, как тебя вести по этой истории.\n\n"
-                    "Какой режим включаем? 👇"
-                ),
-                "buttons": [
-                    {"text": "❄️ Нежно и тепло", "action": "set_mode", "value": "soft"},
-                    {"text": "🎄 Смешно и легко", "action": "set_mode", "value": "fun"},
-                    {"text": "✨ Микс", "action": "set_mode", "value": "mix"},
-                ],
-            },
-            # ответ бота на выбор режима (отправим автоматически)
-            {
-                "type": "text",
-                "text": "Принято. Варежку закрепляю на хвост, курс — на Новый год 🐶🧤✨",
-                "next": False,
-            },
-            # финал дня: картинка + кнопка забрать искру
-            {
-                "type": "photo",
-                "file": "media/img3.png",
-                "caption": (
-                    "Тогда торжественно:\n\n"
-                    "<b>Искра №1 найдена</b> ✨\n\n"
-                    "Сегодняшний подарок — маленький, но очень важный:\n"
-                    "<b>открытка от Вайбика</b> (и чуть-чуть от меня) 🤍\n\n"
-                    "Завтра варежка покажет следующую подсказку."
-                ),
-                "buttons": [
-                    {"text": "✨ Забрать Искру", "action": "get_spark"},
-                ],
-                # опционально: после открытки автоматически отправить голосовое
-                "after": [
-                    {"type": "voice", "file": "media/day1/voice.ogg"},
-                ],
-            },
-        ],
-    },
-
-    2: {
-        "title": "День 2 — «Лавка сияния»",
-        "spark_name": "Искра №2",
-        "code_part": "А",
-        "steps": [
-            {
-                "type": "text",
-                "text": (
-                    "Доброе утро ✨\n"
-                    "Вайбик сегодня проснулся раньше обычного.\n"
-                    "Варежка из вчерашнего дня всё ещё была тёплой…\n"
-                    "и привела его к одному странному месту."
-                ),
-                "next": True,
-            },
-            {
-                "type": "photo",
-                "file_id": "AgACAgIAAxkBAAOXaUglTZimhXKMTBPxQ3wFMoXaTjkAAgMPaxt2VUFKWeaxTfdixPcBAAMCAAN5AAM2BA",
-                "caption": (
-                    "На узкой заснеженной улочке\n"
-                    "Вайбик увидел вывеску:\n\n"
-                    "«Лавка сияния» ✨\n\n"
-                    "Говорят, сюда приходят,\n"
-                    "когда хочется снова почувствовать себя красивой,\n"
-                    "живой\n"
-                    "и немного счастливее."
-                ),
-                "next": True,
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Вайбик говорит, что лавка работает\n"
-                    "только если выбрать, какое сияние нужно сегодня.\n\n"
-                    "Что выбираем? 👇"
-                ),
-                "buttons": [
-                    {"text": "✨ Внутренний свет", "action": "glow", "value": "inner"},
-                    {"text": "💄 Внешний блеск", "action": "glow", "value": "outer"},
-                    {"text": "🌸 И то и другое", "action": "glow", "value": "both"},
-                ],
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Отличный выбор.\n"
-                    "Хозяин лавки улыбнулся и протянул Вайбику маленький флакон ✨\n\n"
-                    "Внутри была вторая Искра."
-                ),
-                "no_menu": True
-            },
-            {
-                "type": "photo",
-                "file": "media/img6.png",
-                "caption": (
-                    "Искра №2 найдена ✨\n\n"
-                    "Хозяин лавки сказал:\n"
-                    "«Сияние — это когда ты позволяешь себе заботу».\n\n"
-                    "Поэтому сегодня — подарок для тебя 💛\n"
-                    "сертификат в Золотое Яблоко\n"
-                    "на то, что захочется именно тебе."
-                ),
-                "buttons": [
-                    {"text": "✨ Забрать Искру", "action": "get_spark"},
-                ],
-            },
-        ],
-    },
-    3: {
-        "title": "День 3 — «След памяти»",
-        "spark_name": "Искра №3",
-        "code_part": "Б",
-        "steps": [
-            {
-                "type": "photo",
-                "file_id": "AgACAgIAAxkBAAIBamlMd0nq52EQ5nvz07Gi-5c2GwRHAAJyE2sb_gdhSu0nBBbcnKjLAQADAgADeQADNgQ",
-                "caption": (
-                    "Привет 🌸\n"
-                    "Сегодня Вайбик идёт медленно.\n"
-                    "Он заметил, что на снегу\n"
-                    "остаются следы — и каждый из них что-то хранит."
-                ),
-                "next": True,
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Вайбик понял одну вещь:\n"
-                    "не всё, что важно, видно глазами.\n\n"
-                    "Иногда после тебя остаётся\n"
-                    "след памяти —\n"
-                    "ощущение,\n"
-                    "запах,\n"
-                    "чувство.\n\n"
-                    "И сегодня он учится оставлять именно такой след."
-                ),
-                "next": True,
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Вайбик говорит, что у каждого дня\n"
-                    "есть свой аромат.\n\n"
-                    "Какой сегодня ближе тебе? 👇"
-                ),
-                "buttons": [
-                    {"text": "🌸 Цветочный и нежный", "action": "aroma", "value": "floral"},
-                    {"text": "🌿 Свежий и спокойный", "action": "aroma", "value": "fresh"},
-                    {"text": "🍊 Тёплый и уютный", "action": "aroma", "value": "warm"},
-                    {"text": "✨ Загадочный и вечерний", "action": "aroma", "value": "mystery"},
-                ],
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Вайбик остановился, вдохнул глубже…\n"
-                    "и в этом аромате появилась\n"
-                    "третья Искра ✨"
-                ),
-                "no_menu": True
-            },
-            {
-                "type": "photo",
-                "file_id": "AgACAgIAAxkBAAIBbGlMeQS9YPjRH9w-_GEGbf1_oTnoAAJzE2sb_gdhSljP74T9LdyaAQADAgADeQADNgQ",
-                "caption": (
-                    "✨ Искра №3 найдена\n\n"
-                    "Вайбик говорит:\n"
-                    "«Ароматы — это воспоминания, которые можно носить с собой».\n\n"
-                    "Поэтому сегодня — подарок для тебя 🌸\n"
-                    "сертификат на духи ETIB\n"
-                    "чтобы ты выбрала аромат,\n"
-                    "который захочешь оставить после себя."
-                ),
-                "buttons": [
-                    {"text": "✨ Забрать Искру", "action": "get_spark"},
-                ],
-            },
-        ],
-    },
-    4: {
-        "title": "День 4 — «Чайная станция»",
-        "spark_name": "Искра №4",
-        "code_part": "Й",
-        "steps": [
-            {
-                "type": "text",
-                "text": (
-                    "Доброе утро ☕\n"
-                    "Сегодня Вайбик никуда не спешит.\n"
-                    "Снег идёт медленно,\n"
-                    "и путь вдруг стал тише."
-                ),
-                "next": True,
-            },
-            {
-                "type": "photo",
-                "file_id": "AgACAgIAAxkBAAIBsmlOMgfCO2eML5Xj89fRSQ3kqUXHAAI6EGsbxlZxSiq-3jo-2xyrAQADAgADeQADNgQ",
-                "caption": (
-                    "По дороге Вайбик нашёл маленькую станцию.\n"
-                    "Там было тепло. Пахло чаем.\n"
-                    "И свет горел так, будто ждал именно его.\n\n"
-                    "Он понял:\n"
-                    "иногда, чтобы идти дальше,\n"
-                    "нужно просто остановиться и согреться."
-                ),
-                "next": True,
-            },
-            {
-                "type": "text",
-                "text": (
-                    "На станции Вайбик заметил странное правило 🐾\n\n"
-                    "Чтобы получить следующую Искру, нужно показать фото бигля.\n\n"
-                    "Найди и пришли любую фотографию бигля:\n"
-                    "– настоящего\n"
-                    "– с интернета\n"
-                    "– мем\n\n"
-                    "Всё подойдёт 🤍"
-                ),
-                "no_menu": True
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Вайбик внимательно посмотрел…\n"
-                    "повилял хвостом и сказал:\n\n"
-                    "«Одобрено. Очень уютный бигль» 🐶✨\n\n"
-                    "В этот момент станция зажглась мягким светом — и появилась четвёртая Искра."
-                ),
-                "no_menu": True
-            },
-            {
-                "type": "photo",
-                "file_id": "AgACAgIAAxkBAAIBt2lOOFB7VSWQ1XVU3W-Ob1vytQfyAAJrEGsbxlZxSmx9j8Gt71oJAQADAgADeQADNgQ",
-                "caption": (
-                    "✨ Искра №4 найдена\n\n"
-                    "На чайной станции Вайбик оставил для тебя\n"
-                    "набор уюта 🤍\n\n"
-                    "☕ новогодний чай\n"
-                    "🕯️ свечи с тёплым ароматом\n\n"
-                    "Чтобы в один из вечеров\n"
-                    "ты тоже могла просто остановиться\n"
-                    "и почувствовать тепло."
-                ),
-                "buttons": [
-                    {"text": "✨ Забрать Искру", "action": "get_spark"},
-                ],
-            },
-        ],
-    },
-    5: {
-        "title": "День 5 — «Карта желаний»",
-        "spark_name": "Искра №5",
-        "code_part": "И",
-        "steps": [
-            {
-                "type": "text",
-                "text": (
-                    "Сегодня Вайбик остановился.\n"
-                    "Не потому что устал, а потому что понял —\n"
-                    "дальше хочется идти осознанно."
-                ),
-                "next": True,
-            },
-            {
-                "type": "photo",
-                "file_id": "AgACAgIAAxkBAAICAAFpTx70-jwiW3sPlC70nek0r4YzHgACFRJrG8ZWeUprgvympa2hTgEAAwIAA3kAAzYE",
-                "caption": (
-                    "Рядом лежала карта.\n"
-                    "Не как у путешественников.\n"
-                    "А как у людей, которые хотят понять,\n"
-                    "куда им на самом деле хочется."
-                ),
-                "next": True,
-            },
-            {
-                "type": "text",
-                "text": (
-                    "На ней не было маршрутов,\n"
-                    "дедлайнов или чужих ожиданий.\n\n"
-                    "Только место для твоих мыслей.\n"
-                    "И твоих “хочу”."
-                ),
-                "next": True,
-            },
-            {
-                "type": "photo",
-                "file_id": "AgACAgIAAxkBAAICAmlPJYlGnv_0v3DFvvTy3yX3xhb6AAIWEmsbxlZ5SomUO4YWzC4KAQADAgADeQADNgQ",
-                "caption": (
-                    "✨ Искра №5 появилась\n\n"
-                    "Сегодняшний подарок —\n"
-                    "настоящая карта желаний 💌\n\n"
-                    "Ты можешь делать с ней всё, как тебе удобно:\n"
-                    "– заполнять сразу\n"
-                    "– возвращаться иногда\n"
-                    "– или просто держать рядом\n\n"
-                    "Дальше идти будет проще, когда знаешь, чего тебе хочется. 🤍"
-                ),
-                "buttons": [
-                    {"text": "✨ Забрать Искру", "action": "get_spark"},
-                ],
-            },
-        ],
-    },
-    6: {
-        "title": "День 6 — «Письмо в будущее»",
-        "spark_name": "Искра №6",
-        "code_part": "К",
-        "steps": [
-            {
-                "type": "text",
-                "text": (
-                    "Сегодня Вайбик понял кое-что важное:\n"
-                    "иногда не нужно торопиться идти вперёд.\n"
-                    "Иногда стоит остановиться и подумать, куда идти.\n\n"
-                    "И как раз в этот момент он наткнулся на нечто необычное."
-                ),
-                "next": True,
-            },
-            {
-                "type": "photo",
-                "file_id": "AgACAgIAAxkBAAICQ2lRK-wRSBVk2E8QFvby_kzaEGloAAJjDGsb0A2RSv6SGjwWBiCjAQADAgADeQADNgQ",
-                "caption": (
-                    "Вдалеке Вайбик увидел маленькую почтовую будку.\n"
-                    "На ней было написано:\n"
-                    "«Письма в Будущее» ✨\n\n"
-                    "Вайбик заглянул внутрь, и там была пустая коробка с надписью:\n"
-                    "«Ты можешь отправить себе письмо, если готова встретить будущее»."
-                ),
-                "next": True,
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Вайбик сказал, что отправлять письмо себе — это не просто задание.\n"
-                    "Это подарок себе, чтобы напомнить, что ты хочешь от следующего года.\n\n"
-                    "Напиши, что для тебя будет важным, чего ты хочешь достичь, что оставить позади."
-                ),
-                "no_menu": True
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Что для тебя будет важным в следующем году?"
-                ),
-                "no_menu": True
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Чего ты хочешь достичь?"
-                ),
-                "no_menu": True
-            },
-            {
-                "type": "text",
-                "text": (
-                    "Что хочешь оставить позади?"
-                ),
-                "no_menu": True
-            },
-            {
-                "type": "photo",
-                "file_id": "AgACAgIAAxkBAAICRWlRLdUebcSJIoo1lO4JWGf_MhOyAAJ3DGsb0A2RSm2cBS8c2vBXAQADAgADeQADNgQ",
-                "caption": (
-                    "✨ Искра №6 получена\n"
-                    "Письмо улетело в долгий путь до следующего года.\n\n"
-                    "Вайбик сказал, что будущее не приходит случайно,\n"
-                    "оно создаётся каждым твоим шагом.\n\n"
-                    "Следы не всегда видны, но они ведут нас к новому.\n"
-                    "Завтра будет важный день — зажжём ёлку и отгадаем слово! ✨"
-                ),
-                "buttons": [
-                    {"text": "✨ Забрать Искру", "action": "get_spark"},
-                ],
-            },
-        ],
-    },
-    7: {"title": "День 7 — (заполни)", 
-        "steps": [
-            {
-                "type":"text","text":"День 7 пока не заполнен 🙂","buttons":[{"text":"⬅️ В меню","action":"menu"}]
-            }
-    ]},
-}
+CONTENT_PATH = os.getenv("CONTENT_PATH", "days.yaml")
+CONTENT_REQUIRED_STEPS = REQUIRED_STEPS
+
+CONTENT: Dict[int, Dict[str, Any]] = load_content(CONTENT_PATH, CONTENT_REQUIRED_STEPS)
 
 # ----------------------------
 # 3) DB
 # ----------------------------
-SCHEMA = """
-CREATE TABLE IF NOT EXISTS users (
-  user_id INTEGER PRIMARY KEY,
-  opened_day INTEGER NOT NULL DEFAULT 1,
-  active_day INTEGER NOT NULL DEFAULT 1,
-  active_step INTEGER NOT NULL DEFAULT 0,
-  mode TEXT NOT NULL DEFAULT 'mix',
-  sparks TEXT NOT NULL DEFAULT '',
-  codes TEXT NOT NULL DEFAULT '',
-  next_unlock_at TEXT NOT NULL
-);
-"""
+DAY_SECONDS = 24 * 60 * 60
 
 def _now() -> datetime:
     return datetime.now(tz=TZ)
@@ -524,158 +181,238 @@ def _next_unlock_time() -> datetime:
     Следующий момент открытия нового дня:
     завтра в UNLOCK_HOUR:UNLOCK_MINUTE по TZ
     """
-    now = _now()
-    tomorrow = (now + timedelta(days=1)).date()
-    return datetime(tomorrow.year, tomorrow.month, tomorrow.day, UNLOCK_HOUR, UNLOCK_MINUTE, tzinfo=TZ)
+    return next_unlock_time(TZ, UNLOCK_HOUR, UNLOCK_MINUTE, _now())
+
+def _epoch(dt: datetime) -> int:
+    return int(dt.timestamp())
 
-def _split_pipe(s: str) -> List[str]:
-    s = (s or "").strip()
-    return [x for x in s.split("|") if x] if s else []
+def _spark_bit(day: int) -> int:
+    return 1 << (day - 1)
 
-def _add_unique_pipe(s: str, value: str) -> str:
-    items = _split_pipe(s)
-    if value not in items:
-        items.append(value)
-    return "|".join(items)
+def _spark_days(mask: int) -> List[int]:
+    return [day for day in range(1, mask.bit_length() + 1) if mask & _spark_bit(day)]
 
-def _resolve_media_source(item: Dict[str, Any]):
+async def _resolve_media_source(item: CompiledMedia):
     """
-    Возвращает либо file_id, либо FSInputFile по локальному пути.
-    Позволяет использовать заранее загруженные медиа.
+    Возвращает либо file_id, либо файл для загрузки по локальному пути.
+    Для локального файла, который уже загружался, берём file_id из media_cache,
+    иначе грузим его вариант из media_variants (пережатое фото, байты из памяти).
+    Вариант собирается в пуле потоков: холодное пережатие PNG не должно стопорить event loop.
     """
-    file_id = item.get("file_id")
-    if file_id:
-        return file_id
-
-    file_path = item.get("file")
-    if file_path:
-        return FSInputFile(file_path)
+    if item.file_id:
+        return item.file_id
+
+    if item.file:
+        file_id = media_cache.lookup(item.file)
+        if file_id:
+            return file_id
+        return await asyncio.get_running_loop().run_in_executor(
+            None, media_variants.input_file, item.file, item.type
+        )
 
     raise ValueError("Не указан источник медиа (file или file_id)")
 
-async def db_init():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(SCHEMA)
-        await db.commit()
+async def _remember_media(item: CompiledMedia, message: Optional[Message]):
+    """
+    После первой загрузки локального файла запоминаем выданный Telegram file_id.
+    """
+    if not item.file or item.file_id:
+        return
+    file_id = file_id_from_message(message)
+    if file_id:
+        await media_cache.remember(item.file, file_id)
+
+# Соединения открываются в main() и живут до остановки бота
+db_pool = ConnectionPool(DB_PATH, size=DB_POOL_SIZE)
+if METRICS_ENABLED:
+    db_pool.on_release = metrics.observe_db
+media_cache = MediaCache(db_pool)
+media_variants = MediaVariants(
+    MEDIA_VARIANTS_DIR,
+    memory_bytes=int(MEDIA_MEMORY_CACHE_MB * 1024 * 1024),
+    max_side=MEDIA_PHOTO_MAX_SIDE,
+    quality=MEDIA_PHOTO_QUALITY,
+)
+
+async def db_init() -> int:
+    return await schema_db_init(db_pool, MigrationContext(CONTENT, _epoch(_next_unlock_time())))
 
 async def db_upsert_user(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
+    due = _epoch(_next_unlock_time())
+    async with db_pool.transaction() as db:
+        cur = await db.execute(
             "INSERT OR IGNORE INTO users(user_id, next_unlock_at) VALUES(?, ?)",
-            (user_id, _next_unlock_time().isoformat()),
+            (user_id, due),
         )
-        await db.commit()
-
-async def db_get_user(user_id: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+        inserted = cur.rowcount == 1
+        await cur.close()
+        if not inserted:
+            # вернулся после блокировки — снова получает рассылки
+            await db.execute(
+                "UPDATE users SET blocked_at=NULL WHERE user_id=? AND blocked_at IS NOT NULL",
+                (user_id,),
+            )
+    if inserted:
+        _schedule_unlock(due)
+
+def _schedule_unlock(due: int):
+    # таймер открытия дней один на весь бот — в шарде 0
+    if shard_bus is None or SHARD_INDEX == 0:
+        unlock_scheduler.schedule(due)
+    else:
+        shard_bus.send(0, "unlock_due", due)
+
+async def _db_load_user(user_id: int) -> Optional[Dict[str, Any]]:
+    async with db_pool.acquire() as db:
         cur = await db.execute(
-            "SELECT user_id, opened_day, active_day, active_step, mode, sparks, codes, next_unlock_at "
+            "SELECT user_id, opened_day, active_day, active_step, mode, sparks_mask, next_unlock_at "
             "FROM users WHERE user_id=?",
             (user_id,),
         )
         row = await cur.fetchone()
-        if not row:
-            return None
-        return {
-            "user_id": row[0],
-            "opened_day": row[1],
-            "active_day": row[2],
-            "active_step": row[3],
-            "mode": row[4],
-            "sparks": row[5],
-            "codes": row[6],
-            "next_unlock_at": row[7],
-        }
-
-async def db_get_all_user_ids() -> List[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT user_id FROM users")
+        await cur.close()
+    if not row:
+        return None
+    return {
+        "user_id": row[0],
+        "opened_day": row[1],
+        "active_day": row[2],
+        "active_step": row[3],
+        "mode": row[4],
+        "sparks_mask": row[5],
+        "next_unlock_at": row[6],
+    }
+
+# Состояние пользователей читается из памяти; шаг и режим пишутся в БД пачками
+user_cache = UserStateCache(
+    db_pool,
+    _db_load_user,
+    capacity=USER_CACHE_SIZE,
+    flush_interval=USER_CACHE_FLUSH_MS / 1000,
+)
+
+async def db_get_user(user_id: int) -> Optional[Dict[str, Any]]:
+    return await user_cache.get(user_id)
+
+async def db_get_unlock_due_times() -> List[int]:
+    async with db_pool.acquire() as db:
+        cur = await db.execute(
+            "SELECT DISTINCT next_unlock_at FROM users WHERE opened_day < 7"
+        )
         rows = await cur.fetchall()
+        await cur.close()
     return [row[0] for row in rows]
 
 async def db_set_progress(user_id: int, active_day: int, active_step: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET active_day=?, active_step=? WHERE user_id=?",
-            (active_day, active_step, user_id),
-        )
-        await db.commit()
+    # в БД уйдёт со следующим сбросом user_cache
+    user_cache.set_progress(user_id, active_day, active_step)
 
 async def db_set_mode(user_id: int, mode: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET mode=? WHERE user_id=?",
-            (mode, user_id),
-        )
-        await db.commit()
+    user_cache.set_mode(user_id, mode)
 
-async def db_add_spark_code(user_id: int, spark: str, code: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT sparks, codes FROM users WHERE user_id=?", (user_id,))
-        row = await cur.fetchone()
-        sparks = _add_unique_pipe(row[0], spark)
-        codes = _add_unique_pipe(row[1], code)
-        await db.execute(
-            "UPDATE users SET sparks=?, codes=? WHERE user_id=?",
-            (sparks, codes, user_id),
+async def db_add_spark(user_id: int, day: int):
+    """
+    Искра и буква дня: одно атомарное UPDATE, повторное нажатие ничего не меняет.
+    """
+    async with db_pool.transaction() as db:
+        cur = await db.execute(
+            "UPDATE users SET sparks_mask = sparks_mask | ? WHERE user_id=? RETURNING sparks_mask",
+            (_spark_bit(day), user_id),
         )
-        await db.commit()
+        row = await cur.fetchone()
+        await cur.close()
+    if row:
+        user_cache.update(user_id, sparks_mask=row[0])
 
 async def db_unlock_next_day_for_due_users():
     """
-    Проверяем каждые 5 минут:
-    если next_unlock_at <= now и opened_day < 7 -> opened_day++ и next_unlock_at += 1 день
+    Вызывается планировщиком, когда подошёл ближайший next_unlock_at:
+    если next_unlock_at <= now и opened_day < 7 -> opened_day++ и next_unlock_at += 1 день.
+    Выборка идёт по индексу (next_unlock_at, opened_day), все due-пользователи
+    сдвигаются одним UPDATE ... RETURNING в одной транзакции.
     """
-    now = _now()
+    now = _epoch(_now())
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with db_pool.transaction() as db:
         cur = await db.execute(
-            "SELECT user_id, opened_day, next_unlock_at FROM users"
+            "UPDATE users SET opened_day = opened_day + 1, next_unlock_at = next_unlock_at + ? "
+            "WHERE next_unlock_at <= ? AND opened_day < 7 "
+            "RETURNING user_id, opened_day, next_unlock_at",
+            (DAY_SECONDS, now),
         )
-        users = await cur.fetchall()
+        unlocked = await cur.fetchall()
+        await cur.close()
 
-    for user_id, opened_day, next_unlock_at in users:
-        try:
-            due = datetime.fromisoformat(next_unlock_at)
-        except Exception:
-            due = _next_unlock_time()
-
-        if opened_day >= 7:
-            continue
-
-        if due <= now:
-            new_day = opened_day + 1
-            # следующий unlock — через сутки (в то же время)
-            new_due = due + timedelta(days=1)
-
-            async with aiosqlite.connect(DB_PATH) as db:
-                await db.execute(
-                    "UPDATE users SET opened_day=?, next_unlock_at=? WHERE user_id=?",
-                    (new_day, new_due.isoformat(), user_id),
-                )
-                await db.commit()
-
-            # уведомление
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"🐶✨ Доступен новый день адвента: <b>День {new_day}</b>!\n"
-                    f"Жми «Открыть доступный день» 🙂",
-                    reply_markup=menu_kb()
-                )
-            except Exception:
-                # пользователь мог заблокировать бота — игнорим
-                pass
+    for user_id, new_day, next_due in unlocked:
+        user_cache.update(user_id, opened_day=new_day, next_unlock_at=next_due)
+        if new_day < 7:
+            unlock_scheduler.schedule(next_due)
+
+    if not unlocked:
+        return
+
+    if shard_bus is not None:
+        # кеш пользователя живёт в его шарде: отправляем туда раньше уведомления,
+        # очередь шарда FIFO, так что нажатие «Открыть день» увидит новый opened_day
+        by_shard: Dict[int, List[Tuple[int, int, int]]] = {}
+        for user_id, new_day, next_due in unlocked:
+            shard = shard_bus.shard_of(user_id)
+            if shard != SHARD_INDEX:
+                by_shard.setdefault(shard, []).append((user_id, new_day, next_due))
+        for shard, rows in by_shard.items():
+            shard_bus.send(shard, "unlocked", rows)
+
+    # уведомления уходят параллельно, в пределах лимитов Telegram
+    new_days = {user_id: new_day for user_id, new_day, _ in unlocked}
+
+    async def notify(user_id: int):
+        await bot.send_message(
+            user_id,
+            f"🐶✨ Доступен новый день адвента: <b>День {new_days[user_id]}</b>!\n"
+            f"Жми «Открыть доступный день» 🙂",
+            reply_markup=menu_kb()
+        )
+
+    await notify_dispatcher.run(new_days, notify)
 
 # ----------------------------
 # 4) UI (KEYBOARDS)
 # ----------------------------
+# Таблица callback-действий: имя совпадает с action кнопки в days.yaml, код — один символ
+# в callback_data (формат и разбор старых "next:4:2" — в callbacks.py). Хендлеры — в разделе 6.
+callbacks = CallbackRouter()
+for _name, _code in (
+    ("menu", "m"), ("progress", "p"), ("open_day", "o"), ("noop", "x"),
+    ("next", "n"), ("set_mode", "s"), ("glow", "g"), ("aroma", "a"), ("get_spark", "k"),
+):
+    callbacks.declare(_name, _code)
+
+@lru_cache(maxsize=None)
 def menu_kb():
+    # одна и та же клавиатура для всех сообщений — собираем один раз
     kb = InlineKeyboardBuilder()
-    kb.button(text="📖 Открыть доступный день", callback_data="open_day")
-    kb.button(text="✨ Прогресс", callback_data="progress")
+    kb.button(text="📖 Открыть доступный день", callback_data=callbacks.encode("open_day"))
+    kb.button(text="✨ Прогресс", callback_data=callbacks.encode("progress"))
     kb.adjust(1)
-    return kb.as_markup()
+    return freeze_markup(kb.as_markup())
+
+@lru_cache(maxsize=None)
+def back_to_menu_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⬅️ В меню", callback_data=callbacks.encode("menu"))
+    kb.adjust(1)
+    return freeze_markup(kb.as_markup())
+
+def _button_data(action: str, day: int, step_idx: int, value: Optional[str]) -> str:
+    # что упаковать, определяется формой действия: шаговые — день и шаг, искра — день
+    if action not in callbacks:
+        # на будущее — свои экшены
+        return callbacks.encode("noop")
+    if action == "get_spark":
+        return callbacks.encode(action, day)
+    if BUTTON_ACTIONS.get(action):
+        return callbacks.encode(action, day, step_idx, value=value)
+    return callbacks.encode(action)
 
 def build_step_kb(day: int, step_idx: int, step: Dict[str, Any], total_steps: int):
     kb = InlineKeyboardBuilder()
@@ -683,31 +420,17 @@ def build_step_kb(day: int, step_idx: int, step: Dict[str, Any], total_steps: in
     buttons = step.get("buttons")
     if buttons:
         for b in buttons:
-            text = b["text"]
             action = b.get("action", "")
             if action == "url":
-                kb.button(text=text, url=b["url"])
-            elif action == "set_mode":
-                kb.button(text=text, callback_data=f"mode:{day}:{step_idx}:{b['value']}")
-            elif action == "glow":
-                kb.button(text=text, callback_data=f"glow:{day}:{step_idx}:{b['value']}")
-            elif action == "aroma":
-                kb.button(text=text, callback_data=f"aroma:{day}:{step_idx}:{b['value']}")
-            elif action == "get_spark":
-                kb.button(text=text, callback_data=f"spark:{day}")
-            elif action == "menu":
-                kb.button(text=text, callback_data="menu")
-            elif action == "next":
-                kb.button(text=text, callback_data=f"next:{day}:{step_idx}")
+                kb.button(text=b["text"], url=b["url"])
             else:
-                # на будущее — свои экшены
-                kb.button(text=text, callback_data=f"noop")
+                kb.button(text=b["text"], callback_data=_button_data(action, day, step_idx, b.get("value")))
         kb.adjust(1)
         return kb.as_markup()
 
     # Если нет кастомных кнопок — делаем "Дальше" автоматически
     if step.get("next", False) and step_idx < total_steps - 1:
-        kb.button(text="➡️ Дальше", callback_data=f"next:{day}:{step_idx}")
+        kb.button(text="➡️ Дальше", callback_data=callbacks.encode("next", day, step_idx))
         kb.adjust(1)
         return kb.as_markup()
 
@@ -716,86 +439,116 @@ def build_step_kb(day: int, step_idx: int, step: Dict[str, Any], total_steps: in
         return None
 
     # Если последний шаг без кнопок — хотя бы меню
-    kb.button(text="⬅️ В меню", callback_data="menu")
+    kb.button(text="⬅️ В меню", callback_data=callbacks.encode("menu"))
     kb.adjust(1)
     return kb.as_markup()
 
+# CONTENT компилируется один раз: клавиатуры и медиа шагов готовы заранее
+COMPILED: Dict[int, CompiledDay] = compile_content(CONTENT, build_step_kb)
+
+def reload_content() -> Dict[int, CompiledDay]:
+    """
+    Перечитывает CONTENT_PATH и атомарно подменяет контент без перезапуска polling.
+    При ошибке проверки (ContentError) остаётся старый контент.
+    """
+    global CONTENT, COMPILED
+    content = load_content(CONTENT_PATH, CONTENT_REQUIRED_STEPS)
+    compiled = compile_content(content, build_step_kb)
+    CONTENT, COMPILED = content, compiled
+    # буквы в подписи прогресса берутся из контента
+    _progress_caption.cache_clear()
+    return compiled
+
 # ----------------------------
 # 5) SENDER (step engine)
 # ----------------------------
-async def send_step(chat_id: int, day: int, step_idx: int):
-    day_data = CONTENT.get(day)
+async def send_after(chat_id: int, a: CompiledMedia):
+    at = a.type
+    message = None
+    if at == "voice":
+        message = await bot.send_voice(chat_id, await _resolve_media_source(a))
+    elif at == "photo":
+        message = await bot.send_photo(chat_id, await _resolve_media_source(a), caption=a.caption or "")
+    elif at == "video":
+        message = await bot.send_video(chat_id, await _resolve_media_source(a), caption=a.caption)
+    elif at == "video_note":
+        message = await bot.send_video_note(chat_id, await _resolve_media_source(a))
+    elif at == "sticker":
+        await bot.send_sticker(chat_id, a.file_id)
+    elif at == "text":
+        await bot.send_message(chat_id, a.text)
+    await _remember_media(a, message)
+
+async def send_step(chat_id: int, day: int, step_idx: int) -> bool:
+    """
+    Отправляет один шаг (и его after-сообщения). True — шаг доставлен.
+    Ошибки Telegram на самом шаге не перехватываются: их обрабатывает вызывающий (см. send_chain).
+    Ошибка after-сообщения только пишется в лог: шаг к этому моменту уже у пользователя.
+    """
+    day_data = COMPILED.get(day)
     if not day_data:
         await bot.send_message(chat_id, "Такого дня нет 😅", reply_markup=menu_kb())
-        return
+        return False
 
-    steps = day_data["steps"]
+    steps = day_data.steps
     if step_idx < 0 or step_idx >= len(steps):
         await bot.send_message(chat_id, "Этот день уже закончился 🙂", reply_markup=menu_kb())
-        return
+        return False
 
     step = steps[step_idx]
-    total = len(steps)
-    reply_markup = build_step_kb(day, step_idx, step, total)
+    reply_markup = step.reply_markup
 
-    t = step["type"]
+    t = step.type
 
     try:
+        message = None
         if t == "text":
-            await bot.send_message(chat_id, step["text"], reply_markup=reply_markup)
+            await bot.send_message(chat_id, step.text, reply_markup=reply_markup)
 
         elif t == "photo":
-            caption = step.get("caption", "")
-            await bot.send_photo(
+            message = await bot.send_photo(
                 chat_id,
-                _resolve_media_source(step),
-                caption=caption,
+                await _resolve_media_source(step),
+                caption=step.caption or "",
                 reply_markup=reply_markup
             )
 
         elif t == "voice":
-            await bot.send_voice(chat_id, _resolve_media_source(step), reply_markup=reply_markup)
+            message = await bot.send_voice(chat_id, await _resolve_media_source(step), reply_markup=reply_markup)
 
         elif t == "video":
-            caption = step.get("caption", None)
-            await bot.send_video(
+            message = await bot.send_video(
                 chat_id,
-                _resolve_media_source(step),
-                caption=caption,
+                await _resolve_media_source(step),
+                caption=step.caption,
                 reply_markup=reply_markup
             )
 
         elif t == "video_note":
-            await bot.send_video_note(chat_id, _resolve_media_source(step), reply_markup=reply_markup)
+            message = await bot.send_video_note(chat_id, await _resolve_media_source(step), reply_markup=reply_markup)
 
         elif t == "sticker":
             # sticker отправляется по file_id
-            await bot.send_sticker(chat_id, step["file_id"], reply_markup=reply_markup)
+            await bot.send_sticker(chat_id, step.file_id, reply_markup=reply_markup)
 
         else:
             await bot.send_message(chat_id, f"Неизвестный тип шага: {t}", reply_markup=menu_kb())
 
-        # Автосообщения после шага (например голосовое после открытки)
-        after = step.get("after") or []
-        for a in after:
-            at = a["type"]
-            if at == "voice":
-                await bot.send_voice(chat_id, _resolve_media_source(a))
-            elif at == "photo":
-                await bot.send_photo(chat_id, _resolve_media_source(a), caption=a.get("caption", ""))
-            elif at == "video":
-                await bot.send_video(chat_id, _resolve_media_source(a), caption=a.get("caption"))
-            elif at == "video_note":
-                await bot.send_video_note(chat_id, _resolve_media_source(a))
-            elif at == "sticker":
-                await bot.send_sticker(chat_id, a["file_id"])
-            elif at == "text":
-                await bot.send_message(chat_id, a["text"])
+        await _remember_media(step, message)
+
+        # Автосообщения после шага (например голосовое после открытки).
+        # Шаг с кнопками уже доставлен: сбой after-сообщения его не откатывает.
+        for a in step.after:
+            if a.optional and a.file and not a.file_id and not os.path.isfile(a.file):
+                continue
+            try:
+                await send_after(chat_id, a)
+            except (TelegramAPIError, FileNotFoundError, ValueError) as err:
+                logging.warning("after message of %s:%s to %s failed: %s", day, step_idx, chat_id, err)
 
         if day == 6 and step_idx == 2:
-            await sleep(DAY6_LETTER_DELAY)
-            await db_set_progress(chat_id, active_day=6, active_step=3)
-            await send_step(chat_id, 6, 3)
+            # первый вопрос письма — через паузу, хендлер не ждёт
+            await delayed_steps.enqueue(chat_id, 6, 3, DAY6_LETTER_DELAY, expect=(6, 2))
 
     except (FileNotFoundError, ValueError) as err:
         await bot.send_message(
@@ -803,6 +556,47 @@ async def send_step(chat_id: int, day: int, step_idx: int):
             f"⚠️ Не вышло отправить медиа: {err}",
             reply_markup=menu_kb()
         )
+        return False
+    return True
+
+def _chat_unavailable(err: TelegramAPIError) -> bool:
+    return isinstance(err, (TelegramForbiddenError, TelegramNotFound)) or "chat not found" in err.message.lower()
+
+async def send_chain(chat_id: int, day: int, first: int, last: Optional[int] = None, delay: float = 0.0) -> Optional[int]:
+    """
+    Отправляет шаги first..last дня по порядку (между ними пауза delay, для длинных пауз —
+    delayed_steps) и возвращает последний доставленный шаг (None — ни одного).
+
+    Прогресс пишется один раз и сразу на last: старые кнопки тут же становятся неактуальными,
+    повторное нажатие не отправит цепочку второй раз. Если шаг не ушёл (ошибка Telegram или медиа),
+    цепочка останавливается, а пользователь остаётся на последнем доставленном шаге.
+    Если чат сообщений не примет (бот заблокирован, чат не найден), после отката прогресса
+    поднимается ChatUnavailable — отложенный шаг по нему удаляется, а не повторяется.
+    """
+    last = first if last is None else last
+    user = await db_get_user(chat_id)
+    previous = (user["active_day"], user["active_step"]) if user else None
+    await db_set_progress(chat_id, active_day=day, active_step=last)
+
+    delivered: Optional[int] = None
+    try:
+        for step_idx in range(first, last + 1):
+            if delay and step_idx > first:
+                await asyncio.sleep(delay)
+            if not await send_step(chat_id, day, step_idx):
+                break
+            delivered = step_idx
+    except TelegramAPIError as err:
+        logging.warning("chain %s:%s-%s to %s stopped: %s", day, first, last, chat_id, err)
+        if _chat_unavailable(err):
+            raise ChatUnavailable(err.message) from err
+    finally:
+        if delivered != last:
+            if delivered is not None:
+                await db_set_progress(chat_id, active_day=day, active_step=delivered)
+            elif previous is not None:
+                await db_set_progress(chat_id, active_day=previous[0], active_step=previous[1])
+    return delivered
 
 # ----------------------------
 # 6) HANDLERS
@@ -810,9 +604,8 @@ async def send_step(chat_id: int, day: int, step_idx: int):
 @dp.message(F.text == "/start")
 async def cmd_start(m: Message):
     await db_upsert_user(m.from_user.id)
-    photo_meta = {"file_id": PROGRESS_PHOTO_ID} if PROGRESS_PHOTO_ID else {"file": "media/img1.png"}
-    await m.answer_photo(
-        _resolve_media_source(photo_meta),
+    message = await m.answer_photo(
+        await _resolve_media_source(PROGRESS_PHOTO),
         caption=(
             "Привет! Я Вайбик 🐶✨\n"
             "Здесь будет новогодняя история на <b>7 дней</b>.\n\n"
@@ -820,6 +613,45 @@ async def cmd_start(m: Message):
         ),
         reply_markup=menu_kb()
     )
+    await _remember_media(PROGRESS_PHOTO, message)
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} с"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes} мин {seconds} с"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} ч {minutes} мин"
+
+def _format_broadcast(job: Dict[str, Any]) -> str:
+    status = "идёт" if job["status"] == "running" else "завершена"
+    done = job["sent"] + job["failed"]
+    lines = [
+        f"📣 Рассылка #{job['id']}: {status}",
+        f"Обработано: {done}/{job['total']}",
+        f"Успешно: {job['sent']}, ошибок: {job['failed']}",
+    ]
+    if job.get("rate"):
+        lines.append(f"Скорость: {job['rate']:.1f} сообщ./с")
+    if job.get("eta") is not None:
+        lines.append(f"Осталось: ~{_format_duration(job['eta'])}")
+    return "\n".join(lines)
+
+# /broadcast_status регистрируем раньше /broadcast: оба начинаются с "/broadcast"
+@dp.message(F.text.startswith("/broadcast_status"))
+async def cmd_broadcast_status(m: Message):
+    if m.from_user.id != ADMIN_CHAT_ID:
+        await m.answer("Эта команда доступна только администратору.")
+        return
+
+    arg = (m.text or "").partition(" ")[2].strip()
+    job = await broadcast_runner.get(int(arg) if arg.isdigit() else None)
+    if not job:
+        await m.answer("Рассылок пока не было.")
+        return
+    await m.answer(_format_broadcast(job))
 
 @dp.message(F.text.startswith("/broadcast"))
 async def cmd_broadcast(m: Message):
@@ -832,55 +664,133 @@ async def cmd_broadcast(m: Message):
         await m.answer("Напиши так: /broadcast твой текст")
         return
 
-    user_ids = await db_get_all_user_ids()
-    sent = 0
-    failed = 0
-    for user_id in user_ids:
-        try:
-            await bot.send_message(user_id, text)
-            sent += 1
-        except Exception:
-            failed += 1
-        if BROADCAST_DELAY:
-            await sleep(BROADCAST_DELAY)
+    # рассылка идёт в фоне: хендлер сразу освобождается, прогресс — в /broadcast_status
+    broadcast_id = await broadcast_runner.create(text, author_id=m.from_user.id)
+    if shard_bus is not None and SHARD_INDEX != 0:
+        # рассылки выполняет шард 0
+        shard_bus.send(0, "broadcast_wake")
+    await m.answer(f"Рассылка #{broadcast_id} запущена. Прогресс: /broadcast_status {broadcast_id}")
+
+@dp.message(F.text == "/reload")
+async def cmd_reload(m: Message):
+    if m.from_user.id != ADMIN_CHAT_ID:
+        await m.answer("Эта команда доступна только администратору.")
+        return
+
+    try:
+        compiled = reload_content()
+    except ContentError as err:
+        errors = "\n".join(f"• {html.escape(e)}" for e in err.errors[:20])
+        await m.answer(f"⚠️ Контент не обновлён, ошибки в {html.escape(err.path)}:\n{errors}")
+        return
 
-    await m.answer(f"Рассылка завершена. Успешно: {sent}, ошибок: {failed}.")
+    if shard_bus is not None:
+        shard_bus.broadcast("reload")
+    steps = sum(len(d.steps) for d in compiled.values())
+    await m.answer(f"Контент обновлён: дней {len(compiled)}, шагов {steps}.")
 
-@dp.callback_query(F.data == "menu")
-async def cb_menu(c: CallbackQuery):
+@dp.message(F.text == "/stats")
+async def cmd_stats(m: Message):
+    if m.from_user.id != ADMIN_CHAT_ID:
+        await m.answer("Эта команда доступна только администратору.")
+        return
+
+    if not metrics.enabled:
+        await m.answer("Метрики выключены (METRICS_ENABLED=0).")
+        return
+    title = f"📊 Шард {SHARD_INDEX}\n" if shard_bus is not None else "📊 "
+    await m.answer(f"{title}<pre>{html.escape(metrics.render_text())}</pre>")
+
+@dp.message(F.text.startswith("/funnel"))
+async def cmd_funnel(m: Message):
+    """
+    /funnel — воронка по счётчикам (без прохода по users);
+    /funnel check — пересчитать с нуля и показать расхождения, /funnel fix — ещё и исправить.
+    """
+    if m.from_user.id != ADMIN_CHAT_ID:
+        await m.answer("Эта команда доступна только администратору.")
+        return
+
+    arg = m.text.removeprefix("/funnel").strip()
+    if arg in ("check", "fix"):
+        # BEGIN IMMEDIATE до подсчёта: запись в users ждёт COMMIT, счётчики и users сравниваются на одном снимке
+        async with db_pool.transaction() as db:
+            stored = await funnel.read_counters(db)
+            actual = await funnel.rebuild(db) if arg == "fix" else await funnel.count_from_scratch(db)
+        mismatches = funnel.diff(stored, actual)
+        if not mismatches:
+            await m.answer("✅ Счётчики воронки сходятся с users.")
+            return
+        lines = [f"{metric} {key}: было {was}, на самом деле {real}" for metric, key, was, real in mismatches[:50]]
+        title = "🛠 Исправлено" if arg == "fix" else "⚠️ Расхождения (исправить: /funnel fix)"
+        await m.answer(f"{title}: {len(mismatches)}\n<pre>{html.escape(chr(10).join(lines))}</pre>")
+        return
+
+    async with db_pool.acquire() as db:
+        counters = await funnel.read_counters(db)
+    titles = {number: day.title for number, day in COMPILED.items()}
+    await m.answer(f"📈 <b>Воронка</b>\n<pre>{html.escape(funnel.format_funnel(counters, titles))}</pre>")
+
+@callbacks.on("menu")
+async def cb_menu(c: CallbackQuery, _cb: CallbackData):
     await c.message.answer("Меню:", reply_markup=menu_kb())
     await c.answer()
 
-@dp.callback_query(F.data == "progress")
-async def cb_progress(c: CallbackQuery):
+@lru_cache(maxsize=256)
+def _progress_caption(opened_day: int, sparks_mask: int) -> str:
+    # состояний немного (день x набор искр), подпись собирается один раз на каждое
+    spark_days = _spark_days(sparks_mask)
+    codes = [COMPILED[d].code_part for d in spark_days if d in COMPILED and COMPILED[d].code_part]
+    return (
+        f"✨ <b>Твой прогресс</b>\n\n"
+        f"Открыто дней: <b>{opened_day}/7</b>\n"
+        f"Искры: <b>{len(spark_days)}/6</b>\n"
+        f"Буквы: <b>{len(codes)}/6</b>\n\n"
+        f"Буквы: {', '.join(codes) if spark_days else 'пока нет'}"
+    )
+
+@callbacks.on("progress")
+async def cb_progress(c: CallbackQuery, _cb: CallbackData):
     user = await db_get_user(c.from_user.id)
     if not user:
         await db_upsert_user(c.from_user.id)
         user = await db_get_user(c.from_user.id)
 
-    sparks = _split_pipe(user["sparks"])
-    codes = _split_pipe(user["codes"])
-    opened_day = user["opened_day"]
-
-    text = (
-        f"✨ <b>Твой прогресс</b>\n\n"
-        f"Открыто дней: <b>{opened_day}/7</b>\n"
-        f"Искры: <b>{len(sparks)}/6</b>\n"
-        f"Буквы: <b>{len(codes)}/6</b>\n\n"
-        f"Буквы: {', '.join(codes) if sparks else 'пока нет'}"
-    )
-    media_meta = {"file_id": PROGRESS_PHOTO_ID} if PROGRESS_PHOTO_ID else {"file": "media/img1.png"}
-    await c.message.answer_photo(
-        _resolve_media_source(media_meta),
+    text = _progress_caption(user["opened_day"], user["sparks_mask"])
+    # нажали на карточке с картинкой (/start или прошлый прогресс) — меняем подпись на месте,
+    # без новой отправки фото; новая карточка — только если править нечего или не вышло
+    if isinstance(c.message, Message) and c.message.photo:
+        try:
+            await c.message.edit_caption(caption=text, reply_markup=menu_kb())
+            await c.answer()
+            return
+        except TelegramBadRequest as err:
+            if "message is not modified" in str(err):
+                await c.answer()
+                return
+            logging.warning("progress card edit failed, sending a new one: %s", err)
+        except TelegramAPIError as err:
+            logging.warning("progress card edit failed, sending a new one: %s", err)
+
+    message = await c.message.answer_photo(
+        await _resolve_media_source(PROGRESS_PHOTO),
         caption=text,
         reply_markup=menu_kb()
     )
+    await _remember_media(PROGRESS_PHOTO, message)
     await c.answer()
 
 STEP_DELAY = float(os.getenv("STEP_DELAY", "1.5"))
 
-@dp.callback_query(F.data == "open_day")
-async def cb_open_day(c: CallbackQuery):
+async def _ack(c: CallbackQuery, text: Optional[str] = None):
+    # ответ на нажатие убирает «часики» у кнопки; если он не ушёл, шаги всё равно отправляем
+    try:
+        await c.answer(text)
+    except TelegramAPIError as err:
+        logging.warning("callback answer failed: %s", err)
+
+@callbacks.on("open_day")
+async def cb_open_day(c: CallbackQuery, _cb: CallbackData):
     user = await db_get_user(c.from_user.id)
     if not user:
         await db_upsert_user(c.from_user.id)
@@ -890,19 +800,27 @@ async def cb_open_day(c: CallbackQuery):
     # начинаем день с первого шага
     await db_set_progress(c.from_user.id, active_day=day, active_step=0)
 
-    title = CONTENT.get(day, {}).get("title", f"День {day}")
+    day_data = COMPILED.get(day)
+    title = day_data.title if day_data else f"День {day}"
+    await c.answer()
     await c.message.answer(f"📅 <b>{title}</b>\n(пойдём по сообщениям шаг за шагом)", reply_markup=None)
-    await sleep(STEP_DELAY)
-    await send_step(c.from_user.id, day, 0)
+    await delayed_steps.enqueue(c.from_user.id, day, 0, STEP_DELAY, expect=(day, 0))
+
+@callbacks.on("noop")
+async def cb_noop(c: CallbackQuery, _cb: CallbackData):
     await c.answer()
 
-@dp.callback_query(F.data.startswith("next:"))
-async def cb_next(c: CallbackQuery):
-    # next:day:step
-    _, day_s, step_s = c.data.split(":")
-    day = int(day_s)
-    step_idx = int(step_s)
+# Кнопки шага: день и шаг в callback_data, защита от старых кнопок, затем цепочка следующих
+# шагов — сколько, задаёт BUTTON_ACTIONS. Действие -> (ответ на нажатие, что сохранить).
+STEP_ACTIONS = {
+    "next": (None, None),
+    "set_mode": ("Принято ✅", db_set_mode),
+    "glow": ("Сияние активировано ✨", None),
+    "aroma": ("Аромат сохранён 🌸", None),
+}
 
+async def cb_step_action(c: CallbackQuery, cb: CallbackData):
+    day, step_idx = cb.day, cb.step
     user = await db_get_user(c.from_user.id)
     if not user:
         await c.answer("Нажми /start 🙂", show_alert=True)
@@ -913,127 +831,37 @@ async def cb_next(c: CallbackQuery):
         await c.answer("Эта кнопка уже неактуальна 🙂", show_alert=False)
         return
 
+    ack_text, save = STEP_ACTIONS[cb.action]
+    if save is not None:
+        await save(c.from_user.id, cb.value)
+    await _ack(c, ack_text)
     # убираем кнопки у прошлого сообщения (чтобы не нажимали по 10 раз)
     try:
         await c.message.edit_reply_markup(reply_markup=None)
     except Exception:
         pass
 
-    new_step = step_idx + 1
-    await db_set_progress(c.from_user.id, active_day=day, active_step=new_step)
-    await send_step(c.from_user.id, day, new_step)
-    await c.answer()
+    # например, после выбора режима: ответ (следующий шаг) и финал (ещё следующий)
+    await send_chain(c.from_user.id, day, step_idx + 1, step_idx + BUTTON_ACTIONS[cb.action])
 
-@dp.callback_query(F.data.startswith("mode:"))
-async def cb_mode(c: CallbackQuery):
-    # mode:day:step:value
-    _, day_s, step_s, value = c.data.split(":")
-    day = int(day_s)
-    step_idx = int(step_s)
+for _name in STEP_ACTIONS:
+    callbacks.bind(_name, cb_step_action)
 
-    user = await db_get_user(c.from_user.id)
-    if not user:
-        await c.answer("Нажми /start 🙂", show_alert=True)
-        return
-
-    if user["active_day"] != day or user["active_step"] != step_idx:
-        await c.answer("Эта кнопка уже неактуальна 🙂", show_alert=False)
-        return
-
-    await db_set_mode(c.from_user.id, value)
-
-    # уберём кнопки выбора режима у сообщения
-    try:
-        await c.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
-
-    # после выбора режима автоматически отправим:
-    # 1) ответ (следующий шаг)
-    # 2) финал (ещё следующий шаг)
-    await db_set_progress(c.from_user.id, active_day=day, active_step=step_idx + 1)
-    await send_step(c.from_user.id, day, step_idx + 1)
-
-    await db_set_progress(c.from_user.id, active_day=day, active_step=step_idx + 2)
-    await send_step(c.from_user.id, day, step_idx + 2)
-
-    await c.answer("Принято ✅")
-
-@dp.callback_query(F.data.startswith("glow:"))
-async def cb_glow(c: CallbackQuery):
-    # glow:day:step:value
-    _, day_s, step_s, _choice = c.data.split(":")
-    day = int(day_s)
-    step_idx = int(step_s)
+@callbacks.on("get_spark")
+async def cb_spark(c: CallbackQuery, cb: CallbackData):
+    day = cb.day
 
     user = await db_get_user(c.from_user.id)
     if not user:
         await c.answer("Нажми /start 🙂", show_alert=True)
         return
 
-    if user["active_day"] != day or user["active_step"] != step_idx:
-        await c.answer("Эта кнопка уже неактуальна 🙂", show_alert=False)
-        return
-
-    try:
-        await c.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
-
-    await db_set_progress(c.from_user.id, active_day=day, active_step=step_idx + 1)
-    await send_step(c.from_user.id, day, step_idx + 1)
-
-    await db_set_progress(c.from_user.id, active_day=day, active_step=step_idx + 2)
-    await send_step(c.from_user.id, day, step_idx + 2)
-
-    await c.answer("Сияние активировано ✨")
-
-@dp.callback_query(F.data.startswith("aroma:"))
-async def cb_aroma(c: CallbackQuery):
-    # aroma:day:step:value
-    _, day_s, step_s, _choice = c.data.split(":")
-    day = int(day_s)
-    step_idx = int(step_s)
-
-    user = await db_get_user(c.from_user.id)
-    if not user:
-        await c.answer("Нажми /start 🙂", show_alert=True)
-        return
-
-    if user["active_day"] != day or user["active_step"] != step_idx:
-        await c.answer("Эта кнопка уже неактуальна 🙂", show_alert=False)
-        return
-
-    try:
-        await c.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
-
-    await db_set_progress(c.from_user.id, active_day=day, active_step=step_idx + 1)
-    await send_step(c.from_user.id, day, step_idx + 1)
-
-    await db_set_progress(c.from_user.id, active_day=day, active_step=step_idx + 2)
-    await send_step(c.from_user.id, day, step_idx + 2)
-
-    await c.answer("Аромат сохранён 🌸")
-
-@dp.callback_query(F.data.startswith("spark:"))
-async def cb_spark(c: CallbackQuery):
-    # spark:day
-    _, day_s = c.data.split(":")
-    day = int(day_s)
-
-    user = await db_get_user(c.from_user.id)
-    if not user:
-        await c.answer("Нажми /start 🙂", show_alert=True)
-        return
-
-    day_data = CONTENT.get(day)
+    day_data = COMPILED.get(day)
     if not day_data:
         await c.answer("Странно… такого дня нет", show_alert=True)
         return
 
-    await db_add_spark_code(c.from_user.id, day_data["spark_name"], day_data["code_part"])
+    await db_add_spark(c.from_user.id, day)
 
     # убираем кнопки у сообщения с искрой
     try:
@@ -1042,21 +870,38 @@ async def cb_spark(c: CallbackQuery):
         pass
 
     caption = (
-        f"✨ Ты получила: <b>{day_data['spark_name']}</b>\n"
-        f"🔑 Одна буква секретного слова: <code>{day_data['code_part']}</code>\n\n"
+        f"✨ Ты получила: <b>{day_data.spark_name}</b>\n"
+        f"🔑 Одна буква секретного слова: <code>{day_data.code_part}</code>\n\n"
         "Увидимся завтра 🤍"
     )
-    kb = InlineKeyboardBuilder()
-    kb.button(text="⬅️ В меню", callback_data="menu")
-    kb.adjust(1)
-
     await c.message.answer_photo(
-        _resolve_media_source({"file_id": "AgACAgIAAxkBAAOvaUgnNw2JzDxnByBIIpwFPoQob4IAAhAPaxt2VUFKQl2M5j59ho0BAAMCAAN5AAM2BA"}),
+        "AgACAgIAAxkBAAOvaUgnNw2JzDxnByBIIpwFPoQob4IAAhAPaxt2VUFKQl2M5j59ho0BAAMCAAN5AAM2BA",
         caption=caption,
-        reply_markup=kb.as_markup()
+        reply_markup=back_to_menu_kb()
     )
     await c.answer("Искра добавлена ✅")
 
+@dp.callback_query(callbacks)
+async def on_callback(c: CallbackQuery, callback: CallbackData):
+    # единственная точка входа: data уже разобрана фильтром, действие — поиск по таблице
+    await callbacks.dispatch(c, callback)
+
+def _check_callback_actions():
+    """
+    Действия кнопок описаны в трёх местах: BUTTON_ACTIONS (content.py, по нему проверяется days.yaml),
+    коды в разделе 4 и хендлеры выше (шаговые — STEP_ACTIONS). Расхождение — ошибка при импорте,
+    а не кнопка, которая молча становится noop или не отвечает.
+    """
+    problems = [f"{name}: нет кода в callbacks" for name in BUTTON_ACTIONS if name != "url" and name not in callbacks]
+    stepping = {name for name, steps in BUTTON_ACTIONS.items() if steps}
+    if stepping != set(STEP_ACTIONS):
+        problems.append(f"шаговые действия BUTTON_ACTIONS {sorted(stepping)} != STEP_ACTIONS {sorted(STEP_ACTIONS)}")
+    problems += [f"{name}: нет хендлера" for name in callbacks.unbound()]
+    if problems:
+        raise RuntimeError("callback-действия не сходятся: " + "; ".join(problems))
+
+_check_callback_actions()
+
 @dp.message(F.text & ~F.text.startswith("/"))
 async def day6_letter_flow(m: Message):
     user = await db_get_user(m.from_user.id)
@@ -1080,28 +925,11 @@ async def day6_letter_flow(m: Message):
     user_name = m.from_user.full_name
     if m.from_user.username:
         user_name = f"{user_name} (@{m.from_user.username})"
-    admin_text = (
-        f"✉️ День 6 — {label_map.get(step_idx, 'Ответ')}\n"
-        f"От: {html.escape(user_name)} (id {m.from_user.id})\n\n"
-        f"{html.escape(answer)}"
-    )
-    try:
-        await bot.send_message(ADMIN_CHAT_ID, admin_text)
-    except Exception:
-        pass
-
-    if step_idx == 3:
-        await db_set_progress(m.from_user.id, active_day=6, active_step=4)
-        await send_step(m.from_user.id, 6, 4)
-        return
-
-    if step_idx == 4:
-        await db_set_progress(m.from_user.id, active_day=6, active_step=5)
-        await send_step(m.from_user.id, 6, 5)
-        return
+    # сначала в БД: админу ответ уйдёт дайджестом, даже если Telegram сейчас отвечает 429
+    await letter_digester.add(m.from_user.id, user_name, 6, step_idx, label_map.get(step_idx, "Ответ"), answer)
 
-    await db_set_progress(m.from_user.id, active_day=6, active_step=6)
-    await send_step(m.from_user.id, 6, 6)
+    # следующий вопрос (после третьего ответа — финал письма)
+    await send_chain(m.from_user.id, 6, step_idx + 1)
 
 # (опционально) ловушка file_id стикеров: отправь стикер боту, он пришлёт file_id
 @dp.message(F.sticker)
@@ -1113,45 +941,260 @@ async def photo_file_id(m: Message):
     user = await db_get_user(m.from_user.id)
     if user and user["active_day"] == 4 and user["active_step"] == 2:
         step_idx = user["active_step"]
-        try:
-            await bot.send_photo(791104636, m.photo[-1].file_id)
-        except Exception:
-            pass
-
-        await db_set_progress(m.from_user.id, active_day=4, active_step=step_idx + 1)
-        await send_step(m.from_user.id, 4, step_idx + 1)
-
-        # Pause before the gift step.
-        await sleep(DAY4_BEAGLE_DELAY)
-
-        await db_set_progress(m.from_user.id, active_day=4, active_step=step_idx + 2)
-        await send_step(m.from_user.id, 4, step_idx + 2)
+        user_name = m.from_user.full_name
+        if m.from_user.username:
+            user_name = f"{user_name} (@{m.from_user.username})"
+        # админу фото уйдёт альбомом из фоновой задачи, пользователь её не ждёт
+        await beagle_forwarder.add(m.from_user.id, user_name, m.photo[-1].file_id)
+
+        if await send_chain(m.from_user.id, 4, step_idx + 1) == step_idx + 1:
+            # Pause before the gift step (отложенное задание, хендлер не ждёт).
+            await delayed_steps.enqueue(
+                m.from_user.id, 4, step_idx + 2, DAY4_BEAGLE_DELAY, expect=(4, step_idx + 1)
+            )
         return
 
     await m.answer(f"file_id:\n<code>{m.photo[-1].file_id}</code>")
 
 
 # ----------------------------
-# 7) BACKGROUND LOOP (unlock checker)
+# 7) BACKGROUND (unlock scheduler)
 # ----------------------------
+async def _on_unlock_due(_due_times: List[Any]):
+    await db_unlock_next_day_for_due_users()
+
+# Спит ровно до ближайшего next_unlock_at; сроки добавляют db_upsert_user и сама разблокировка
+unlock_scheduler = Scheduler(_on_unlock_due)
+
+async def _send_broadcast_text(user_id: int, text: str):
+    await bot.send_message(user_id, text)
+
+async def _on_broadcast_done(job: Dict[str, Any]):
+    if job["author_id"]:
+        await bot.send_message(
+            job["author_id"],
+            f"Рассылка #{job['id']} завершена. Успешно: {job['sent']}, ошибок: {job['failed']}."
+        )
+
+# Задания рассылок хранятся в БД и после рестарта продолжаются с места остановки
+broadcast_runner = BroadcastRunner(
+    db_pool,
+    FanoutDispatcher(send_bucket, workers=FANOUT_WORKERS),
+    _send_broadcast_text,
+    chunk_size=BROADCAST_CHUNK_SIZE,
+    on_done=_on_broadcast_done,
+)
+
+async def _send_letters_digest(text: str):
+    await send_bucket.acquire()
+    await bot.send_message(LETTERS_CHAT_ID, text)
+
+letter_digester = LetterDigester(db_pool, _send_letters_digest, interval=LETTERS_DIGEST_INTERVAL)
+
+async def _send_beagle_album(photos: List[Tuple[str, str]]):
+    await send_bucket.acquire()
+    try:
+        if len(photos) == 1:
+            await bot.send_photo(BEAGLE_PHOTOS_CHAT_ID, photos[0][0], caption=photos[0][1])
+        else:
+            await bot.send_media_group(
+                BEAGLE_PHOTOS_CHAT_ID, [InputMediaPhoto(media=file_id, caption=text) for file_id, text in photos]
+            )
+    except TelegramBadRequest as err:
+        # виноваты сами фото — их пометит forwarder; «chat not found», нет прав — повтор всего позже
+        if is_file_error(err.message):
+            raise PhotoRejected(err.message) from err
+        raise
+
+beagle_forwarder = BeagleForwarder(db_pool, _send_beagle_album, interval=BEAGLE_PHOTOS_INTERVAL)
+
+async def _deliver_delayed_step(chat_id: int, day: int, step_idx: int) -> bool:
+    # send_chain глотает ошибки Telegram, кроме ChatUnavailable; не дошёл шаг — задание повторится
+    return await send_chain(chat_id, day, step_idx) == step_idx
+
+async def _user_position(user_id: int) -> Optional[Tuple[int, int]]:
+    user = await db_get_user(user_id)
+    return (user["active_day"], user["active_step"]) if user else None
+
+# Паузы между шагами истории: задания в scheduled_steps, переживают рестарт
+delayed_steps = DelayedSteps(db_pool, _deliver_delayed_step, _user_position)
+
 async def unlock_loop():
-    while True:
-        try:
-            await db_unlock_next_day_for_due_users()
-        except Exception:
-            pass
-        await asyncio.sleep(300)  # каждые 5 минут
+    # после рестарта восстанавливаем очередь из таблицы
+    for due in await db_get_unlock_due_times():
+        unlock_scheduler.schedule(due)
+    await unlock_scheduler.run()
+
+async def media_prepare():
+    """
+    Строит варианты всех локальных медиа из CONTENT (и картинки прогресса) заранее —
+    в отдельном потоке, это диск и CPU — и пишет в лог, сколько байт сэкономлено.
+    """
+    items = collect_media(CONTENT, extra=[PROGRESS_PHOTO_META])
+    report = await asyncio.get_running_loop().run_in_executor(
+        None, media_variants.build, [(item["file"], item["type"]) for item in items]
+    )
+    logging.info("media variants:\n%s", format_report(report))
+    return report
+
+async def media_warmup():
+    """
+    Заранее загружает все локальные медиа из CONTENT (и картинку прогресса) в MEDIA_STORAGE_CHAT_ID.
+    """
+    await media_prepare()
+    items = collect_media(CONTENT, extra=[PROGRESS_PHOTO_META])
+    return await warmup_media(
+        bot, media_cache, items, MEDIA_STORAGE_CHAT_ID, send_bucket,
+        open_file=lambda item: media_variants.input_file(item["file"], item["type"]),
+    )
 
 # ----------------------------
 # 8) MAIN
 # ----------------------------
-async def main():
-    await db_init()
+async def main(mode: str = RUN_MODE):
+    create_bot()
+    await db_pool.open()
+    try:
+        await db_init()
+        await media_cache.load()
+
+        background = [
+            asyncio.create_task(user_cache.run()),
+            asyncio.create_task(delayed_steps.run()),
+        ]
+        # открытие новых дней, рассылки и warm-up — по одному на бот (при шардировании — в шарде 0)
+        if SHARD_INDEX == 0:
+            background.append(asyncio.create_task(unlock_loop()))
+            background.append(asyncio.create_task(broadcast_runner.run()))
+            background.append(asyncio.create_task(letter_digester.run()))
+            background.append(asyncio.create_task(beagle_forwarder.run()))
+        if SHARD_INDEX == 0 and MEDIA_WARMUP_ON_START:
+            background.append(asyncio.create_task(media_warmup()))
+        else:
+            # варианты на диске общие, а байты в памяти у каждого процесса свои
+            background.append(asyncio.create_task(media_prepare()))
+        metrics_server = None
+        if METRICS_ENABLED and METRICS_PORT:
+            # у каждого шарда свой порт: METRICS_PORT + номер шарда
+            metrics_server = await serve_prometheus(metrics, METRICS_HOST, METRICS_PORT + SHARD_INDEX)
+        try:
+            if mode == "shard":
+                await shard_bus.serve(_feed_shard_update, SHARD_HANDLERS)
+            elif mode == "webhook":
+                await run_webhook(dp, bot, WEBHOOK_CONFIG)
+            else:
+                await dp.start_polling(bot)
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            # несброшенные шаги/режимы — в БД до закрытия соединений
+            await user_cache.close()
+            if metrics_server is not None:
+                await metrics_server.cleanup()
+    finally:
+        await db_pool.close()
+
+async def _feed_shard_update(update: Dict[str, Any]):
+    try:
+        result = await dp.feed_raw_update(bot, update)
+        if isinstance(result, TelegramMethod):
+            await dp.silent_call_request(bot, result)
+    except Exception:
+        logging.exception("shard %s: update %s failed", SHARD_INDEX, update.get("update_id"))
+
+def _on_unlocked(rows: List[Tuple[int, int, int]]):
+    for user_id, new_day, next_due in rows:
+        user_cache.update(user_id, opened_day=new_day, next_unlock_at=next_due)
+
+def _on_reload(_payload: Any):
+    try:
+        reload_content()
+    except ContentError:
+        logging.exception("shard %s: content reload failed, keeping old content", SHARD_INDEX)
+
+# служебные сообщения между шардами (ShardBus.send / broadcast)
+SHARD_HANDLERS = {
+    "unlock_due": unlock_scheduler.schedule,
+    "unlocked": _on_unlocked,
+    "broadcast_wake": lambda _payload: broadcast_runner.wake(),
+    "reload": _on_reload,
+}
+
+async def _shard_main():
+    try:
+        await main("shard")
+    finally:
+        await bot.session.close()
 
-    # запускаем цикл открытия новых дней
-    asyncio.create_task(unlock_loop())
+def _shard_process(index: int, count: int, queues: List[Any]):
+    """
+    Точка входа процесса-шарда (его запускает supervisor_main).
+    """
+    global SHARD_INDEX, shard_bus
+    logging.basicConfig(level=logging.INFO, format=f"shard-{index} %(levelname)s:%(name)s:%(message)s")
+    SHARD_INDEX = index
+    shard_bus = ShardBus(queues, index)
+    delayed_steps.shard = (index, count)
+    asyncio.run(_shard_main())
+
+async def supervisor_main(mode: str = RUN_MODE):
+    """
+    SHARDS > 1: этот процесс только принимает апдейты (polling или webhook) и раздаёт их шардам
+    по user_id, обработка и фоновые задачи — в процессах шардов. Все шарды работают с одной
+    SQLite-базой в режиме WAL.
+    """
+    create_bot()
+    # миграции — один раз здесь, а не наперегонки в каждом шарде
+    await db_pool.open()
+    try:
+        await db_init()
+    finally:
+        await db_pool.close()
+
+    bus, processes = start_shards(_shard_process, SHARDS)
+    stop = asyncio.Event()
+    stop_on_signals(stop)
+    watchdog = asyncio.create_task(watch_shards(processes, stop))
+    allowed_updates = dp.resolve_used_update_types()
+    try:
+        if mode == "webhook":
+            await serve_webhook_into(bot, bus, WEBHOOK_CONFIG, allowed_updates, stop)
+        else:
+            await poll_into(bot, bus, allowed_updates, stop)
+    finally:
+        watchdog.cancel()
+        await stop_shards(bus, processes, WEBHOOK_CONFIG.drain_timeout)
+        await bot.session.close()
+
+async def warmup_main():
+    """
+    Отдельная команда: python -m adventcalendar warmup
+    """
+    create_bot()
+    await db_pool.open()
+    try:
+        await db_init()
+        await media_cache.load()
+        print(await media_warmup())
+    finally:
+        await db_pool.close()
+        await bot.session.close()
 
-    await dp.start_polling(bot)
+def run(mode: str = RUN_MODE):
+    asyncio.run(supervisor_main(mode) if SHARDS > 1 else main(mode))
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # прежний запуск (python bot.py [polling|webhook|warmup|media|validate]); команды — в adventcalendar.py
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] == ["warmup"]:
+        asyncio.run(warmup_main())
+    elif sys.argv[1:] == ["media"]:
+        print(format_report(media_variants.build(
+            (item["file"], item["type"]) for item in collect_media(CONTENT, extra=[PROGRESS_PHOTO_META])
+        )))
+    elif sys.argv[1:] == ["validate"]:
+        # CONTENT уже загружен и проверен при импорте — если дошли сюда, ошибок нет
+        print(f"{CONTENT_PATH}: OK, дней {len(COMPILED)}, шагов {sum(len(d.steps) for d in COMPILED.values())}")
+    else:
+        run(sys.argv[1] if sys.argv[1:] in (["polling"], ["webhook"]) else RUN_MODE)
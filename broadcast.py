@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from storage import ConnectionPool
+
+if TYPE_CHECKING:
+    from fanout import FanoutDispatcher
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS broadcasts (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      text TEXT NOT NULL,
+      author_id INTEGER,
+      status TEXT NOT NULL DEFAULT 'running',  -- running | done
+      total INTEGER NOT NULL DEFAULT 0,
+      sent INTEGER NOT NULL DEFAULT 0,
+      failed INTEGER NOT NULL DEFAULT 0,
+      cursor INTEGER NOT NULL DEFAULT 0,       -- последний обработанный user_id
+      created_at INTEGER NOT NULL,
+      finished_at INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+      broadcast_id INTEGER NOT NULL,
+      user_id INTEGER NOT NULL,
+      status TEXT NOT NULL,                    -- sent | failed | blocked
+      error TEXT,
+      delivered_at INTEGER NOT NULL,
+      PRIMARY KEY (broadcast_id, user_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status, id)",
+)
+
+SendText = Callable[[int, str], Awaitable[Any]]
+OnDone = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class BroadcastRunner:
+    """
+    Рассылки как задания в таблице broadcasts.
+    Получатели читаются порциями по chunk_size (keyset по user_id), порция
+    уходит через FanoutDispatcher, затем одной транзакцией пишутся доставки,
+    счётчики и cursor. После рестарта задание продолжается с cursor:
+    повторно может уйти максимум одна незаписанная порция.
+    Заблокировавшие бота помечаются users.blocked_at и дальше пропускаются.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        dispatcher: "FanoutDispatcher",
+        send_text: SendText,
+        chunk_size: int = 200,
+        on_done: Optional[OnDone] = None,
+    ):
+        self.pool = pool
+        self.dispatcher = dispatcher
+        self.send_text = send_text
+        self.chunk_size = chunk_size
+        self.on_done = on_done
+        self._wakeup = asyncio.Event()
+        # скорость текущего прогона для ETA: (broadcast_id, время старта, обработано на старте)
+        self._run_started: Optional[Tuple[int, float, int]] = None
+
+    async def create(self, text: str, author_id: Optional[int] = None) -> int:
+        async with self.pool.transaction() as db:
+            cur = await db.execute("SELECT COUNT(*) FROM users WHERE blocked_at IS NULL")
+            (total,) = await cur.fetchone()
+            await cur.close()
+            cur = await db.execute(
+                "INSERT INTO broadcasts(text, author_id, total, created_at) VALUES(?, ?, ?, ?)",
+                (text, author_id, total, int(time.time())),
+            )
+            broadcast_id = cur.lastrowid
+            await cur.close()
+        self.wake()
+        return broadcast_id
+
+    def wake(self):
+        """
+        Проверить новые задания сейчас (их могли создать в другом процессе).
+        """
+        self._wakeup.set()
+
+    async def get(self, broadcast_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Задание по id, а без id — самое свежее. Для активного прогона добавляет rate и eta (секунды).
+        """
+        query = (
+            "SELECT id, text, author_id, status, total, sent, failed, cursor, created_at, finished_at "
+            "FROM broadcasts "
+        )
+        if broadcast_id is None:
+            query += "ORDER BY id DESC LIMIT 1"
+            params: Tuple = ()
+        else:
+            query += "WHERE id=?"
+            params = (broadcast_id,)
+        async with self.pool.acquire() as db:
+            cur = await db.execute(query, params)
+            row = await cur.fetchone()
+            await cur.close()
+        if not row:
+            return None
+
+        job = dict(zip(
+            ("id", "text", "author_id", "status", "total", "sent", "failed", "cursor", "created_at", "finished_at"),
+            row,
+        ))
+        job["rate"] = None
+        job["eta"] = None
+        if job["status"] == "running" and self._run_started and self._run_started[0] == job["id"]:
+            _, started, done_at_start = self._run_started
+            elapsed = time.monotonic() - started
+            done = job["sent"] + job["failed"] - done_at_start
+            if elapsed > 0 and done > 0:
+                job["rate"] = done / elapsed
+                remaining = max(job["total"] - job["sent"] - job["failed"], 0)
+                job["eta"] = remaining / job["rate"]
+        return job
+
+    async def _next_running(self) -> Optional[Dict[str, Any]]:
+        async with self.pool.acquire() as db:
+            cur = await db.execute(
+                "SELECT id, text, cursor, sent, failed FROM broadcasts "
+                "WHERE status='running' ORDER BY id LIMIT 1"
+            )
+            row = await cur.fetchone()
+            await cur.close()
+        if not row:
+            return None
+        return dict(zip(("id", "text", "cursor", "sent", "failed"), row))
+
+    async def _next_chunk(self, cursor: int) -> List[int]:
+        async with self.pool.acquire() as db:
+            cur = await db.execute(
+                "SELECT user_id FROM users WHERE user_id > ? AND blocked_at IS NULL "
+                "ORDER BY user_id LIMIT ?",
+                (cursor, self.chunk_size),
+            )
+            rows = await cur.fetchall()
+            await cur.close()
+        return [row[0] for row in rows]
+
+    async def _drain(self, job: Dict[str, Any]):
+        broadcast_id = job["id"]
+        text = job["text"]
+        cursor = job["cursor"]
+        self._run_started = (broadcast_id, time.monotonic(), job["sent"] + job["failed"])
+
+        async def send(user_id: int):
+            await self.send_text(user_id, text)
+
+        while True:
+            user_ids = await self._next_chunk(cursor)
+            if not user_ids:
+                break
+
+            results: List[Tuple[int, str, Optional[str], int]] = []
+
+            async def on_result(user_id: int, error: Optional[BaseException]):
+                results.append((user_id, "sent" if error is None else "failed",
+                                None if error is None else str(error)[:500], int(time.time())))
+
+            stats = await self.dispatcher.run(user_ids, send, on_result)
+            blocked = set(stats.blocked)
+            rows = [
+                (broadcast_id, user_id, "blocked" if user_id in blocked else status, error, ts)
+                for user_id, status, error, ts in results
+            ]
+            cursor = user_ids[-1]
+
+            async with self.pool.transaction() as db:
+                await db.executemany(
+                    "INSERT OR REPLACE INTO broadcast_deliveries(broadcast_id, user_id, status, error, delivered_at) "
+                    "VALUES(?, ?, ?, ?, ?)",
+                    rows,
+                )
+                await db.executemany(
+                    "UPDATE users SET blocked_at=? WHERE user_id=?",
+                    [(int(time.time()), user_id) for user_id in blocked],
+                )
+                await db.execute(
+                    "UPDATE broadcasts SET sent = sent + ?, failed = failed + ?, cursor=? WHERE id=?",
+                    (stats.sent, stats.failed, cursor, broadcast_id),
+                )
+
+        async with self.pool.transaction() as db:
+            await db.execute(
+                "UPDATE broadcasts SET status='done', finished_at=? WHERE id=?",
+                (int(time.time()), broadcast_id),
+            )
+        self._run_started = None
+
+        done = await self.get(broadcast_id)
+        logger.info("broadcast #%s finished: sent=%s failed=%s", broadcast_id, done["sent"], done["failed"])
+        if self.on_done is not None:
+            try:
+                await self.on_done(done)
+            except Exception:
+                logger.exception("broadcast #%s on_done failed", broadcast_id)
+
+    async def run(self):
+        """
+        Фоновый цикл: выполняет задания по очереди, включая недоделанные до рестарта.
+        """
+        while True:
+            self._wakeup.clear()
+            job = await self._next_running()
+            if job is None:
+                await self._wakeup.wait()
+                continue
+            try:
+                await self._drain(job)
+            except Exception:
+                logger.exception("broadcast #%s failed, retrying later", job["id"])
+                self._run_started = None
+                await asyncio.sleep(30)
@@ -0,0 +1,142 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from aiogram.types import CallbackQuery
+
+# Формат callback_data v1: "<версия><код действия><числа в base36 через '.'>[|значение]",
+# например next:4:2 -> "1n4.2", mode:1:3:soft -> "1s1.3|soft". Telegram ограничивает 64 байтами.
+VERSION = "1"
+MAX_BYTES = 64
+_ARGS_SEP = "."
+_VALUE_SEP = "|"
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# кнопки старых сообщений в чатах: префикс -> действие
+LEGACY_PREFIXES = {"next": "next", "mode": "set_mode", "glow": "glow", "aroma": "aroma", "spark": "get_spark"}
+
+Handler = Callable[[CallbackQuery, "CallbackData"], Awaitable[Any]]
+
+
+def _b36(n: int) -> str:
+    if n < 0:
+        raise ValueError(f"callback_data: отрицательное число {n}")
+    out = ""
+    while True:
+        n, rem = divmod(n, 36)
+        out = _DIGITS[rem] + out
+        if not n:
+            return out
+
+
+class CallbackData:
+    """
+    Разобранное нажатие: действие, числа (обычно день и шаг) и необязательное значение.
+    """
+    __slots__ = ("action", "args", "value")
+
+    def __init__(self, action: str, args: Tuple[int, ...] = (), value: Optional[str] = None):
+        self.action = action
+        self.args = args
+        self.value = value
+
+    @property
+    def day(self) -> Optional[int]:
+        return self.args[0] if self.args else None
+
+    @property
+    def step(self) -> Optional[int]:
+        return self.args[1] if len(self.args) > 1 else None
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CallbackData) and (self.action, self.args, self.value) == (other.action, other.args, other.value)
+
+    def __repr__(self) -> str:
+        return f"CallbackData({self.action!r}, {self.args!r}, {self.value!r})"
+
+
+class CallbackRouter:
+    """
+    Таблица callback-действий: имя (как action в days.yaml) -> однобуквенный код и хендлер.
+    Действие объявляется до сборки клавиатур (declare), хендлер привязывается позже (on/bind).
+    Роутер — фильтр единственного хендлера callback_query: разбирает data один раз и
+    кладёт результат в data["callback"], дальше dispatch — поиск по словарю.
+    """
+
+    def __init__(self):
+        self._codes: Dict[str, str] = {}
+        self._names: Dict[str, str] = {}
+        self._handlers: Dict[str, Handler] = {}
+
+    def declare(self, name: str, code: str):
+        if len(code) != 1 or code.isdigit():
+            raise ValueError(f"код действия {name!r} — один символ, не цифра: {code!r}")
+        if self._names.get(code, name) != name or self._codes.get(name, code) != code:
+            raise ValueError(f"действие {name!r} или код {code!r} уже объявлены")
+        self._codes[name] = code
+        self._names[code] = name
+
+    def bind(self, name: str, handler: Handler):
+        if name not in self._codes:
+            raise KeyError(f"действие {name!r} не объявлено")
+        self._handlers[name] = handler
+
+    def on(self, name: str) -> Callable[[Handler], Handler]:
+        def decorator(handler: Handler) -> Handler:
+            self.bind(name, handler)
+            return handler
+        return decorator
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._codes
+
+    def unbound(self):
+        return [name for name in self._codes if name not in self._handlers]
+
+    # --- кодек ---
+    def encode(self, name: str, *args: int, value: Optional[str] = None) -> str:
+        data = VERSION + self._codes[name] + _ARGS_SEP.join(_b36(int(a)) for a in args)
+        if value is not None:
+            data += _VALUE_SEP + str(value)
+        if len(data.encode("utf-8")) > MAX_BYTES:
+            raise ValueError(f"callback_data длиннее {MAX_BYTES} байт: {data!r}")
+        return data
+
+    def decode(self, data: Optional[str]) -> Optional[CallbackData]:
+        if not data:
+            return None
+        try:
+            if data[0] == VERSION:
+                name = self._names.get(data[1:2])
+                if name is None:
+                    return None
+                packed, sep, value = data[2:].partition(_VALUE_SEP)
+                args = tuple(int(a, 36) for a in packed.split(_ARGS_SEP)) if packed else ()
+                return CallbackData(name, args, value if sep else None)
+            return self._decode_legacy(data)
+        except (ValueError, IndexError):
+            return None
+
+    def _decode_legacy(self, data: str) -> Optional[CallbackData]:
+        # menu / progress / open_day / noop и next:d:s, mode:d:s:v, glow:..., aroma:..., spark:d
+        if data in self._codes:
+            return CallbackData(data)
+        prefix, _, rest = data.partition(":")
+        name = LEGACY_PREFIXES.get(prefix)
+        if name is None or name not in self._codes:
+            return None
+        parts = rest.split(":")
+        if name == "get_spark":
+            return CallbackData(name, (int(parts[0]),))
+        if name == "next":
+            return CallbackData(name, (int(parts[0]), int(parts[1])))
+        return CallbackData(name, (int(parts[0]), int(parts[1])), ":".join(parts[2:]))
+
+    # --- диспетчеризация ---
+    def __call__(self, c: CallbackQuery) -> Union[bool, Dict[str, Any]]:
+        cb = self.decode(c.data)
+        if cb is None or cb.action not in self._handlers:
+            return False
+        # метка для метрик — по действию: один хендлер может обслуживать несколько действий
+        return {"callback": cb, "handler_name": f"cb:{cb.action}"}
+
+    async def dispatch(self, c: CallbackQuery, cb: CallbackData):
+        return await self._handlers[cb.action](c, cb)
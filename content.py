@@ -0,0 +1,301 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+if TYPE_CHECKING:
+    from aiogram.types import InlineKeyboardMarkup
+
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # PyYAML без libyaml
+    from yaml import SafeLoader as _YamlLoader
+
+STEP_TYPES = {"text", "photo", "voice", "video", "video_note", "sticker"}
+MEDIA_TYPES = {"photo", "voice", "video", "video_note"}
+# действие кнопки -> сколько следующих шагов отправит его хендлер
+BUTTON_ACTIONS = {"url": 0, "menu": 0, "get_spark": 0, "next": 1, "set_mode": 2, "glow": 2, "aroma": 2}
+MAX_BUTTON_VALUE_BYTES = 48
+# Хендлеры завязаны на номера шагов: фото бигля (день 4, шаги 2-4) и письмо (день 6, шаги 2-6)
+REQUIRED_STEPS = {4: 5, 6: 7}
+# меняется при изменении формата кеша или нормализации
+CACHE_VERSION = 1
+
+
+class ContentError(Exception):
+    def __init__(self, path: str, errors: List[str]):
+        self.path = path
+        self.errors = errors
+        super().__init__(f"{path}: " + "; ".join(errors))
+
+
+@lru_cache(maxsize=None)
+def _frozen_keyboard_type():
+    # aiogram нужен только для клавиатур: загрузка и проверка контента обходятся без него
+    from aiogram.types import InlineKeyboardMarkup
+
+    class FrozenKeyboard(InlineKeyboardMarkup):
+        """
+        Клавиатура, собранная один раз при компиляции контента и общая для всех отправок.
+        """
+        model_config = {**InlineKeyboardMarkup.model_config, "frozen": True}
+
+    return FrozenKeyboard
+
+
+def freeze_markup(markup: Optional["InlineKeyboardMarkup"]) -> Optional["InlineKeyboardMarkup"]:
+    if markup is None:
+        return None
+    return _frozen_keyboard_type()(inline_keyboard=markup.inline_keyboard)
+
+
+class _Frozen:
+    __slots__ = ()
+
+    def _set(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class CompiledMedia(_Frozen):
+    """
+    Одно сообщение: тип, текст/подпись и источник медиа (file_id или локальный file).
+    """
+    __slots__ = ("type", "text", "caption", "file_id", "file", "optional")
+
+    def __init__(self, raw: Dict[str, Any]):
+        self._set(
+            type=raw.get("type", "text"),
+            text=raw.get("text"),
+            caption=raw.get("caption"),
+            file_id=raw.get("file_id") or None,
+            file=raw.get("file") or None,
+            optional=bool(raw.get("optional", False)),
+        )
+
+
+class CompiledStep(_Frozen):
+    """
+    Шаг дня, готовый к отправке: клавиатура собрана, after-сообщения разобраны,
+    next_index — следующий шаг (None для последнего).
+    """
+    __slots__ = CompiledMedia.__slots__ + ("day", "index", "reply_markup", "after", "next_index", "raw")
+
+    def __init__(
+        self,
+        day: int,
+        index: int,
+        raw: Dict[str, Any],
+        reply_markup: Optional["InlineKeyboardMarkup"],
+        total: int,
+    ):
+        media = CompiledMedia(raw)
+        self._set(**{name: getattr(media, name) for name in CompiledMedia.__slots__})
+        self._set(
+            day=day,
+            index=index,
+            reply_markup=reply_markup,
+            after=tuple(CompiledMedia(a) for a in raw.get("after") or ()),
+            next_index=index + 1 if index + 1 < total else None,
+            raw=raw,
+        )
+
+
+class CompiledDay(_Frozen):
+    __slots__ = ("number", "title", "spark_name", "code_part", "steps")
+
+    def __init__(self, number: int, raw: Dict[str, Any], steps: Tuple[CompiledStep, ...]):
+        self._set(
+            number=number,
+            title=raw.get("title", f"День {number}"),
+            spark_name=raw.get("spark_name"),
+            code_part=raw.get("code_part"),
+            steps=steps,
+        )
+
+
+BuildKeyboard = Callable[[int, int, Dict[str, Any], int], Optional["InlineKeyboardMarkup"]]
+
+
+def compile_content(content: Dict[int, Dict[str, Any]], build_kb: BuildKeyboard) -> Dict[int, CompiledDay]:
+    """
+    Превращает словарь CONTENT в неизменяемые объекты один раз при старте,
+    чтобы при отправке шага оставался только поиск по словарю и вызов API.
+    """
+    compiled: Dict[int, CompiledDay] = {}
+    for number, raw_day in content.items():
+        raw_steps = raw_day.get("steps", [])
+        total = len(raw_steps)
+        steps = tuple(
+            CompiledStep(number, index, raw, freeze_markup(build_kb(number, index, raw, total)), total)
+            for index, raw in enumerate(raw_steps)
+        )
+        compiled[number] = CompiledDay(number, raw_day, steps)
+    return compiled
+
+
+# ----------------------------
+# Загрузка из YAML
+# ----------------------------
+def _normalize(raw: Any) -> Dict[int, Dict[str, Any]]:
+    """
+    {"days": {1: {...}}} -> {1: {...}}; у блочных строк YAML (|) убираем хвостовой перевод строки.
+    """
+    if not isinstance(raw, dict) or not isinstance(raw.get("days"), dict):
+        raise ValueError("ожидается ключ верхнего уровня 'days'")
+
+    content: Dict[int, Dict[str, Any]] = {}
+    for number, day in raw["days"].items():
+        number = int(number)
+        day = dict(day or {})
+        steps = []
+        for step in day.get("steps") or []:
+            step = dict(step)
+            for key in ("text", "caption"):
+                if isinstance(step.get(key), str):
+                    step[key] = step[key].rstrip("\n")
+            if step.get("after"):
+                step["after"] = [dict(a) for a in step["after"]]
+            steps.append(step)
+        day["steps"] = steps
+        content[number] = day
+    return dict(sorted(content.items()))
+
+
+def _validate_media(where: str, item: Dict[str, Any], errors: List[str]):
+    t = item.get("type")
+    if t not in STEP_TYPES:
+        errors.append(f"{where}: неизвестный тип {t!r}")
+        return
+    if t == "text" and not item.get("text"):
+        errors.append(f"{where}: у текстового сообщения нет text")
+    if t == "sticker" and not item.get("file_id"):
+        errors.append(f"{where}: стикер отправляется только по file_id")
+    if t in MEDIA_TYPES:
+        path = item.get("file")
+        if not item.get("file_id") and not path:
+            errors.append(f"{where}: не указан источник медиа (file или file_id)")
+        elif path and not item.get("file_id") and not item.get("optional") and not os.path.isfile(path):
+            errors.append(f"{where}: файл {path} не найден")
+
+
+def validate_content(content: Dict[int, Dict[str, Any]], required_steps: Optional[Dict[int, int]] = None) -> List[str]:
+    """
+    Список ошибок контента (пустой — всё в порядке).
+    required_steps: {день: минимальное число шагов}, на которые завязаны хендлеры.
+    """
+    errors: List[str] = []
+    if not content:
+        return ["нет ни одного дня"]
+
+    expected = list(range(1, max(content) + 1))
+    if sorted(content) != expected:
+        errors.append(f"дни должны идти подряд с 1, сейчас: {sorted(content)}")
+
+    for number, day in content.items():
+        steps = day.get("steps") or []
+        if not steps:
+            errors.append(f"день {number}: нет шагов")
+            continue
+
+        total = len(steps)
+        minimum = (required_steps or {}).get(number)
+        if minimum is not None and total < minimum:
+            errors.append(f"день {number}: нужно минимум {minimum} шагов, сейчас {total}")
+
+        for index, step in enumerate(steps):
+            where = f"день {number}, шаг {index} ({step.get('id', '?')})"
+            _validate_media(where, step, errors)
+            for a_index, a in enumerate(step.get("after") or []):
+                _validate_media(f"{where}, after[{a_index}]", a, errors)
+
+            for button in step.get("buttons") or []:
+                action = button.get("action", "")
+                if not button.get("text"):
+                    errors.append(f"{where}: кнопка без text")
+                if action not in BUTTON_ACTIONS:
+                    errors.append(f"{where}: неизвестное действие кнопки {action!r}")
+                    continue
+                if action == "url" and not button.get("url"):
+                    errors.append(f"{where}: у url-кнопки нет url")
+                if action in ("set_mode", "glow", "aroma") and not button.get("value"):
+                    errors.append(f"{where}: у кнопки {action} нет value")
+                elif len(str(button.get("value", "")).encode("utf-8")) > MAX_BUTTON_VALUE_BYTES:
+                    # value едет в callback_data, а у Telegram там предел 64 байта
+                    errors.append(f"{where}: value длиннее {MAX_BUTTON_VALUE_BYTES} байт")
+                if action == "get_spark" and not (day.get("spark_name") and day.get("code_part")):
+                    errors.append(f"день {number}: кнопка get_spark, но нет spark_name/code_part")
+                if index + BUTTON_ACTIONS[action] >= total:
+                    errors.append(
+                        f"{where}: кнопка {action} ведёт на шаг {index + BUTTON_ACTIONS[action]}, "
+                        f"а в дне только {total} шагов"
+                    )
+    return errors
+
+
+def _cache_path(path: str, cache_dir: Optional[str]) -> str:
+    directory = cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)), ".content_cache")
+    return os.path.join(directory, os.path.basename(path) + ".pickle")
+
+
+def _read_cache(cache_path: str, sha: str) -> Optional[Dict[int, Dict[str, Any]]]:
+    try:
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("version") != CACHE_VERSION or cached.get("sha256") != sha:
+        return None
+    return cached["content"]
+
+
+def _write_cache(cache_path: str, sha: str, content: Dict[int, Dict[str, Any]]):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"version": CACHE_VERSION, "sha256": sha, "content": content}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path)
+    except OSError:
+        # кеш — только ускорение, без него просто будет парсинг YAML
+        pass
+
+
+def load_content(
+    path: str,
+    required_steps: Optional[Dict[int, int]] = None,
+    cache_dir: Optional[str] = None,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Читает календарь из YAML. Разобранный файл кешируется на диске (pickle, ключ — sha256
+    содержимого), поэтому при неизменном файле YAML не парсится. Проверка выполняется всегда:
+    она дешёвая и ловит, например, удалённые с диска картинки. При ошибках — ContentError.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    sha = hashlib.sha256(data).hexdigest()
+    cache_path = _cache_path(path, cache_dir)
+
+    content = _read_cache(cache_path, sha)
+    if content is None:
+        try:
+            content = _normalize(yaml.load(data, Loader=_YamlLoader))
+        except (yaml.YAMLError, ValueError, TypeError, AttributeError) as err:
+            raise ContentError(path, [f"не удалось разобрать YAML: {err}"]) from err
+        _write_cache(cache_path, sha, content)
+
+    errors = validate_content(content, required_steps)
+    if errors:
+        raise ContentError(path, errors)
+    return content
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from scheduler import Clock, Scheduler, Sleep
+from storage import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS scheduled_steps (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      chat_id INTEGER NOT NULL,
+      day INTEGER NOT NULL,
+      step INTEGER NOT NULL,
+      due_at REAL NOT NULL,            -- unix epoch, секунды
+      expect_day INTEGER,              -- отправлять, только если пользователь всё ещё на этом шаге
+      expect_step INTEGER,
+      created_at INTEGER NOT NULL,
+      attempts INTEGER NOT NULL DEFAULT 0,  -- неудачных попыток отправки
+      UNIQUE (chat_id, day, step)
+    )
+    """,
+)
+
+# пауза перед повтором неудачной отправки: RETRY_BASE * 2^(попытка - 1), не больше RETRY_MAX
+RETRY_BASE = 5.0
+RETRY_MAX = 3600.0
+# после стольких неудачных попыток (около 2,5 часа повторов) задание удаляется
+MAX_ATTEMPTS = 12
+
+
+class ChatUnavailable(Exception):
+    """
+    Чат не принимает сообщения (бот заблокирован, «chat not found»): повтор не поможет,
+    задание удаляется сразу.
+    """
+
+
+# True — шаг доставлен; False или исключение — задание остаётся и повторяется позже,
+# ChatUnavailable — задание удаляется
+Deliver = Callable[[int, int, int], Awaitable[bool]]
+GetPosition = Callable[[int], Awaitable[Optional[Tuple[int, int]]]]
+
+
+class DelayedSteps:
+    """
+    Отложенная отправка шагов: «шаг S дня D в чат C в момент T».
+    Задание пишется в scheduled_steps и кладётся в таймер (Scheduler),
+    хендлер сразу возвращается. При рестарте задания поднимаются из таблицы.
+    Одинаковое задание (chat, day, step) не создаётся дважды, пока первое не отправлено.
+    Если задан expect, шаг отправится, только если пользователь всё ещё
+    стоит на (expect_day, expect_step) — иначе задание устарело.
+    Задание удаляется, когда шаг доставлен или устарел; при ошибке отправки
+    (429, сеть) оно остаётся в таблице и повторяется с нарастающей паузой.
+    Чат, который сообщений не примет (ChatUnavailable), и MAX_ATTEMPTS неудач подряд
+    тоже удаляют задание — с записью в лог.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        deliver: Deliver,
+        get_position: GetPosition,
+        clock: Clock = time.time,
+        sleep: Sleep = asyncio.sleep,
+    ):
+        self.pool = pool
+        self.deliver = deliver
+        self.get_position = get_position
+        self.clock = clock
+        # (номер, всего): при шардировании процесс поднимает только задания своих чатов
+        self.shard: Tuple[int, int] = (0, 1)
+        self.scheduler = Scheduler(self._on_due, clock=clock, sleep=sleep)
+
+    async def load(self) -> int:
+        index, count = self.shard
+        async with self.pool.acquire() as db:
+            if count > 1:
+                cur = await db.execute(
+                    "SELECT id, due_at FROM scheduled_steps WHERE abs(chat_id) % ? = ?", (count, index)
+                )
+            else:
+                cur = await db.execute("SELECT id, due_at FROM scheduled_steps")
+            rows = await cur.fetchall()
+            await cur.close()
+        for job_id, due_at in rows:
+            self.scheduler.schedule(due_at, job_id)
+        return len(rows)
+
+    async def enqueue(
+        self,
+        chat_id: int,
+        day: int,
+        step: int,
+        delay: float,
+        expect: Optional[Tuple[int, int]] = None,
+    ) -> Optional[int]:
+        """
+        Возвращает id задания или None, если такое задание уже ждёт отправки.
+        """
+        due_at = self.clock() + max(delay, 0.0)
+        expect_day, expect_step = expect if expect else (None, None)
+        async with self.pool.transaction() as db:
+            cur = await db.execute(
+                "INSERT OR IGNORE INTO scheduled_steps(chat_id, day, step, due_at, expect_day, expect_step, created_at) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?) RETURNING id",
+                (chat_id, day, step, due_at, expect_day, expect_step, int(time.time())),
+            )
+            row = await cur.fetchone()
+            await cur.close()
+        if not row:
+            return None
+        self.scheduler.schedule(due_at, row[0])
+        return row[0]
+
+    async def _run_job(self, job: Dict[str, Any]):
+        delivered = False
+        try:
+            if job["expect_day"] is not None:
+                position = await self.get_position(job["chat_id"])
+                if position != (job["expect_day"], job["expect_step"]):
+                    delivered = True  # устарело: пользователь уже ушёл с этого шага
+            if not delivered:
+                delivered = bool(await self.deliver(job["chat_id"], job["day"], job["step"]))
+        except ChatUnavailable as err:
+            logger.warning("delayed step %s dropped, chat unavailable: %s", job, err)
+            delivered = True
+        except Exception:
+            logger.exception("delayed step %s failed", job)
+
+        attempts = job["attempts"] + 1
+        if not delivered and attempts >= MAX_ATTEMPTS:
+            logger.error("delayed step %s dropped after %s failed attempts", job, attempts)
+            delivered = True
+
+        if delivered:
+            async with self.pool.transaction() as db:
+                await db.execute("DELETE FROM scheduled_steps WHERE id=?", (job["id"],))
+            return
+
+        due_at = self.clock() + min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX)
+        async with self.pool.transaction() as db:
+            await db.execute(
+                "UPDATE scheduled_steps SET due_at=?, attempts=? WHERE id=?", (due_at, attempts, job["id"])
+            )
+        logger.warning("delayed step %s not delivered (attempt %s), retry at %.0f", job, attempts, due_at)
+        self.scheduler.schedule(due_at, job["id"])
+
+    async def _on_due(self, job_ids: List[int]):
+        rows = []
+        async with self.pool.acquire() as db:
+            for i in range(0, len(job_ids), 500):
+                chunk = job_ids[i:i + 500]
+                cur = await db.execute(
+                    "SELECT id, chat_id, day, step, expect_day, expect_step, attempts FROM scheduled_steps "
+                    f"WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                rows.extend(await cur.fetchall())
+                await cur.close()
+        keys = ("id", "chat_id", "day", "step", "expect_day", "expect_step", "attempts")
+        await asyncio.gather(*(self._run_job(dict(zip(keys, row))) for row in rows))
+
+    async def run(self):
+        await self.load()
+        await self.scheduler.run()
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Telegram: ~30 сообщений в секунду на бота, не чаще ~1 сообщения в секунду в один чат
+TELEGRAM_GLOBAL_RATE = 30.0
+TELEGRAM_PER_CHAT_INTERVAL = 1.0
+
+Clock = Callable[[], float]
+Sleep = Callable[[float], Awaitable[Any]]
+SendFn = Callable[[int], Awaitable[Any]]
+ResultFn = Callable[[int, Optional[BaseException]], Awaitable[None]]
+
+
+class TokenBucket:
+    """
+    Глобальный лимит на исходящие вызовы Bot API.
+    Один экземпляр делится между всеми рассылками, чтобы они вместе
+    не превышали лимит. pause() замораживает выдачу токенов (TelegramRetryAfter).
+    """
+
+    def __init__(
+        self,
+        rate: float = TELEGRAM_GLOBAL_RATE,
+        capacity: Optional[float] = None,
+        clock: Clock = time.monotonic,
+        sleep: Sleep = asyncio.sleep,
+    ):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, self.clock() + seconds)
+        self._tokens = 0.0
+
+    def _refill(self, now: float):
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self._tokens = min(self.capacity, self._tokens + (now - start) * self.rate)
+        self._updated = max(self._updated, now)
+
+    async def acquire(self):
+        # lock держит очередь ожидающих в порядке FIFO
+        async with self._lock:
+            while True:
+                now = self.clock()
+                if now < self._paused_until:
+                    await self.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await self.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class FanoutStats:
+    total: int = 0
+    sent: int = 0
+    retries: int = 0
+    failed: int = 0
+    blocked: List[int] = field(default_factory=list)
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return max(end - self.started_at, 1e-9)
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.duration
+
+    def __str__(self) -> str:
+        return (
+            f"sent={self.sent}/{self.total} failed={self.failed} "
+            f"(blocked={len(self.blocked)}) retries={self.retries} "
+            f"{self.rate:.1f} msg/s in {self.duration:.1f}s"
+        )
+
+
+class FanoutDispatcher:
+    """
+    Рассылка по списку чатов пулом из workers задач:
+    - общий TokenBucket на все отправки;
+    - пауза между сообщениями в один и тот же чат;
+    - TelegramRetryAfter ставит на паузу весь bucket и повторяет отправку;
+    - сетевые/5xx ошибки повторяются до max_retries, блокировки бота не повторяются.
+    """
+
+    def __init__(
+        self,
+        bucket: TokenBucket,
+        workers: int = 16,
+        per_chat_interval: float = TELEGRAM_PER_CHAT_INTERVAL,
+        max_retries: int = 3,
+        clock: Clock = time.monotonic,
+        sleep: Sleep = asyncio.sleep,
+    ):
+        self.bucket = bucket
+        self.workers = max(1, workers)
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.clock = clock
+        self.sleep = sleep
+        self._last_sent: Dict[int, float] = {}
+
+    async def _wait_chat_slot(self, chat_id: int):
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.per_chat_interval - self.clock()
+            if delay > 0:
+                await self.sleep(delay)
+
+    def _forget_old_chats(self):
+        horizon = self.clock() - self.per_chat_interval
+        for chat_id in [c for c, t in self._last_sent.items() if t < horizon]:
+            del self._last_sent[chat_id]
+
+    async def _deliver(self, chat_id: int, send: SendFn, stats: FanoutStats) -> Optional[BaseException]:
+        attempt = 0
+        while True:
+            await self._wait_chat_slot(chat_id)
+            await self.bucket.acquire()
+            self._last_sent[chat_id] = self.clock()
+            try:
+                await send(chat_id)
+                return None
+            except TelegramRetryAfter as err:
+                self.bucket.pause(err.retry_after)
+                error: BaseException = err
+            except (TelegramForbiddenError, TelegramNotFound) as err:
+                stats.blocked.append(chat_id)
+                return err
+            except (TelegramNetworkError, TelegramServerError) as err:
+                await self.sleep(min(2 ** attempt, 30))
+                error = err
+            except Exception as err:
+                return err
+
+            attempt += 1
+            if attempt > self.max_retries:
+                return error
+            stats.retries += 1
+
+    async def run(
+        self,
+        chat_ids: Iterable[int],
+        send: SendFn,
+        on_result: Optional[ResultFn] = None,
+    ) -> FanoutStats:
+        stats = FanoutStats(started_at=self.clock())
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if chat_id is None:
+                        return
+                    error = await self._deliver(chat_id, send, stats)
+                    if error is None:
+                        stats.sent += 1
+                    else:
+                        stats.failed += 1
+                    if on_result is not None:
+                        await on_result(chat_id, error)
+                finally:
+                    queue.task_done()
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            for chat_id in chat_ids:
+                stats.total += 1
+                await queue.put(chat_id)
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            stats.finished_at = self.clock()
+            self._forget_old_chats()
+
+        logger.info("fanout finished: %s", stats)
+        return stats
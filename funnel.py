@@ -0,0 +1,183 @@
+from typing import Dict, List, Mapping, Optional, Tuple
+
+# Счётчики воронки поддерживаются триггерами на users: любая запись в users (сброс
+# user_cache, открытие дня, искра, новый пользователь) меняет их в той же транзакции,
+# поэтому /funnel читает несколько сотен строк вместо полного прохода по users.
+# Метрики: opened_day (ключ — день), position (ключ — "день:шаг"), mode (ключ — режим),
+# spark (ключ — день, чья искра получена).
+
+# Дни, чьи биты sparks_mask разбирают триггеры (бит день - 1)
+SPARK_DAYS = 62
+_SPARK_DAYS_JSON = "[" + ",".join(str(day) for day in range(1, SPARK_DAYS + 1)) + "]"
+
+
+def _bump(metric: str, key: str, delta: int) -> str:
+    return (
+        f"INSERT INTO funnel_counters(metric, key, users) VALUES('{metric}', {key}, {delta}) "
+        f"ON CONFLICT(metric, key) DO UPDATE SET users = users + ({delta});"
+    )
+
+
+def _spark_diff(row: str, other: str, delta: int) -> str:
+    # дни, чей бит есть в row и нет в other
+    return (
+        f"INSERT INTO funnel_counters(metric, key, users) "
+        f"SELECT 'spark', value, {delta} FROM json_each('{_SPARK_DAYS_JSON}') "
+        f"WHERE ({row}.sparks_mask >> (value - 1)) & 1 AND NOT ({other} >> (value - 1)) & 1 "
+        f"ON CONFLICT(metric, key) DO UPDATE SET users = users + ({delta});"
+    )
+
+
+_POSITION_NEW = "NEW.active_day || ':' || NEW.active_step"
+_POSITION_OLD = "OLD.active_day || ':' || OLD.active_step"
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS funnel_counters (
+      metric TEXT NOT NULL,        -- opened_day | position | mode | spark
+      key TEXT NOT NULL,
+      users INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (metric, key)
+    ) WITHOUT ROWID
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS funnel_users_insert AFTER INSERT ON users BEGIN
+      {_bump("opened_day", "NEW.opened_day", 1)}
+      {_bump("position", _POSITION_NEW, 1)}
+      {_bump("mode", "NEW.mode", 1)}
+      {_spark_diff("NEW", "0", 1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS funnel_users_delete AFTER DELETE ON users BEGIN
+      {_bump("opened_day", "OLD.opened_day", -1)}
+      {_bump("position", _POSITION_OLD, -1)}
+      {_bump("mode", "OLD.mode", -1)}
+      {_spark_diff("OLD", "0", -1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS funnel_users_opened_day AFTER UPDATE OF opened_day ON users
+    WHEN OLD.opened_day IS NOT NEW.opened_day BEGIN
+      {_bump("opened_day", "OLD.opened_day", -1)}
+      {_bump("opened_day", "NEW.opened_day", 1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS funnel_users_position AFTER UPDATE OF active_day, active_step ON users
+    WHEN OLD.active_day IS NOT NEW.active_day OR OLD.active_step IS NOT NEW.active_step BEGIN
+      {_bump("position", _POSITION_OLD, -1)}
+      {_bump("position", _POSITION_NEW, 1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS funnel_users_mode AFTER UPDATE OF mode ON users
+    WHEN OLD.mode IS NOT NEW.mode BEGIN
+      {_bump("mode", "OLD.mode", -1)}
+      {_bump("mode", "NEW.mode", 1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS funnel_users_sparks AFTER UPDATE OF sparks_mask ON users
+    WHEN OLD.sparks_mask IS NOT NEW.sparks_mask BEGIN
+      {_spark_diff("NEW", "OLD.sparks_mask", 1)}
+      {_spark_diff("OLD", "NEW.sparks_mask", -1)}
+    END
+    """,
+)
+
+# те же счётчики, посчитанные заново по users
+_REBUILD = (
+    "SELECT 'opened_day', opened_day, COUNT(*) FROM users GROUP BY opened_day",
+    "SELECT 'position', active_day || ':' || active_step, COUNT(*) FROM users GROUP BY active_day, active_step",
+    "SELECT 'mode', mode, COUNT(*) FROM users GROUP BY mode",
+    f"SELECT 'spark', value, COUNT(*) FROM users, json_each('{_SPARK_DAYS_JSON}') "
+    f"WHERE (sparks_mask >> (value - 1)) & 1 GROUP BY value",
+)
+
+Counters = Dict[Tuple[str, str], int]
+
+
+async def read_counters(db) -> Counters:
+    cur = await db.execute("SELECT metric, key, users FROM funnel_counters WHERE users <> 0")
+    rows = await cur.fetchall()
+    await cur.close()
+    return {(metric, str(key)): users for metric, key, users in rows}
+
+
+async def count_from_scratch(db) -> Counters:
+    """
+    Полный проход по users — для проверки и перестройки, не для горячего пути.
+    Для сравнения с read_counters оба чтения делаются в одной pool.transaction().
+    """
+    counters: Counters = {}
+    for query in _REBUILD:
+        cur = await db.execute(query)
+        for metric, key, users in await cur.fetchall():
+            counters[(metric, str(key))] = users
+        await cur.close()
+    return counters
+
+
+def diff(stored: Counters, actual: Counters) -> List[Tuple[str, str, int, int]]:
+    """
+    Расхождения (метрика, ключ, в счётчиках, на самом деле); пустой список — всё сходится.
+    """
+    keys = sorted(set(stored) | set(actual))
+    return [
+        (metric, key, stored.get((metric, key), 0), actual.get((metric, key), 0))
+        for metric, key in keys
+        if stored.get((metric, key), 0) != actual.get((metric, key), 0)
+    ]
+
+
+async def rebuild(db) -> Counters:
+    """
+    Пересчитать счётчики с нуля. Вызывается только внутри pool.transaction() (BEGIN IMMEDIATE):
+    блокировка записи берётся до подсчёта, так что запись в users от другого соединения
+    ждёт COMMIT и проходит через триггеры уже поверх новых счётчиков, а не теряется между
+    подсчётом и DELETE.
+    """
+    if not db.in_transaction:
+        raise RuntimeError("funnel.rebuild() нужна открытая транзакция (pool.transaction())")
+    actual = await count_from_scratch(db)
+    await db.execute("DELETE FROM funnel_counters")
+    await db.executemany(
+        "INSERT INTO funnel_counters(metric, key, users) VALUES(?, ?, ?)",
+        [(metric, key, users) for (metric, key), users in actual.items()],
+    )
+    return actual
+
+
+def _day_sort(key: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in key.split(":") if part.lstrip("-").isdigit())
+
+
+def format_funnel(counters: Counters, titles: Optional[Mapping[int, str]] = None) -> str:
+    """
+    Текст для /funnel: открытые дни, где сейчас стоят пользователи, искры и режимы.
+    """
+    def section(metric: str) -> List[Tuple[str, int]]:
+        rows = [(key, users) for (m, key), users in counters.items() if m == metric and users]
+        return sorted(rows, key=lambda row: _day_sort(row[0]) or (0,))
+
+    total = sum(users for _, users in section("opened_day"))
+    lines = [f"Пользователей: {total}", "", "Открыт день:"]
+    for key, users in section("opened_day"):
+        title = (titles or {}).get(int(key), "")
+        lines.append(f"  {key}{' ' + title if title else ''}: {users}")
+
+    lines += ["", "Сейчас на шаге (день:шаг):"]
+    for key, users in section("position"):
+        lines.append(f"  {key}: {users}")
+
+    sparks = section("spark")
+    if sparks:
+        lines += ["", "Искры по дням:"]
+        lines += [f"  {key}: {users}" for key, users in sparks]
+
+    modes = sorted(((key, users) for (m, key), users in counters.items() if m == "mode" and users),
+                   key=lambda row: -row[1])
+    if modes:
+        lines += ["", "Режимы: " + ", ".join(f"{key} {users}" for key, users in modes)]
+    return "\n".join(lines)
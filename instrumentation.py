@@ -0,0 +1,272 @@
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates
+
+# имя -> (метка, единица, описание); секунды хранятся в микросекундах
+METRICS = {
+    "handler_seconds": ("handler", "seconds", "Время хендлера целиком"),
+    "handler_db_calls": ("handler", "calls", "Обращений к БД за апдейт"),
+    "handler_db_seconds": ("handler", "seconds", "Время в БД за апдейт"),
+    "handler_api_calls": ("handler", "calls", "Вызовов Bot API за апдейт"),
+    "handler_api_seconds": ("handler", "seconds", "Время в Bot API за апдейт"),
+    "db_seconds": ("", "seconds", "Обращение к БД (ожидание соединения + работа)"),
+    "api_seconds": ("method", "seconds", "Вызов Bot API"),
+}
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """
+    Гистограмма в духе HdrHistogram для целых неотрицательных значений:
+    корзины по степеням двойки, каждая разбита на 2^SUB_BITS линейных подкорзин,
+    поэтому относительная погрешность квантилей не больше 1/2^(SUB_BITS-1) (~1.6%),
+    запись — O(1), память — по числу занятых корзин, а не по числу значений.
+    """
+    SUB_BITS = 7
+    __slots__ = ("_counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self._counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value: int):
+        value = max(0, int(value))
+        shift = max(0, value.bit_length() - self.SUB_BITS)
+        key = (shift << self.SUB_BITS) | (value >> shift)
+        self._counts[key] = self._counts.get(key, 0) + 1
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    @classmethod
+    def _value_of(cls, key: int) -> int:
+        shift = key >> cls.SUB_BITS
+        sub = key & ((1 << cls.SUB_BITS) - 1)
+        # середина корзины
+        return (sub << shift) + ((1 << shift) >> 1)
+
+    def percentile(self, q: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for key in sorted(self._counts):
+            seen += self._counts[key]
+            if seen >= rank:
+                return min(max(self._value_of(key), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class _CallStats:
+    """
+    Обращения к БД и Bot API внутри одного апдейта (живёт в contextvar).
+    """
+    __slots__ = ("db_calls", "db_us", "api_calls", "api_us")
+
+    def __init__(self):
+        self.db_calls = 0
+        self.db_us = 0
+        self.api_calls = 0
+        self.api_us = 0
+
+
+_current: ContextVar[Optional[_CallStats]] = ContextVar("advent_call_stats", default=None)
+
+
+def _us(seconds: float) -> int:
+    return int(seconds * 1_000_000)
+
+
+class Metrics:
+    """
+    Гистограммы процесса по (метрика, метка). Заполняются middleware и хуками;
+    при выключенных метриках ничего не регистрируется и накладных расходов нет.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started_at = time.time()
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+
+    def histogram(self, name: str, label: str = "") -> Histogram:
+        key = (name, label)
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = Histogram()
+        return hist
+
+    def observe(self, name: str, label: str, value: int):
+        self.histogram(name, label).record(value)
+
+    def labels(self, name: str) -> List[str]:
+        return sorted(label for metric, label in self._histograms if metric == name)
+
+    # --- хуки ---
+    def observe_db(self, seconds: float):
+        """
+        ConnectionPool.on_release: каждое обращение к пулу.
+        """
+        us = _us(seconds)
+        self.observe("db_seconds", "", us)
+        stats = _current.get()
+        if stats is not None:
+            stats.db_calls += 1
+            stats.db_us += us
+
+    def observe_api(self, method: str, seconds: float):
+        us = _us(seconds)
+        self.observe("api_seconds", method, us)
+        stats = _current.get()
+        if stats is not None:
+            stats.api_calls += 1
+            stats.api_us += us
+
+    # --- вывод ---
+    def render_text(self, limit: int = 15) -> str:
+        """
+        Сводка для /stats: хендлеры по суммарному времени, Bot API по методам, БД.
+        """
+        def ms(us: float) -> str:
+            return f"{us / 1000:.1f}"
+
+        lines = [f"За {int(time.time() - self.started_at) // 60} мин, время в мс (p50/p99/max)", ""]
+        handlers = sorted(
+            self.labels("handler_seconds"),
+            key=lambda h: self.histogram("handler_seconds", h).total,
+            reverse=True,
+        )
+        if handlers:
+            lines.append("Хендлеры: n, p50/p99/max | БД: вызовов, мс | API: вызовов, мс (в среднем)")
+        for handler in handlers[:limit]:
+            h = self.histogram("handler_seconds", handler)
+            db_calls = self.histogram("handler_db_calls", handler)
+            db_time = self.histogram("handler_db_seconds", handler)
+            api_calls = self.histogram("handler_api_calls", handler)
+            api_time = self.histogram("handler_api_seconds", handler)
+            lines.append(
+                f"{handler}: {h.count}, {ms(h.percentile(0.5))}/{ms(h.percentile(0.99))}/{ms(h.max)}"
+                f" | БД {db_calls.mean:.1f}, {ms(db_time.mean)}"
+                f" | API {api_calls.mean:.1f}, {ms(api_time.mean)}"
+            )
+
+        methods = self.labels("api_seconds")
+        if methods:
+            lines += ["", "Bot API: n, p50/p99/max"]
+        for method in methods:
+            h = self.histogram("api_seconds", method)
+            lines.append(f"{method}: {h.count}, {ms(h.percentile(0.5))}/{ms(h.percentile(0.99))}/{ms(h.max)}")
+
+        db = self.histogram("db_seconds")
+        if db.count:
+            lines += ["", f"БД: {db.count}, {ms(db.percentile(0.5))}/{ms(db.percentile(0.99))}/{ms(db.max)}"]
+        if len(lines) == 2:
+            lines.append("Пока нет данных.")
+        return "\n".join(lines)
+
+    def render_prometheus(self, prefix: str = "advent_") -> str:
+        """
+        Текстовый формат Prometheus: каждая гистограмма — summary с квантилями.
+        """
+        out: List[str] = []
+        for name, (label_name, unit, help_text) in METRICS.items():
+            labels = self.labels(name)
+            if not labels:
+                continue
+            metric = prefix + name
+            scale = 1_000_000 if unit == "seconds" else 1
+            out.append(f"# HELP {metric} {help_text}")
+            out.append(f"# TYPE {metric} summary")
+            for label in labels:
+                h = self.histogram(name, label)
+                base = f'{label_name}="{label}"' if label_name else ""
+                for q in QUANTILES:
+                    tags = ",".join(filter(None, (base, f'quantile="{q}"')))
+                    out.append(f"{metric}{{{tags}}} {h.percentile(q) / scale:g}")
+                suffix = f"{{{base}}}" if base else ""
+                out.append(f"{metric}_sum{suffix} {h.total / scale:g}")
+                out.append(f"{metric}_count{suffix} {h.count}")
+        return "\n".join(out) + "\n"
+
+
+def _handler_name(data) -> str:
+    # общая точка входа (таблица callback-действий) сама называет конкретный хендлер
+    if data.get("handler_name"):
+        return data["handler_name"]
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    return getattr(callback, "__name__", None) or "unhandled"
+
+
+class InstrumentationMiddleware(BaseMiddleware):
+    """
+    Время каждого хендлера и число/время обращений к БД и Bot API внутри него.
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        stats = _CallStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            name = _handler_name(data)
+            m = self.metrics
+            m.observe("handler_seconds", name, _us(elapsed))
+            m.observe("handler_db_calls", name, stats.db_calls)
+            m.observe("handler_db_seconds", name, stats.db_us)
+            m.observe("handler_api_calls", name, stats.api_calls)
+            m.observe("handler_api_seconds", name, stats.api_us)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: время каждого вызова Bot API по методам.
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, GetUpdates):
+            # long polling: это время ожидания апдейтов, а не задержка API
+            return await make_request(bot, method)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            self.metrics.observe_api(getattr(method, "__api_method__", type(method).__name__), time.perf_counter() - started)
+
+
+async def serve_prometheus(metrics: Metrics, host: str, port: int) -> web.AppRunner:
+    """
+    GET /metrics на host:port. Возвращает runner — остановить через runner.cleanup().
+    """
+    async def handle(_request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
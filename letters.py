@@ -0,0 +1,151 @@
+import html
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from scheduler import run_periodic
+from storage import ConnectionPool
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS letters (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id INTEGER NOT NULL,
+      user_name TEXT NOT NULL DEFAULT '',
+      day INTEGER NOT NULL,
+      step INTEGER NOT NULL,
+      question TEXT NOT NULL DEFAULT '',
+      answer TEXT NOT NULL,
+      created_at INTEGER NOT NULL,
+      delivered_at INTEGER             -- NULL: ещё не ушло админу в дайджесте
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_letters_pending ON letters(id) WHERE delivered_at IS NULL",
+)
+
+# Telegram считает длину текста после разбора HTML, так что длина HTML-строки — оценка сверху
+MAX_MESSAGE_CHARS = 4096
+_SEPARATOR = "\n\n— — —\n\n"
+
+SendText = Callable[[str], Awaitable[Any]]
+
+
+def _format_letter(row: Dict[str, Any], budget: int) -> str:
+    """
+    Один ответ для дайджеста; ответ, который не влезает в budget, обрезается (полный — в БД и выгрузке).
+    """
+    when = datetime.fromtimestamp(row["created_at"]).strftime("%d.%m %H:%M")
+    head = (
+        f"✉️ День {row['day']} — {html.escape(row['question'] or 'Ответ')}\n"
+        f"От: {html.escape(row['user_name'] or '')} (id {row['user_id']}), {when}\n\n"
+    )
+    body = html.escape(row["answer"])
+    if len(head) + len(body) <= budget:
+        return head + body
+    # режем исходный текст, а не экранированный, чтобы не разорвать &amp;; самый длинный
+    # префикс, который после экранирования и «…» влезает в budget, — бинарным поиском
+    answer, low, high = row["answer"], 0, len(row["answer"])
+    while low < high:
+        middle = (low + high + 1) // 2
+        if len(head) + len(html.escape(answer[:middle])) + 1 <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return head + html.escape(answer[:low]) + "…"
+
+
+def header(count: int) -> str:
+    return f"📬 Ответы письма ({count})\n\n"
+
+
+# место под header(): число ответов в сообщении заранее неизвестно
+HEADER_ROOM = len(header(10 ** 6))
+
+
+def pack(rows: List[Dict[str, Any]], limit: int = MAX_MESSAGE_CHARS) -> List[Tuple[str, List[int]]]:
+    """
+    Раскладывает ответы по сообщениям не длиннее limit: [(текст, id ответов в нём)].
+    У каждого сообщения свой заголовок с числом ответов именно в нём.
+    """
+    budget = limit - HEADER_ROOM
+    messages: List[Tuple[str, List[int]]] = []
+    text, ids = "", []
+    for row in rows:
+        entry = _format_letter(row, budget)
+        if ids and len(text) + len(_SEPARATOR) + len(entry) > budget:
+            messages.append((header(len(ids)) + text, ids))
+            text, ids = "", []
+        text = text + (_SEPARATOR if ids else "") + entry
+        ids.append(row["id"])
+    if ids:
+        messages.append((header(len(ids)) + text, ids))
+    return messages
+
+
+class LetterDigester:
+    """
+    Ответы письма сначала пишутся в таблицу letters, а админу уходят дайджестом:
+    раз в interval секунд все недоставленные ответы упаковываются в сообщения до 4096 символов.
+    Сообщение помечает свои ответы доставленными только после успешной отправки, поэтому
+    при ошибке или 429 они уйдут в следующий раз (повтор с нарастающей паузой).
+    Если отправка прошла, а запись отметки — нет, ответ придёт админу повторно.
+    """
+
+    def __init__(self, pool: ConnectionPool, send_text: SendText, interval: float = 60.0, batch: int = 500):
+        self.pool = pool
+        self.send_text = send_text
+        self.interval = interval
+        self.batch = batch
+
+    async def add(self, user_id: int, user_name: str, day: int, step: int, question: str, answer: str) -> int:
+        async with self.pool.transaction() as db:
+            cur = await db.execute(
+                "INSERT INTO letters(user_id, user_name, day, step, question, answer, created_at) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                (user_id, user_name, day, step, question, answer, int(time.time())),
+            )
+            letter_id = cur.lastrowid
+            await cur.close()
+        return letter_id
+
+    async def pending(self) -> int:
+        async with self.pool.acquire() as db:
+            cur = await db.execute("SELECT COUNT(*) FROM letters WHERE delivered_at IS NULL")
+            (count,) = await cur.fetchone()
+            await cur.close()
+        return count
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        async with self.pool.acquire() as db:
+            cur = await db.execute(
+                "SELECT id, user_id, user_name, day, step, question, answer, created_at FROM letters "
+                "WHERE delivered_at IS NULL ORDER BY id LIMIT ?",
+                (self.batch,),
+            )
+            rows = await cur.fetchall()
+            await cur.close()
+        columns = ("id", "user_id", "user_name", "day", "step", "question", "answer", "created_at")
+        return [dict(zip(columns, row)) for row in rows]
+
+    async def deliver(self) -> int:
+        """
+        Отправить все недоставленные ответы. Ошибку отправки пробрасывает — повтор решает run_periodic.
+        """
+        delivered = 0
+        while True:
+            rows = await self._next_batch()
+            if not rows:
+                return delivered
+            for text, ids in pack(rows):
+                await self.send_text(text)
+                async with self.pool.transaction() as db:
+                    await db.executemany(
+                        "UPDATE letters SET delivered_at=? WHERE id=?",
+                        [(int(time.time()), letter_id) for letter_id in ids],
+                    )
+                delivered += len(ids)
+            if len(rows) < self.batch:
+                return delivered
+
+    async def run(self):
+        await run_periodic("letters digest", self.deliver, self.interval)
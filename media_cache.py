@@ -0,0 +1,97 @@
+import hashlib
+import os
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from storage import ConnectionPool
+
+if TYPE_CHECKING:
+    from aiogram.types import Message
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS media_cache (
+      path TEXT NOT NULL,
+      sha256 TEXT NOT NULL,
+      file_id TEXT NOT NULL,
+      created_at INTEGER NOT NULL,
+      PRIMARY KEY (path, sha256)
+    ) WITHOUT ROWID
+    """,
+)
+
+
+def file_id_from_message(message: Optional["Message"]) -> Optional[str]:
+    """
+    file_id медиа из отправленного сообщения (для фото — самый большой размер).
+    """
+    if message is None:
+        return None
+    if message.photo:
+        return message.photo[-1].file_id
+    for media in (message.voice, message.video, message.video_note,
+                  message.animation, message.audio, message.document, message.sticker):
+        if media is not None:
+            return media.file_id
+    return None
+
+
+class MediaCache:
+    """
+    Кеш file_id для локальных файлов: после первой загрузки Telegram
+    отдаёт file_id, дальше отправляем уже его, без повторного аплоада.
+    Ключ — путь + sha256 содержимого, поэтому изменённый файл
+    автоматически загрузится заново. Хеш пересчитывается только
+    когда меняются mtime/size файла.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self._file_ids: Dict[Tuple[str, str], str] = {}
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+
+    async def load(self):
+        async with self.pool.acquire() as db:
+            cur = await db.execute("SELECT path, sha256, file_id FROM media_cache")
+            rows = await cur.fetchall()
+            await cur.close()
+        self._file_ids = {(path, sha): file_id for path, sha, file_id in rows}
+
+    @staticmethod
+    def _key_path(path: str) -> str:
+        return os.path.normpath(path)
+
+    def content_hash(self, path: str) -> str:
+        path = self._key_path(path)
+        st = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+        sha = digest.hexdigest()
+        self._hashes[path] = (st.st_mtime_ns, st.st_size, sha)
+        return sha
+
+    def lookup(self, path: str) -> Optional[str]:
+        path = self._key_path(path)
+        return self._file_ids.get((path, self.content_hash(path)))
+
+    async def remember(self, path: str, file_id: str):
+        path = self._key_path(path)
+        sha = self.content_hash(path)
+        if self._file_ids.get((path, sha)) == file_id:
+            return
+        async with self.pool.transaction() as db:
+            # старые версии файла больше не нужны
+            await db.execute("DELETE FROM media_cache WHERE path=? AND sha256<>?", (path, sha))
+            await db.execute(
+                "INSERT OR REPLACE INTO media_cache(path, sha256, file_id, created_at) VALUES(?, ?, ?, ?)",
+                (path, sha, file_id, int(time.time())),
+            )
+        for key in [k for k in self._file_ids if k[0] == path]:
+            del self._file_ids[key]
+        self._file_ids[(path, sha)] = file_id
@@ -0,0 +1,182 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple, Union
+
+from aiogram.types import BufferedInputFile, FSInputFile
+
+try:
+    from PIL import Image
+except ImportError:  # без Pillow фото уходят как есть (с предупреждением при старте)
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Telegram всё равно пережимает фото в JPEG и хранит не больше 2560 по стороне
+# (клиенты обычно показывают 1280), а для sendPhoto принимает до 10 МБ и w + h <= 10000.
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+# меняется при изменении алгоритма: старые варианты на диске просто перестают находиться
+VARIANT_VERSION = 1
+
+
+@dataclass
+class VariantInfo:
+    path: str
+    variant: str
+    original_bytes: int
+    variant_bytes: int
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_bytes - self.variant_bytes
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode_photo(path: str, max_side: int, quality: int) -> bytes:
+    with Image.open(path) as im:
+        im.load()
+        if im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info):
+            # у JPEG нет прозрачности: кладём на белый, как Telegram показывает PNG с альфой
+            rgba = im.convert("RGBA")
+            flat = Image.new("RGB", rgba.size, (255, 255, 255))
+            flat.paste(rgba, mask=rgba.getchannel("A"))
+            im = flat
+        else:
+            im = im.convert("RGB")
+        if max(im.size) > max_side:
+            im.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        im.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+class MediaVariants:
+    """
+    Варианты локальных медиа для загрузки в Telegram и их байты в памяти.
+
+    Фото пережимаются в JPEG (сторона не больше max_side) и кладутся в cache_dir
+    под именем из sha256 исходника и настроек, поэтому строятся один раз на версию файла.
+    Если вариант не меньше исходника или Pillow не установлен, отправляется исходник.
+    Голос/видео не трогаем. Байты отправляемых файлов держатся в LRU размером до
+    memory_bytes и уходят как BufferedInputFile, без чтения с диска на каждую загрузку.
+    Методы синхронные (диск и CPU) и потокобезопасные: бот вызывает их из пула потоков.
+    """
+
+    def __init__(self, cache_dir: str, memory_bytes: int, max_side: int = 1280, quality: int = 85):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.max_side = max_side
+        self.quality = quality
+        self._variants: Dict[Tuple[str, int, int], VariantInfo] = {}
+        self._bytes: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes_total = 0
+        # build() в фоне и отправки из разных потоков делят _variants и LRU байтов
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def _variant_path(self, sha: str) -> str:
+        name = f"{sha[:32]}-v{VARIANT_VERSION}-{self.max_side}-q{self.quality}.jpg"
+        return os.path.join(self.cache_dir, name)
+
+    def _write(self, target: str, data: bytes):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, target)
+
+    def variant(self, path: str, media_type: str = "photo") -> VariantInfo:
+        """
+        Какой файл отправлять вместо path. Для фото при первом обращении строит вариант.
+        """
+        with self._lock:
+            return self._variant(os.path.normpath(path), media_type)
+
+    def _variant(self, path: str, media_type: str) -> VariantInfo:
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        info = self._variants.get(key)
+        if info is not None:
+            return info
+
+        info = VariantInfo(path, path, st.st_size, st.st_size)
+        if media_type == "photo" and self.enabled:
+            target = self._variant_path(_sha256(path))
+            try:
+                if not os.path.isfile(target):
+                    data = _encode_photo(path, self.max_side, self.quality)
+                    # пережатый файл хуже исходника по размеру — не сохраняем, шлём исходник
+                    if len(data) < st.st_size and len(data) <= PHOTO_MAX_BYTES:
+                        self._write(target, data)
+                if os.path.isfile(target):
+                    info = VariantInfo(path, target, st.st_size, os.path.getsize(target))
+            except (OSError, ValueError) as err:
+                logger.warning("media variant for %s failed: %s", path, err)
+        self._variants[key] = info
+        return info
+
+    def build(self, items: Iterable[Tuple[str, str]]) -> List[VariantInfo]:
+        """
+        Строит варианты заранее (при сборке или старте): items — пары (путь, тип медиа).
+        Отсутствующие файлы пропускаются — о них сообщит проверка контента или warm-up.
+        """
+        if not self.enabled:
+            logger.warning("Pillow не установлен: фото загружаются без пережатия (pip install -r requirements.txt)")
+        report = []
+        for path, media_type in items:
+            if os.path.isfile(path):
+                report.append(self.variant(path, media_type))
+        return report
+
+    def _read(self, path: str) -> bytes:
+        data = self._bytes.get(path)
+        if data is not None:
+            self._bytes.move_to_end(path)
+            return data
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) <= self.memory_bytes:
+            self._bytes[path] = data
+            self._bytes_total += len(data)
+            while self._bytes_total > self.memory_bytes:
+                _, evicted = self._bytes.popitem(last=False)
+                self._bytes_total -= len(evicted)
+        return data
+
+    def input_file(self, path: str, media_type: str = "photo") -> Union[BufferedInputFile, FSInputFile]:
+        """
+        Файл для загрузки: байты варианта из памяти; то, что больше всего LRU, — с диска.
+        """
+        with self._lock:
+            info = self.variant(path, media_type)
+            if info.variant_bytes > self.memory_bytes:
+                return FSInputFile(info.variant, filename=os.path.basename(info.variant))
+            return BufferedInputFile(self._read(info.variant), filename=os.path.basename(info.variant))
+
+
+def format_report(report: Iterable[VariantInfo]) -> str:
+    lines = []
+    original = variant = 0
+    for info in report:
+        original += info.original_bytes
+        variant += info.variant_bytes
+        state = "как есть" if info.variant == info.path else f"-{info.saved_bytes * 100 // max(1, info.original_bytes)}%"
+        lines.append(f"{info.path}: {info.original_bytes // 1024} КБ -> {info.variant_bytes // 1024} КБ ({state})")
+    lines.append(f"итого: {original // 1024} КБ -> {variant // 1024} КБ, сэкономлено {(original - variant) // 1024} КБ")
+    return "\n".join(lines)
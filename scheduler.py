@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+Clock = Callable[[], float]
+Sleep = Callable[[float], Awaitable[Any]]
+
+# потолок паузы между повторами в run_periodic
+MAX_BACKOFF = 600.0
+
+
+class Scheduler:
+    """
+    Таймер на min-heap: хранит моменты срабатывания (unix-время, секунды)
+    и спит ровно до ближайшего из них. Когда подходит срок, все созревшие
+    элементы одной пачкой отдаются в callback. Пока куча пуста — просто
+    ждёт нового schedule(), без опросов.
+
+    clock и sleep подменяются в тестах фейковыми часами.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[List[Any]], Awaitable[None]],
+        clock: Clock = time.time,
+        sleep: Sleep = asyncio.sleep,
+        retry_delay: float = 30.0,
+    ):
+        self.callback = callback
+        self.clock = clock
+        self.sleep = sleep
+        self.retry_delay = retry_delay
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._keys: Set[Tuple[float, Hashable]] = set()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, due: float, item: Hashable = None):
+        key = (due, item)
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        heapq.heappush(self._heap, (due, next(self._seq), item))
+        # новый срок может оказаться раньше того, до которого мы сейчас спим
+        if self._heap[0][0] == due:
+            self._wakeup.set()
+
+    def next_due(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: Optional[float] = None) -> List[Hashable]:
+        now = self.clock() if now is None else now
+        items = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, item = heapq.heappop(self._heap)
+            self._keys.discard((due, item))
+            items.append(item)
+        return items
+
+    async def _wait(self, timeout: Optional[float]):
+        self._wakeup.clear()
+        waiter = asyncio.ensure_future(self._wakeup.wait())
+        if timeout is None:
+            await waiter
+            return
+        sleeper = asyncio.ensure_future(self.sleep(timeout))
+        try:
+            await asyncio.wait({waiter, sleeper}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            sleeper.cancel()
+
+    async def run_once(self) -> bool:
+        """
+        Отработать все созревшие элементы. Возвращает True, если callback вызывался.
+        При ошибке пачка откладывается на retry_delay, чтобы не потерять её.
+        """
+        now = self.clock()
+        items = self.pop_due(now)
+        if not items:
+            return False
+        try:
+            await self.callback(items)
+        except Exception:
+            for item in items:
+                self.schedule(now + self.retry_delay, item)
+        return True
+
+    async def run(self):
+        while True:
+            await self.run_once()
+            due = self.next_due()
+            if due is None:
+                await self._wait(None)
+                continue
+            delay = due - self.clock()
+            if delay > 0:
+                await self._wait(delay)
+
+
+async def run_periodic(
+    name: str,
+    tick: Callable[[], Awaitable[int]],
+    interval: float,
+    max_backoff: float = MAX_BACKOFF,
+    sleep: Sleep = asyncio.sleep,
+):
+    """
+    Фоновая задача «раз в interval секунд вызвать tick()» с повторами при ошибках:
+    после исключения пауза растёт вдвое (до max_backoff), а если у исключения есть
+    retry_after (429 от Telegram), ждём ровно столько. tick() возвращает, сколько
+    сделано, — ненулевое пишется в лог.
+    """
+    failures = 0
+    delay = interval
+    while True:
+        await sleep(delay)
+        try:
+            done = await tick()
+        except Exception as err:
+            retry_after = getattr(err, "retry_after", None)
+            if retry_after is not None:
+                delay = max(retry_after, 1)
+                continue
+            failures += 1
+            delay = min(interval * 2 ** failures, max_backoff)
+            logger.exception("%s failed, retrying in %.0f s", name, delay)
+            continue
+        failures = 0
+        delay = interval
+        if done:
+            logger.info("%s: %s done", name, done)
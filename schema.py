@@ -0,0 +1,200 @@
+"""
+Схема БД и миграции. Модуль не тянет aiogram и сам бот: python -m adventcalendar migrate
+поднимает только его, storage и модули с таблицами.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta, tzinfo
+from typing import Any, Dict, List, Optional
+
+import funnel
+from beagle_photos import SCHEMA as BEAGLE_PHOTOS_SCHEMA
+from broadcast import SCHEMA as BROADCAST_SCHEMA
+from delayed_steps import SCHEMA as DELAYED_STEPS_SCHEMA
+from letters import SCHEMA as LETTERS_SCHEMA
+from media_cache import SCHEMA as MEDIA_CACHE_SCHEMA
+from storage import ConnectionPool
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+      user_id INTEGER PRIMARY KEY,
+      opened_day INTEGER NOT NULL DEFAULT 1,
+      active_day INTEGER NOT NULL DEFAULT 1,
+      active_step INTEGER NOT NULL DEFAULT 0,
+      mode TEXT NOT NULL DEFAULT 'mix',
+      sparks_mask INTEGER NOT NULL DEFAULT 0,  -- бит (день - 1): искра и буква этого дня получены
+      next_unlock_at INTEGER NOT NULL,  -- unix epoch, секунды
+      blocked_at INTEGER                -- пользователь заблокировал бота (рассылки его пропускают)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_users_unlock ON users(next_unlock_at, opened_day)",
+) + BROADCAST_SCHEMA + MEDIA_CACHE_SCHEMA + DELAYED_STEPS_SCHEMA + funnel.SCHEMA + LETTERS_SCHEMA + BEAGLE_PHOTOS_SCHEMA
+
+
+def next_unlock_time(tz: tzinfo, hour: int, minute: int, now: Optional[datetime] = None) -> datetime:
+    """
+    Следующий момент открытия нового дня: завтра в hour:minute по tz.
+    """
+    now = now or datetime.now(tz=tz)
+    tomorrow = (now + timedelta(days=1)).date()
+    return datetime(tomorrow.year, tomorrow.month, tomorrow.day, hour, minute, tzinfo=tz)
+
+
+@dataclass(frozen=True)
+class MigrationContext:
+    """
+    То, что миграциям нужно от бота: дни календаря (v3 ищет дни искр по названиям)
+    и ближайшее открытие дня (v1 подставляет его вместо битых дат).
+    """
+    content: Dict[int, Dict[str, Any]]
+    next_unlock_at: int
+
+
+def _split_pipe(s: str) -> List[str]:
+    s = (s or "").strip()
+    return [x for x in s.split("|") if x] if s else []
+
+
+async def _columns(db, table: str) -> Dict[str, str]:
+    cur = await db.execute(f"PRAGMA table_info({table})")
+    columns = {row[1]: row[2] for row in await cur.fetchall()}
+    await cur.close()
+    return columns
+
+
+async def _migrate_unlock_epoch(db, ctx: MigrationContext):
+    """
+    v1: next_unlock_at из ISO-строки (TEXT) -> INTEGER epoch.
+    Битые значения заменяем на ближайшее открытие, как и раньше делал цикл разблокировки.
+    """
+    columns = await _columns(db, "users")
+    if columns.get("next_unlock_at", "INTEGER").upper() != "TEXT":
+        return
+
+    await db.execute("ALTER TABLE users RENAME TO users_v0")
+    await db.execute(
+        "CREATE TABLE users ("
+        " user_id INTEGER PRIMARY KEY,"
+        " opened_day INTEGER NOT NULL DEFAULT 1,"
+        " active_day INTEGER NOT NULL DEFAULT 1,"
+        " active_step INTEGER NOT NULL DEFAULT 0,"
+        " mode TEXT NOT NULL DEFAULT 'mix',"
+        " sparks TEXT NOT NULL DEFAULT '',"
+        " codes TEXT NOT NULL DEFAULT '',"
+        " next_unlock_at INTEGER NOT NULL"
+        ")"
+    )
+    await db.execute(
+        "INSERT INTO users(user_id, opened_day, active_day, active_step, mode, sparks, codes, next_unlock_at) "
+        "SELECT user_id, opened_day, active_day, active_step, mode, sparks, codes, "
+        "COALESCE(CAST(strftime('%s', next_unlock_at) AS INTEGER), ?) FROM users_v0",
+        (ctx.next_unlock_at,),
+    )
+    await db.execute("DROP TABLE users_v0")
+
+
+async def _migrate_blocked_at(db, ctx: MigrationContext):
+    """
+    v2: users.blocked_at для пропуска заблокировавших бота в рассылках.
+    """
+    columns = await _columns(db, "users")
+    if columns and "blocked_at" not in columns:
+        await db.execute("ALTER TABLE users ADD COLUMN blocked_at INTEGER")
+
+
+async def _migrate_sparks_mask(db, ctx: MigrationContext):
+    """
+    v3: sparks/codes ("Искра №1|Искра №2", "В|А") -> битовая маска sparks_mask по дням.
+    День ищем по spark_name/code_part из content, для искр — ещё и по номеру в названии.
+    """
+    if "sparks" not in await _columns(db, "users"):
+        return
+
+    by_name: Dict[str, int] = {}
+    for day, day_data in ctx.content.items():
+        for key in ("spark_name", "code_part"):
+            if day_data.get(key):
+                by_name.setdefault(day_data[key], day)
+
+    def day_of(value: str) -> Optional[int]:
+        if value in by_name:
+            return by_name[value]
+        digits = "".join(ch for ch in value if ch.isdigit())
+        return int(digits) if digits and value.startswith("Искра") else None
+
+    await db.execute("ALTER TABLE users ADD COLUMN sparks_mask INTEGER NOT NULL DEFAULT 0")
+    cur = await db.execute("SELECT user_id, sparks, codes FROM users WHERE sparks <> '' OR codes <> ''")
+    rows = await cur.fetchall()
+    await cur.close()
+    updates = []
+    for user_id, sparks, codes in rows:
+        mask = 0
+        for value in _split_pipe(sparks) + _split_pipe(codes):
+            day = day_of(value)
+            if day:
+                mask |= 1 << (day - 1)
+        updates.append((mask, user_id))
+    await db.executemany("UPDATE users SET sparks_mask=? WHERE user_id=?", updates)
+    await db.execute("ALTER TABLE users DROP COLUMN sparks")
+    await db.execute("ALTER TABLE users DROP COLUMN codes")
+
+
+async def _migrate_funnel_counters(db, ctx: MigrationContext):
+    """
+    v4: funnel_counters и триггеры на users; для уже существующих пользователей
+    счётчики считаются один раз здесь, дальше их ведут триггеры.
+    """
+    if not await _columns(db, "users"):
+        return
+    for statement in funnel.SCHEMA:
+        await db.execute(statement)
+    await funnel.rebuild(db)
+
+
+async def _migrate_scheduled_steps_attempts(db, ctx: MigrationContext):
+    """
+    v5: scheduled_steps.attempts — счётчик неудачных отправок для повторов с паузой.
+    """
+    columns = await _columns(db, "scheduled_steps")
+    if columns and "attempts" not in columns:
+        await db.execute("ALTER TABLE scheduled_steps ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+
+async def _migrate_beagle_photos_attempts(db, ctx: MigrationContext):
+    """
+    v6: beagle_photos.attempts — отказы Telegram, после MAX_ATTEMPTS фото пропускается.
+    """
+    columns = await _columns(db, "beagle_photos")
+    if columns and "attempts" not in columns:
+        await db.execute("ALTER TABLE beagle_photos ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+
+# MIGRATIONS[i] переводит базу с user_version=i на i+1
+MIGRATIONS = (
+    _migrate_unlock_epoch,
+    _migrate_blocked_at,
+    _migrate_sparks_mask,
+    _migrate_funnel_counters,
+    _migrate_scheduled_steps_attempts,
+    _migrate_beagle_photos_attempts,
+)
+
+
+async def db_init(pool: ConnectionPool, ctx: MigrationContext) -> int:
+    """
+    Миграции от PRAGMA user_version, затем SCHEMA. Возвращает версию схемы.
+    Всё идёт одной транзакцией BEGIN IMMEDIATE (pool.transaction()): если какая-то миграция
+    упала, откатываются и уже выполненные до неё, и user_version — база остаётся как была,
+    и следующий запуск начинает с той же версии. DDL в SQLite транзакционный, так что
+    это касается и ALTER TABLE.
+    """
+    async with pool.transaction() as db:
+        cur = await db.execute("PRAGMA user_version")
+        (version,) = await cur.fetchone()
+        await cur.close()
+        for migrate in MIGRATIONS[version:]:
+            await migrate(db, ctx)
+        for statement in SCHEMA:
+            await db.execute(statement)
+        await db.execute(f"PRAGMA user_version={len(MIGRATIONS)}")
+    return len(MIGRATIONS)
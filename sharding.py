@@ -0,0 +1,257 @@
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import ClientError, ClientTimeout, web
+from aiogram import Bot
+
+from webhook import WebhookConfig
+
+logger = logging.getLogger(__name__)
+
+# сколько сообщений шард забирает из очереди за один заход в поток чтения
+_BATCH = 256
+
+OnUpdate = Callable[[Dict[str, Any]], Any]
+Handler = Callable[[Any], Any]
+
+
+def shard_of(user_id: int, count: int) -> int:
+    return abs(user_id) % count if count > 1 else 0
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    id пользователя из сырого апдейта без разбора в модели aiogram:
+    from/user события, иначе id чата. None — апдейт не привязан к пользователю.
+    """
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return None
+
+
+class ShardBus:
+    """
+    Очереди между процессами: у каждого шарда своя очередь, в неё приходят
+    апдейты его пользователей и служебные сообщения других шардов.
+    Очередь одна на шард и FIFO, поэтому апдейты одного пользователя
+    обрабатываются в порядке поступления, а служебное сообщение, отправленное
+    раньше апдейта (например, «день открыт»), применяется до него.
+    """
+
+    def __init__(self, queues: Sequence[Any], index: Optional[int] = None):
+        self.queues = list(queues)
+        self.index = index
+
+    @property
+    def count(self) -> int:
+        return len(self.queues)
+
+    def shard_of(self, user_id: int) -> int:
+        return shard_of(user_id, self.count)
+
+    def route(self, update: Dict[str, Any]) -> int:
+        shard = self.shard_of(update_user_id(update) or 0)
+        self.queues[shard].put(("update", update))
+        return shard
+
+    def send(self, shard: int, kind: str, payload: Any = None):
+        self.queues[shard].put((kind, payload))
+
+    def broadcast(self, kind: str, payload: Any = None):
+        """
+        Служебное сообщение всем шардам, кроме текущего.
+        """
+        for shard in range(self.count):
+            if shard != self.index:
+                self.send(shard, kind, payload)
+
+    def stop_all(self):
+        for q in self.queues:
+            q.put(None)
+
+    def _read_batch(self) -> List[Optional[Tuple[str, Any]]]:
+        q = self.queues[self.index]
+        items = [q.get()]
+        while len(items) < _BATCH:
+            try:
+                items.append(q.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    async def serve(self, on_update: OnUpdate, handlers: Dict[str, Handler]):
+        """
+        Цикл шарда: апдейты отдаются в on_update (каждый своей задачей),
+        служебные сообщения — в handlers[kind] по порядку. Выход — по None
+        от супервизора, после обработки уже принятых апдейтов.
+        """
+        loop = asyncio.get_running_loop()
+        in_flight = set()
+        try:
+            while True:
+                # блокирующее чтение multiprocessing.Queue — в потоке
+                items = await loop.run_in_executor(None, self._read_batch)
+                for item in items:
+                    if item is None:
+                        return
+                    kind, payload = item
+                    if kind == "update":
+                        task = asyncio.ensure_future(on_update(payload))
+                        in_flight.add(task)
+                        task.add_done_callback(in_flight.discard)
+                        continue
+                    handler = handlers.get(kind)
+                    if handler is None:
+                        logger.warning("shard %s: unknown message %r", self.index, kind)
+                        continue
+                    try:
+                        result = handler(payload)
+                        if asyncio.iscoroutine(result):
+                            await result
+                    except Exception:
+                        logger.exception("shard %s: %s handler failed", self.index, kind)
+        finally:
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+
+
+def start_shards(target: Callable[..., Any], count: int) -> Tuple[ShardBus, List[multiprocessing.Process]]:
+    """
+    Запускает count процессов target(index, count, queues). spawn, а не fork:
+    дочерний процесс не наследует открытые соединения и цикл событий родителя.
+    SIGINT/SIGTERM шарды игнорируют с самого старта (их получает вся группа процессов):
+    останавливает их супервизор через stop_shards, чтобы принятые апдейты доработались.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(count)]
+    processes = [
+        ctx.Process(target=target, args=(index, count, queues), name=f"shard-{index}", daemon=False)
+        for index in range(count)
+    ]
+    previous = {sig: signal.signal(sig, signal.SIG_IGN) for sig in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        for process in processes:
+            process.start()
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+    return ShardBus(queues), processes
+
+
+async def stop_shards(bus: ShardBus, processes: Sequence[multiprocessing.Process], timeout: float = 30.0):
+    """
+    Просит шарды доработать принятое и завершиться; не успевшие за timeout — terminate().
+    """
+    bus.stop_all()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    for process in processes:
+        await loop.run_in_executor(None, process.join, max(0.0, deadline - loop.time()))
+    for process in processes:
+        if process.is_alive():
+            logger.warning("%s did not stop in %.0fs, terminating", process.name, timeout)
+            process.terminate()
+            process.join()
+
+
+async def watch_shards(processes: Sequence[multiprocessing.Process], stop: asyncio.Event, interval: float = 5.0):
+    """
+    Шард упал — останавливаем всё: его пользователи иначе молча перестанут получать ответы.
+    """
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        for process in processes:
+            if not process.is_alive():
+                logger.error("%s exited with code %s, stopping", process.name, process.exitcode)
+                stop.set()
+                return
+
+
+async def poll_into(bot: Bot, bus: ShardBus, allowed_updates: List[str], stop: asyncio.Event, timeout: int = 30):
+    """
+    Единственный getUpdates на все шарды. Апдейты не разбираются в модели:
+    супервизору нужен только id пользователя для маршрутизации.
+    """
+    url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+    session = await bot.session.create_session()
+    offset = 0
+    backoff = 1.0
+    while not stop.is_set():
+        body = {"offset": offset, "timeout": timeout, "allowed_updates": allowed_updates}
+        try:
+            poll = asyncio.ensure_future(session.post(url, json=body, timeout=ClientTimeout(total=timeout + 10)))
+            stopped = asyncio.ensure_future(stop.wait())
+            done, _ = await asyncio.wait({poll, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            if stopped in done:
+                poll.cancel()
+                break
+            stopped.cancel()
+            async with poll.result() as response:
+                data = await response.json()
+        except (ClientError, asyncio.TimeoutError, ValueError) as err:
+            logger.warning("getUpdates failed: %s, retry in %.0fs", err, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+            continue
+
+        if not data.get("ok"):
+            retry_after = (data.get("parameters") or {}).get("retry_after")
+            logger.warning("getUpdates error: %s", data.get("description"))
+            await asyncio.sleep(retry_after or backoff)
+            backoff = min(backoff * 2, 60.0)
+            continue
+
+        backoff = 1.0
+        for update in data["result"]:
+            bus.route(update)
+            offset = update["update_id"] + 1
+
+
+async def serve_webhook_into(
+    bot: Bot,
+    bus: ShardBus,
+    config: WebhookConfig,
+    allowed_updates: List[str],
+    stop: asyncio.Event,
+):
+    """
+    Вебхук супервизора: проверяет секрет, определяет шард и сразу отвечает Telegram,
+    обработка идёт в процессе шарда.
+    """
+    async def handle(request: web.Request) -> web.Response:
+        if config.secret_token and not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), config.secret_token
+        ):
+            return web.Response(body="Unauthorized", status=401)
+        bus.route(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(config.path, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, config.host, config.port).start()
+    logger.info("sharded webhook listening on %s:%s%s", config.host, config.port, config.path)
+    try:
+        if config.webhook_url:
+            await bot.set_webhook(config.webhook_url, secret_token=config.secret_token, allowed_updates=allowed_updates)
+        await stop.wait()
+    finally:
+        if config.webhook_url and config.delete_on_stop:
+            try:
+                await bot.delete_webhook()
+            except Exception:
+                logger.exception("failed to delete webhook")
+        await runner.cleanup()
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import Sequence
+
+from storage import ConnectionPool
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeSleep:
+    """
+    Запоминает запрошенные паузы и не просыпается сама: время двигает тест.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, delay: float):
+        self.calls.append(delay)
+        await asyncio.Event().wait()
+
+
+class PoolTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    Тест с открытым ConnectionPool на временной базе, в которой уже выполнены SCHEMA.
+    """
+
+    SCHEMA: Sequence[str] = ()
+    POOL_SIZE = 1
+
+    def schema(self) -> Sequence[str]:
+        return self.SCHEMA
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "test.sqlite")
+        self.pool = ConnectionPool(self.db_path, size=self.POOL_SIZE)
+        await self.pool.open()
+        async with self.pool.transaction() as db:
+            for statement in self.schema():
+                await db.execute(statement)
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        self.tmp.cleanup()
@@ -0,0 +1,95 @@
+import unittest
+
+from beagle_photos import MAX_ATTEMPTS, REJECT_PAUSE, SCHEMA, BeagleForwarder, PhotoRejected, is_file_error
+from tests.helpers import PoolTestCase
+
+
+class ChatError(Exception):
+    pass
+
+
+class BeagleForwarderTest(PoolTestCase):
+    SCHEMA = SCHEMA
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.albums = []
+        self.calls = 0
+        self.chat_error = False
+        self.pauses = []
+        self.forwarder = BeagleForwarder(self.pool, self.send_album, sleep=self.sleep)
+
+    async def sleep(self, delay):
+        self.pauses.append(delay)
+
+    async def send_album(self, photos):
+        self.calls += 1
+        if self.chat_error:
+            raise ChatError("Bad Request: chat not found")
+        if any(file_id == "bad" for file_id, _ in photos):
+            raise PhotoRejected("Bad Request: wrong file identifier/HTTP URL specified")
+        self.albums.append([file_id for file_id, _ in photos])
+
+    async def attempts(self):
+        async with self.pool.acquire() as db:
+            cur = await db.execute("SELECT file_id, forwarded_at, attempts FROM beagle_photos ORDER BY id")
+            rows = await cur.fetchall()
+            await cur.close()
+        return rows
+
+    async def test_photos_go_out_in_albums_of_ten(self):
+        for i in range(23):
+            await self.forwarder.add(i, f"user {i}", f"photo-{i}")
+        self.assertEqual(await self.forwarder.forward(), 23)
+        self.assertEqual([len(album) for album in self.albums], [10, 10, 3])
+        self.assertEqual(await self.forwarder.pending(), 0)
+
+    async def test_rejected_photo_does_not_block_the_rest(self):
+        for i in range(5):
+            await self.forwarder.add(i, f"user {i}", "bad" if i == 2 else f"photo-{i}")
+        self.assertEqual(await self.forwarder.forward(), 4)
+        self.assertEqual(sorted(sum(self.albums, [])), ["photo-0", "photo-1", "photo-3", "photo-4"])
+        self.assertEqual(await self.forwarder.pending(), 0)
+        self.assertEqual(("bad", None, MAX_ATTEMPTS), (await self.attempts())[2])
+        # после каждого отказа — пауза перед следующей отправкой
+        self.assertEqual(self.pauses, [REJECT_PAUSE] * MAX_ATTEMPTS)
+
+        # новое фото после пропущенного уходит как обычно
+        await self.forwarder.add(9, "user 9", "photo-9")
+        self.assertEqual(await self.forwarder.forward(), 1)
+
+    async def test_chat_error_leaves_rows_untouched(self):
+        for i in range(25):
+            await self.forwarder.add(i, f"user {i}", f"photo-{i}")
+        self.chat_error = True
+        with self.assertRaises(ChatError):
+            await self.forwarder.forward()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual({(forwarded, attempts) for _, forwarded, attempts in await self.attempts()}, {(None, 0)})
+        self.assertEqual(await self.forwarder.pending(), 25)
+
+        self.chat_error = False
+        self.assertEqual(await self.forwarder.forward(), 25)
+
+
+class FileErrorTest(unittest.TestCase):
+    def test_file_errors_are_told_apart_from_chat_errors(self):
+        for description in (
+            "Bad Request: wrong file identifier/HTTP URL specified",
+            "Bad Request: wrong type of the web page content",
+            "Bad Request: PHOTO_INVALID_DIMENSIONS",
+            "Bad Request: IMAGE_PROCESS_FAILED",
+            "Bad Request: can't use file of type Video as Photo",
+        ):
+            self.assertTrue(is_file_error(description), description)
+        for description in (
+            "Bad Request: chat not found",
+            "Bad Request: not enough rights to send photos to the chat",
+            "Bad Request: group chat was upgraded to a supergroup chat",
+            "Bad Request: CHAT_WRITE_FORBIDDEN",
+        ):
+            self.assertFalse(is_file_error(description), description)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+from unittest import mock
+
+
+class ActionTablesTest(unittest.TestCase):
+    """
+    BUTTON_ACTIONS, коды callbacks и STEP_ACTIONS в bot.py сверяются при импорте.
+    """
+
+    def setUp(self):
+        import bot
+        self.bot = bot
+
+    def test_tables_agree(self):
+        self.bot._check_callback_actions()
+
+    def test_button_action_without_code(self):
+        with mock.patch.dict(self.bot.BUTTON_ACTIONS, {"hug": 0}):
+            with self.assertRaisesRegex(RuntimeError, "hug: нет кода"):
+                self.bot._check_callback_actions()
+
+    def test_stepping_action_without_step_handler(self):
+        with mock.patch.dict(self.bot.BUTTON_ACTIONS, {"get_spark": 1}):
+            with self.assertRaisesRegex(RuntimeError, "STEP_ACTIONS"):
+                self.bot._check_callback_actions()
+
+
+if __name__ == "__main__":
+    unittest.main()
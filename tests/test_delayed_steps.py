@@ -0,0 +1,100 @@
+import unittest
+
+from delayed_steps import MAX_ATTEMPTS, RETRY_BASE, SCHEMA, ChatUnavailable, DelayedSteps
+from tests.helpers import FakeClock, PoolTestCase
+
+
+class DelayedStepsTest(PoolTestCase):
+    SCHEMA = SCHEMA
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.clock = FakeClock()
+        self.position = (4, 3)
+        self.results = []
+        self.sent = []
+        self.steps = DelayedSteps(self.pool, self.deliver, self.get_position, clock=self.clock)
+
+    async def deliver(self, chat_id, day, step):
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        if result:
+            self.sent.append((chat_id, day, step))
+        return result
+
+    async def get_position(self, chat_id):
+        return self.position
+
+    async def jobs(self):
+        async with self.pool.acquire() as db:
+            cur = await db.execute("SELECT id, due_at, attempts FROM scheduled_steps")
+            rows = await cur.fetchall()
+            await cur.close()
+        return rows
+
+    async def fire(self):
+        self.clock.now = self.steps.scheduler.next_due()
+        await self.steps.scheduler.run_once()
+
+    async def test_failed_delivery_is_kept_and_retried_with_backoff(self):
+        job_id = await self.steps.enqueue(7, 4, 4, 8, expect=(4, 3))
+        self.results = [False, RuntimeError("network"), True]
+
+        await self.fire()
+        [(row_id, due_at, attempts)] = await self.jobs()
+        self.assertEqual((row_id, attempts), (job_id, 1))
+        self.assertEqual(due_at, self.clock.now + RETRY_BASE)
+
+        await self.fire()
+        [(_, due_at, attempts)] = await self.jobs()
+        self.assertEqual(attempts, 2)
+        self.assertEqual(due_at, self.clock.now + RETRY_BASE * 2)
+
+        await self.fire()
+        self.assertEqual(await self.jobs(), [])
+        self.assertEqual(self.sent, [(7, 4, 4)])
+
+    async def test_stale_job_is_dropped_without_sending(self):
+        await self.steps.enqueue(7, 4, 4, 8, expect=(4, 3))
+        self.position = (5, 0)
+        await self.fire()
+        self.assertEqual(await self.jobs(), [])
+        self.assertEqual(self.sent, [])
+
+    async def test_unavailable_chat_is_dropped_without_retry(self):
+        await self.steps.enqueue(7, 4, 4, 8, expect=(4, 3))
+        self.results = [ChatUnavailable("Forbidden: bot was blocked by the user")]
+        with self.assertLogs("delayed_steps", "WARNING") as logs:
+            await self.fire()
+        self.assertEqual(await self.jobs(), [])
+        self.assertIsNone(self.steps.scheduler.next_due())
+        self.assertIn("chat unavailable", logs.output[0])
+
+    async def test_job_is_dropped_after_max_attempts(self):
+        await self.steps.enqueue(7, 4, 4, 8, expect=(4, 3))
+        self.results = [False] * MAX_ATTEMPTS
+        for _ in range(MAX_ATTEMPTS - 1):
+            await self.fire()
+        [(_, _, attempts)] = await self.jobs()
+        self.assertEqual(attempts, MAX_ATTEMPTS - 1)
+
+        with self.assertLogs("delayed_steps", "ERROR") as logs:
+            await self.fire()
+        self.assertEqual(await self.jobs(), [])
+        self.assertIsNone(self.steps.scheduler.next_due())
+        self.assertIn(f"after {MAX_ATTEMPTS} failed attempts", logs.output[0])
+
+    async def test_pending_retry_survives_restart(self):
+        await self.steps.enqueue(7, 4, 4, 8, expect=(4, 3))
+        self.results = [False]
+        await self.fire()
+
+        restarted = DelayedSteps(self.pool, self.deliver, self.get_position, clock=self.clock)
+        self.assertEqual(await restarted.load(), 1)
+        [(_, due_at, _)] = await self.jobs()
+        self.assertEqual(restarted.scheduler.next_due(), due_at)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import funnel
+import schema
+from tests.helpers import PoolTestCase
+
+
+class RebuildTest(PoolTestCase):
+    SCHEMA = schema.SCHEMA + (
+        "INSERT INTO users(user_id, opened_day, next_unlock_at) VALUES (1, 2, 0), (2, 3, 0)",
+    )
+    POOL_SIZE = 2
+
+    async def assert_consistent(self):
+        async with self.pool.transaction() as db:
+            stored = await funnel.read_counters(db)
+            self.assertEqual(funnel.diff(stored, await funnel.count_from_scratch(db)), [])
+        return stored
+
+    async def test_write_between_count_and_rebuild_is_not_lost(self):
+        counted = asyncio.Event()
+        count_from_scratch = funnel.count_from_scratch
+
+        async def count_then_yield(db):
+            actual = await count_from_scratch(db)
+            counted.set()
+            # другое соединение пишет в users ровно между подсчётом и перезаписью счётчиков
+            await asyncio.sleep(0.1)
+            return actual
+
+        async def fix():
+            async with self.pool.transaction() as db:
+                await funnel.rebuild(db)
+
+        async def new_user():
+            await counted.wait()
+            async with self.pool.acquire() as db:
+                await db.execute("INSERT INTO users(user_id, opened_day, next_unlock_at) VALUES (3, 3, 0)")
+
+        with mock.patch.object(funnel, "count_from_scratch", count_then_yield):
+            await asyncio.gather(fix(), new_user())
+
+        stored = await self.assert_consistent()
+        self.assertEqual(stored[("opened_day", "3")], 2)
+
+    async def test_rebuild_requires_transaction(self):
+        async with self.pool.acquire() as db:
+            with self.assertRaises(RuntimeError):
+                await funnel.rebuild(db)
+
+
+if __name__ == "__main__":
+    unittest.main()
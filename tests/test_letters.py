@@ -0,0 +1,30 @@
+import unittest
+
+from letters import MAX_MESSAGE_CHARS, pack
+
+
+def letter(letter_id: int, answer: str):
+    return {
+        "id": letter_id, "user_id": letter_id, "user_name": "Аня <a>", "day": 6, "step": 3,
+        "question": "Что хочешь оставить позади?", "answer": answer, "created_at": 0,
+    }
+
+
+class PackTest(unittest.TestCase):
+    def test_each_message_counts_its_own_answers(self):
+        messages = pack([letter(i, "а" * 1500) for i in range(7)])
+        self.assertEqual([ids for _, ids in messages], [[0, 1], [2, 3], [4, 5], [6]])
+        for text, ids in messages:
+            self.assertTrue(text.startswith(f"📬 Ответы письма ({len(ids)})\n\n"))
+            self.assertLessEqual(len(text), MAX_MESSAGE_CHARS)
+
+    def test_oversized_answer_is_truncated_to_fit(self):
+        [(text, ids)] = pack([letter(1, "&" * 10000)])
+        self.assertEqual(ids, [1])
+        self.assertLessEqual(len(text), MAX_MESSAGE_CHARS)
+        self.assertTrue(text.endswith("&amp;…"))
+        self.assertIn("Аня &lt;a&gt;", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import asyncio
+import unittest
+
+import schema
+from scheduler import Scheduler, run_periodic
+from tests.helpers import FakeClock, FakeSleep, PoolTestCase
+
+
+class SchedulerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sleep = FakeSleep()
+        self.batches = []
+        self.failures = 0
+        self.scheduler = Scheduler(self.callback, clock=self.clock, sleep=self.sleep, retry_delay=30)
+
+    async def callback(self, items):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("boom")
+        self.batches.append(items)
+
+    async def settle(self):
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    async def test_due_items_are_delivered_in_one_batch(self):
+        self.scheduler.schedule(1010, "a")
+        self.scheduler.schedule(1005, "b")
+        self.scheduler.schedule(1020, "c")
+
+        self.assertFalse(await self.scheduler.run_once())
+        self.clock.now = 1015
+        self.assertTrue(await self.scheduler.run_once())
+        self.assertEqual(self.batches, [["b", "a"]])
+        self.assertEqual(self.scheduler.next_due(), 1020)
+
+    async def test_equal_due_and_item_are_scheduled_once(self):
+        self.scheduler.schedule(1010, "a")
+        self.scheduler.schedule(1010, "a")
+        self.scheduler.schedule(1010, "b")
+        self.assertEqual(len(self.scheduler), 2)
+
+        self.clock.now = 1010
+        await self.scheduler.run_once()
+        self.assertEqual(self.batches, [["a", "b"]])
+        # после срабатывания тот же ключ можно поставить снова
+        self.scheduler.schedule(1010, "a")
+        self.assertEqual(len(self.scheduler), 1)
+
+    async def test_earlier_schedule_wakes_sleeping_run(self):
+        self.scheduler.schedule(2000, "late")
+        task = asyncio.create_task(self.scheduler.run())
+        try:
+            await self.settle()
+            self.assertEqual(self.sleep.calls, [1000])
+
+            self.scheduler.schedule(1000, "now")
+            await self.settle()
+            self.assertEqual(self.batches, [["now"]])
+            # снова спит, уже до оставшегося срока
+            self.assertEqual(self.sleep.calls, [1000, 1000])
+        finally:
+            task.cancel()
+
+    async def test_empty_heap_waits_for_schedule(self):
+        task = asyncio.create_task(self.scheduler.run())
+        try:
+            await self.settle()
+            self.assertEqual(self.sleep.calls, [])
+            self.scheduler.schedule(self.clock.now, "x")
+            await self.settle()
+            self.assertEqual(self.batches, [["x"]])
+        finally:
+            task.cancel()
+
+    async def test_failed_batch_is_retried_after_retry_delay(self):
+        self.failures = 1
+        self.scheduler.schedule(1000, "a")
+        self.scheduler.schedule(1000, "b")
+
+        self.assertTrue(await self.scheduler.run_once())
+        self.assertEqual(self.batches, [])
+        self.assertEqual(self.scheduler.next_due(), 1030)
+
+        self.clock.now = 1029
+        self.assertFalse(await self.scheduler.run_once())
+        self.clock.now = 1030
+        self.assertTrue(await self.scheduler.run_once())
+        self.assertEqual(self.batches, [["a", "b"]])
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"retry after {retry_after}")
+        self.retry_after = retry_after
+
+
+class RunPeriodicTest(unittest.IsolatedAsyncioTestCase):
+    async def test_backoff_and_retry_after(self):
+        outcomes = [RuntimeError("down"), RuntimeError("down"), RetryAfter(7), 3, 0]
+        sleeps = []
+
+        async def tick():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        async def sleep(delay):
+            sleeps.append(delay)
+            if not outcomes:
+                raise asyncio.CancelledError
+
+        with self.assertRaises(asyncio.CancelledError):
+            await run_periodic("test", tick, interval=10, max_backoff=30, sleep=sleep)
+        # 10 -> ошибка: 20 -> ошибка: 30 (потолок) -> 429: ровно retry_after -> успех: снова interval
+        self.assertEqual(sleeps, [10, 20, 30, 7, 10, 10])
+
+
+class UnlockRestartTest(PoolTestCase):
+    """
+    После рестарта unlock_loop восстанавливает кучу сроков из users (db_get_unlock_due_times).
+    """
+
+    def schema(self):
+        return schema.SCHEMA
+
+    async def asyncSetUp(self):
+        import bot
+
+        await super().asyncSetUp()
+        self.bot = bot
+        self.saved = bot.db_pool, bot.unlock_scheduler
+        bot.db_pool = self.pool
+        async with self.pool.transaction() as db:
+            await db.executemany(
+                "INSERT INTO users(user_id, opened_day, next_unlock_at) VALUES(?, ?, ?)",
+                [(1, 1, 5000), (2, 3, 5000), (3, 2, 4000), (4, 7, 3000)],
+            )
+
+    async def asyncTearDown(self):
+        self.bot.db_pool, self.bot.unlock_scheduler = self.saved
+        await super().asyncTearDown()
+
+    async def test_unlock_loop_rebuilds_heap_from_db(self):
+        clock, sleep, fired = FakeClock(1000), FakeSleep(), []
+
+        async def on_due(items):
+            fired.append(items)
+
+        self.bot.unlock_scheduler = Scheduler(on_due, clock=clock, sleep=sleep)
+        task = asyncio.create_task(self.bot.unlock_loop())
+        try:
+            # SELECT идёт в потоке aiosqlite: ждём, пока run() уснёт до ближайшего срока
+            async def asleep():
+                while not sleep.calls:
+                    await asyncio.sleep(0.01)
+
+            await asyncio.wait_for(asleep(), 5)
+            # сроки без повторов; пользователь, открывший последний день, не ждёт разблокировки
+            self.assertEqual(len(self.bot.unlock_scheduler), 2)
+            self.assertEqual(self.bot.unlock_scheduler.next_due(), 4000)
+            self.assertEqual(sleep.calls, [3000])
+            clock.now = 5000
+            self.assertTrue(await self.bot.unlock_scheduler.run_once())
+            self.assertEqual(fired, [[None, None]])
+        finally:
+            task.cancel()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+
+import schema
+from tests.helpers import PoolTestCase
+
+# users до v1: next_unlock_at строкой, искры и буквы — через "|"
+USERS_V0 = (
+    "CREATE TABLE users ("
+    " user_id INTEGER PRIMARY KEY,"
+    " opened_day INTEGER NOT NULL DEFAULT 1,"
+    " active_day INTEGER NOT NULL DEFAULT 1,"
+    " active_step INTEGER NOT NULL DEFAULT 0,"
+    " mode TEXT NOT NULL DEFAULT 'mix',"
+    " sparks TEXT NOT NULL DEFAULT '',"
+    " codes TEXT NOT NULL DEFAULT '',"
+    " next_unlock_at TEXT NOT NULL"
+    ")"
+)
+CONTEXT = schema.MigrationContext(content={2: {"code_part": "А"}}, next_unlock_at=1_700_000_000)
+
+
+class MigrationsTest(PoolTestCase):
+    SCHEMA = (
+        USERS_V0,
+        "INSERT INTO users VALUES (1, 3, 3, 0, 'mix', 'Искра №1', 'А', '2025-12-02T10:00:00+03:00')",
+        "INSERT INTO users VALUES (2, 1, 1, 0, 'mix', '', '', 'not a date')",
+    )
+
+    async def snapshot(self):
+        async with self.pool.acquire() as db:
+            cur = await db.execute("PRAGMA user_version")
+            (version,) = await cur.fetchone()
+            cur = await db.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
+            tables = [row[0] for row in await cur.fetchall()]
+            cur = await db.execute("PRAGMA table_info(users)")
+            columns = [(row[1], row[2]) for row in await cur.fetchall()]
+            cur = await db.execute("SELECT * FROM users ORDER BY user_id")
+            rows = await cur.fetchall()
+            await cur.close()
+        return version, tables, columns, rows
+
+    async def test_migrates_v0_to_latest(self):
+        self.assertEqual(await schema.db_init(self.pool, CONTEXT), len(schema.MIGRATIONS))
+        async with self.pool.acquire() as db:
+            cur = await db.execute("SELECT user_id, sparks_mask, next_unlock_at FROM users ORDER BY user_id")
+            rows = await cur.fetchall()
+            await cur.close()
+        self.assertEqual(rows, [(1, 0b11, 1764658800), (2, 0, CONTEXT.next_unlock_at)])
+
+    async def test_failed_migration_changes_nothing(self):
+        before = await self.snapshot()
+
+        async def broken(db, ctx):
+            # v3 успевает переписать данные и удалить колонки, и только потом падает
+            await schema._migrate_sparks_mask(db, ctx)
+            raise RuntimeError("boom")
+
+        migrations = schema.MIGRATIONS[:2] + (broken,) + schema.MIGRATIONS[3:]
+        with mock.patch.object(schema, "MIGRATIONS", migrations):
+            with self.assertRaises(RuntimeError):
+                await schema.db_init(self.pool, CONTEXT)
+
+        # откатились и v1/v2 до сбоя, и user_version
+        self.assertEqual(await self.snapshot(), before)
+        # после исправления миграции повтор идёт с той же версии 0
+        self.assertEqual(await schema.db_init(self.pool, CONTEXT), len(schema.MIGRATIONS))
+
+
+if __name__ == "__main__":
+    unittest.main()
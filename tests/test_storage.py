@@ -0,0 +1,51 @@
+import sqlite3
+import unittest
+
+from tests.helpers import PoolTestCase
+
+
+class TransactionTest(PoolTestCase):
+    SCHEMA = ("CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)",)
+    POOL_SIZE = 2
+
+    async def count(self, db) -> int:
+        cur = await db.execute("SELECT COUNT(*) FROM items")
+        (count,) = await cur.fetchone()
+        await cur.close()
+        return count
+
+    async def test_reads_are_inside_the_transaction(self):
+        async with self.pool.transaction() as db:
+            self.assertEqual(await self.count(db), 0)
+            self.assertTrue(db.in_transaction)
+            # другое соединение не может вклиниться между чтением и записью
+            async with self.pool.acquire() as other:
+                await other.execute("PRAGMA busy_timeout=50")
+                with self.assertRaises(sqlite3.OperationalError):
+                    await other.execute("INSERT INTO items(value) VALUES(1)")
+                await other.execute("PRAGMA busy_timeout=5000")
+            await db.execute("INSERT INTO items(value) VALUES(2)")
+        async with self.pool.acquire() as db:
+            self.assertEqual(await self.count(db), 1)
+
+    async def test_error_rolls_back_everything(self):
+        with self.assertRaises(RuntimeError):
+            async with self.pool.transaction() as db:
+                await db.execute("INSERT INTO items(value) VALUES(1)")
+                await db.execute("CREATE TABLE other (id INTEGER)")
+                raise RuntimeError("boom")
+        async with self.pool.acquire() as db:
+            self.assertEqual(await self.count(db), 0)
+            self.assertFalse(db.in_transaction)
+            cur = await db.execute("SELECT name FROM sqlite_master WHERE name='other'")
+            self.assertIsNone(await cur.fetchone())
+            await cur.close()
+
+    async def test_statements_outside_transaction_autocommit(self):
+        async with self.pool.acquire() as db:
+            await db.execute("INSERT INTO items(value) VALUES(1)")
+            self.assertFalse(db.in_transaction)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import asyncio
+import unittest
+
+from storage import ConnectionPool
+from tests.helpers import PoolTestCase
+from user_cache import UserStateCache
+
+USERS = """
+CREATE TABLE users (
+  user_id INTEGER PRIMARY KEY,
+  opened_day INTEGER NOT NULL DEFAULT 1,
+  active_day INTEGER NOT NULL DEFAULT 1,
+  active_step INTEGER NOT NULL DEFAULT 0,
+  mode TEXT NOT NULL DEFAULT 'mix'
+)
+"""
+
+
+class UserStateCacheTest(PoolTestCase):
+    SCHEMA = (USERS,)
+    POOL_SIZE = 2
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        async with self.pool.transaction() as db:
+            await db.executemany("INSERT INTO users(user_id) VALUES(?)", [(1,), (2,), (3,)])
+        self.cache = UserStateCache(self.pool, self.load, capacity=2)
+
+    async def load(self, user_id):
+        return (await self.rows()).get(user_id)
+
+    async def rows(self):
+        async with self.pool.acquire() as db:
+            cur = await db.execute("SELECT user_id, opened_day, active_day, active_step, mode FROM users")
+            rows = await cur.fetchall()
+            await cur.close()
+        keys = ("user_id", "opened_day", "active_day", "active_step", "mode")
+        return {row[0]: dict(zip(keys, row)) for row in rows}
+
+    async def test_pending_write_survives_eviction(self):
+        await self.cache.get(1)
+        self.cache.set_progress(1, 2, 3)
+        await self.cache.get(2)
+        await self.cache.get(3)
+        self.assertNotIn(1, self.cache._entries)
+
+        user = await self.cache.get(1)
+        self.assertEqual((user["active_day"], user["active_step"]), (2, 3))
+        await self.cache.flush()
+        self.assertEqual((await self.rows())[1]["active_step"], 3)
+
+    async def test_miss_overlays_pending_on_db_row(self):
+        self.cache.set_mode(2, "calm")
+        user = await self.cache.get(2)
+        self.assertEqual(user["mode"], "calm")
+        self.assertEqual((await self.rows())[2]["mode"], "mix")
+
+    async def test_failed_flush_requeues_without_clobbering_newer_values(self):
+        self.cache.set_progress(1, 1, 1)
+        self.cache.set_mode(1, "calm")
+        pool, self.cache.pool = self.cache.pool, ConnectionPool(self.pool.path)  # не открыт — flush упадёт
+        with self.assertRaises(RuntimeError):
+            await self.cache.flush()
+        self.cache.set_progress(1, 1, 2)
+        self.cache.pool = pool
+
+        self.assertEqual(await self.cache.flush(), 1)
+        row = (await self.rows())[1]
+        self.assertEqual((row["active_step"], row["mode"]), (2, "calm"))
+        self.assertEqual(self.cache.pending, 0)
+
+    async def test_close_flushes_everything(self):
+        for user_id in (1, 2, 3):
+            self.cache.set_progress(user_id, 4, user_id)
+        await self.cache.close()
+        self.assertEqual(self.cache.pending, 0)
+        self.assertEqual({u: r["active_step"] for u, r in (await self.rows()).items()}, {1: 1, 2: 2, 3: 3})
+
+    async def test_update_during_miss_is_not_lost(self):
+        # SELECT вернул снимок до разблокировки, а update() пришёл, пока он шёл
+        loaded = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_load(user_id):
+            row = await self.load(user_id)
+            loaded.set()
+            await release.wait()
+            return row
+
+        self.cache.loader = slow_load
+        task = asyncio.create_task(self.cache.get(1))
+        await loaded.wait()
+        self.cache.update(1, opened_day=2)
+        release.set()
+        self.assertEqual((await task)["opened_day"], 2)
+        self.assertEqual(self.cache._loading, {})
+
+    async def test_update_for_uncached_user_is_not_kept(self):
+        self.cache.update(3, opened_day=5)
+        self.assertEqual(self.cache._loading, {})
+        self.assertEqual((await self.cache.get(3))["opened_day"], 1)
+
+    async def test_concurrent_misses_share_one_entry(self):
+        first, second = await asyncio.gather(self.cache.get(1), self.cache.get(1))
+        self.assertIs(first, second)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from storage import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+Loader = Callable[[int], Awaitable[Optional[Dict[str, Any]]]]
+
+# поля, запись которых откладывается и сливается пачкой
+WRITE_BEHIND_FIELDS = ("active_day", "active_step", "mode")
+
+
+class UserStateCache:
+    """
+    Кеш состояния пользователей в памяти (LRU на capacity записей).
+
+    Чтение: из памяти, промах — один SELECT через loader.
+    Запись active_day/active_step/mode: сразу в память, в БД — пачкой
+    раз в flush_interval секунд одной транзакцией (и при close()).
+    Остальные поля (искры, opened_day) пишутся в БД сразу, а в кеш
+    попадают через update().
+
+    Гарантии:
+    - несброшенные изменения живут в _pending отдельно от LRU, поэтому
+      вытеснение записи из кеша их не теряет, а промах кеша накладывает
+      их поверх прочитанного из БД;
+    - если сброс не удался, изменения возвращаются в _pending (более
+      новые значения важнее) и уйдут при следующей попытке;
+    - update() во время промаха (SELECT уже идёт и может вернуть снимок до
+      этой записи) запоминается и накладывается на прочитанное, поэтому
+      устаревшие opened_day/next_unlock_at не застревают в кеше;
+    - при штатной остановке close() сбрасывает всё;
+    - при падении процесса теряется не больше flush_interval последних
+      переходов по шагам/выбора режима: пользователь окажется на шаге
+      чуть раньше и просто нажмёт «Дальше» или откроет день заново.
+    """
+
+    def __init__(self, pool: ConnectionPool, loader: Loader, capacity: int = 10000, flush_interval: float = 0.2):
+        self.pool = pool
+        self.loader = loader
+        self.capacity = max(1, capacity)
+        self.flush_interval = flush_interval
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        # промахи, чей SELECT ещё идёт: поля из update(), пришедшие за это время
+        self._loading: Dict[int, Dict[str, Any]] = {}
+        self._flush_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(user_id)
+            return entry
+
+        self.misses += 1
+        updated = self._loading.setdefault(user_id, {})
+        try:
+            entry = await self.loader(user_id)
+        finally:
+            if self._loading.get(user_id) is updated:
+                del self._loading[user_id]
+        if entry is None:
+            return None
+        # пока читали, запись могла появиться (параллельный get) — берём её
+        existing = self._entries.get(user_id)
+        if existing is not None:
+            return existing
+        entry.update(updated)
+        entry.update(self._pending.get(user_id, {}))
+        self._entries[user_id] = entry
+        self._evict()
+        return entry
+
+    def _evict(self):
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def _write(self, user_id: int, fields: Dict[str, Any]):
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry.update(fields)
+        self._pending.setdefault(user_id, {}).update(fields)
+
+    def set_progress(self, user_id: int, active_day: int, active_step: int):
+        self._write(user_id, {"active_day": active_day, "active_step": active_step})
+
+    def set_mode(self, user_id: int, mode: str):
+        self._write(user_id, {"mode": mode})
+
+    def update(self, user_id: int, **fields: Any):
+        """
+        Отразить в кеше поля, которые уже записаны в БД другим путём.
+        """
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry.update(fields)
+        elif user_id in self._loading:
+            self._loading[user_id].update(fields)
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            rows = [
+                (fields.get("active_day"), fields.get("active_step"), fields.get("mode"), user_id)
+                for user_id, fields in batch.items()
+            ]
+            try:
+                async with self.pool.transaction() as db:
+                    await db.executemany(
+                        "UPDATE users SET "
+                        "active_day=COALESCE(?, active_day), "
+                        "active_step=COALESCE(?, active_step), "
+                        "mode=COALESCE(?, mode) "
+                        "WHERE user_id=?",
+                        rows,
+                    )
+            except BaseException:
+                for user_id, fields in batch.items():
+                    self._pending[user_id] = {**fields, **self._pending.get(user_id, {})}
+                raise
+            return len(rows)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("user cache flush failed, will retry")
+
+    async def close(self):
+        await self.flush()
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery, Message
+
+logger = logging.getLogger(__name__)
+
+
+class _Slot:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class KeyedLocks:
+    """
+    asyncio.Lock на ключ (user_id). Замок существует, только пока его кто-то держит
+    или ждёт: последний вышедший удаляет его, поэтому память растёт с числом
+    пользователей, у которых прямо сейчас есть апдейты в работе, а не со всей базой.
+    asyncio.Lock будит ожидающих по очереди (FIFO) — апдейты одного ключа идут по порядку.
+    """
+
+    def __init__(self):
+        self._slots: Dict[Hashable, _Slot] = {}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _Slot()
+        slot.users += 1
+        try:
+            async with slot.lock:
+                yield
+        finally:
+            slot.users -= 1
+            if slot.users == 0:
+                del self._slots[key]
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Outer-middleware для message/callback_query: апдейты одного пользователя
+    обрабатываются строго по очереди, разные пользователи — параллельно.
+    Одинаковое нажатие (тот же пользователь, сообщение и callback_data), пока
+    первое ещё в очереди или в работе, не выполняется второй раз — только гасим «часики».
+    """
+
+    def __init__(self, locks: KeyedLocks = None):
+        self.locks = locks or KeyedLocks()
+        self._in_flight: Set[Tuple[int, int, str]] = set()
+        self.collapsed = 0
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, "from_user", None)
+        if user is None:
+            return await handler(event, data)
+
+        tap = None
+        if isinstance(event, CallbackQuery):
+            message_id = event.message.message_id if isinstance(event.message, Message) else 0
+            tap = (user.id, message_id, event.data or "")
+            if tap in self._in_flight:
+                self.collapsed += 1
+                try:
+                    await event.answer()
+                except TelegramAPIError as err:
+                    logger.debug("duplicate tap answer failed: %s", err)
+                return None
+            self._in_flight.add(tap)
+
+        try:
+            async with self.locks.hold(user.id):
+                return await handler(event, data)
+        finally:
+            if tap is not None:
+                self._in_flight.discard(tap)
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import FSInputFile, InputFile
+
+from fanout import TokenBucket, TELEGRAM_PER_CHAT_INTERVAL
+from media_cache import MediaCache, file_id_from_message
+
+logger = logging.getLogger(__name__)
+
+# метод Bot API для загрузки каждого типа медиа
+_UPLOADERS = {
+    "photo": "send_photo",
+    "voice": "send_voice",
+    "video": "send_video",
+    "video_note": "send_video_note",
+}
+
+
+def collect_media(content: Dict[int, Dict[str, Any]], extra: Iterable[Dict[str, Any]] = ()) -> List[Dict[str, Any]]:
+    """
+    Все локальные файлы ("file" без "file_id") из шагов, их after-списков и extra.
+    Каждый путь — один раз.
+    """
+    items: List[Dict[str, Any]] = []
+    seen = set()
+
+    def add(item: Dict[str, Any]):
+        path = item.get("file")
+        if not path or item.get("file_id") or item.get("type") not in _UPLOADERS:
+            return
+        key = os.path.normpath(path)
+        if key in seen:
+            return
+        seen.add(key)
+        items.append(item)
+
+    for day in content.values():
+        for step in day.get("steps", []):
+            add(step)
+            for a in step.get("after") or []:
+                add(a)
+    for item in extra:
+        add(item)
+    return items
+
+
+@dataclass
+class WarmupReport:
+    uploaded: List[str] = field(default_factory=list)
+    cached: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        return (
+            f"uploaded={len(self.uploaded)} cached={len(self.cached)} "
+            f"missing={len(self.missing)} failed={len(self.failed)}"
+        )
+
+
+async def warmup_media(
+    bot: Bot,
+    cache: MediaCache,
+    items: Iterable[Dict[str, Any]],
+    storage_chat_id: int,
+    bucket: TokenBucket,
+    concurrency: int = 4,
+    open_file: Optional[Callable[[Dict[str, Any]], InputFile]] = None,
+) -> WarmupReport:
+    """
+    Загружает в storage_chat_id каждый ещё не закешированный файл и сохраняет file_id,
+    чтобы первый реальный пользователь уже получал медиа по file_id.
+    Отправки ограничены общим bucket и лимитом на один чат.
+    open_file(item) — что загружать (например, пережатый вариант), по умолчанию сам файл.
+    """
+    report = WarmupReport()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    chat_bucket = TokenBucket(rate=1 / TELEGRAM_PER_CHAT_INTERVAL, capacity=1)
+
+    async def upload(item: Dict[str, Any]):
+        path = item["file"]
+        if not os.path.isfile(path):
+            report.missing.append(path)
+            return
+        if cache.lookup(path):
+            report.cached.append(path)
+            return
+
+        send = getattr(bot, _UPLOADERS[item["type"]])
+        async with semaphore:
+            for _ in range(3):
+                await chat_bucket.acquire()
+                await bucket.acquire()
+                try:
+                    message = await send(storage_chat_id, open_file(item) if open_file else FSInputFile(path))
+                except TelegramRetryAfter as err:
+                    bucket.pause(err.retry_after)
+                    chat_bucket.pause(err.retry_after)
+                    continue
+                except Exception:
+                    logger.exception("warmup: failed to upload %s", path)
+                    break
+
+                file_id: Optional[str] = file_id_from_message(message)
+                if file_id:
+                    await cache.remember(path, file_id)
+                    report.uploaded.append(path)
+                    return
+                break
+        report.failed.append(path)
+
+    await asyncio.gather(*(upload(item) for item in items))
+    if report.missing:
+        logger.warning("warmup: missing files: %s", ", ".join(report.missing))
+    logger.info("warmup finished: %s", report)
+    return report
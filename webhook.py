@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import signal
+from dataclasses import dataclass
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WebhookConfig:
+    """
+    url — публичный адрес (https://bot.example.com), на который Telegram шлёт апдейты;
+    без него сервер просто слушает host:port (локальная проверка, вебхук настроен снаружи).
+    secret_token приходит от Telegram в заголовке X-Telegram-Bot-Api-Secret-Token,
+    запросы без него отклоняются с 401.
+    """
+    url: Optional[str] = None
+    path: str = "/webhook"
+    host: str = "0.0.0.0"
+    port: int = 8080
+    secret_token: Optional[str] = None
+    drain_timeout: float = 30.0
+    delete_on_stop: bool = True
+
+    @property
+    def webhook_url(self) -> Optional[str]:
+        if not self.url:
+            return None
+        return self.url.rstrip("/") + self.path
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """
+    Отвечает Telegram сразу, а апдейт обрабатывает в фоне; drain() дожидается
+    всех ещё не обработанных апдейтов перед остановкой.
+    """
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Возвращает число апдейтов, которые не успели обработаться за timeout.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._background_feed_update_tasks:
+            left = deadline - loop.time()
+            if left <= 0:
+                break
+            await asyncio.wait(set(self._background_feed_update_tasks), timeout=left)
+        return self.in_flight
+
+
+def stop_on_signals(stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # Windows / не главный поток
+            pass
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, config: WebhookConfig, stop: Optional[asyncio.Event] = None):
+    """
+    Поднимает aiohttp-сервер с обработчиком вебхука и работает до stop (по умолчанию — SIGINT/SIGTERM).
+    При старте регистрирует вебхук в Telegram (если задан url), при остановке:
+    снимает вебхук, дожидается обработки принятых апдейтов, закрывает сервер и сессию бота.
+
+    Локальная проверка — отправить записанный апдейт:
+        curl -X POST localhost:8080/webhook -H 'Content-Type: application/json' \\
+             -H 'X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>' -d @update.json
+    """
+    if stop is None:
+        stop = asyncio.Event()
+        stop_on_signals(stop)
+    if not config.secret_token:
+        logger.warning("WEBHOOK_SECRET is not set: webhook accepts updates from anyone who knows the path")
+
+    app = web.Application()
+    handler = DrainingRequestHandler(dispatcher=dp, bot=bot, secret_token=config.secret_token)
+    handler.register(app, path=config.path)
+    # startup/shutdown-хуки диспетчера, как при polling
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.host, config.port)
+    await site.start()
+    logger.info("webhook server listening on %s:%s%s", config.host, config.port, config.path)
+
+    try:
+        if config.webhook_url:
+            await bot.set_webhook(
+                config.webhook_url,
+                secret_token=config.secret_token,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info("webhook set to %s", config.webhook_url)
+        await stop.wait()
+    finally:
+        if config.webhook_url and config.delete_on_stop:
+            try:
+                await bot.delete_webhook()
+            except Exception:
+                logger.exception("failed to delete webhook")
+        left = await handler.drain(config.drain_timeout)
+        if left:
+            logger.warning("webhook stopped with %d updates still in flight", left)
+        await runner.cleanup()